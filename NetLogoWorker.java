@@ -0,0 +1,140 @@
+/*
+Copyright (c) 2014 High-Performance Computing and GIS (HPCGIS) Laboratory. All rights reserved.
+Use of this source code is governed by a BSD-style license that can be found in the LICENSE file.
+Authors and contributors: Eric Shook (eshook@kent.edu)
+*/
+
+import java.io.BufferedReader;
+import java.io.File;
+import java.io.InputStreamReader;
+import java.io.PrintStream;
+import java.security.Permission;
+
+/*
+A long-lived NetLogo worker (see WorkerRunner in workflow.py and runabm-worker.sh)
+
+It reads one task per line on stdin, runs it with headless NetLogo in this JVM and replies on stdout.
+Each task holds the same arguments as runabm.sh, separated by tabs:
+    <task id> <netlogo model file> <experiment file> <experiment name> <number of threads>
+and the reply is:
+    <task id> <return code>
+The output of NetLogo goes to stderr so it does not mix with the replies.
+Running many tasks in one JVM saves the JVM startup and JIT warm-up of every task.
+*/
+public class NetLogoWorker {
+
+    // headless.Main calls System.exit when it fails, this turns the exit into an exception
+    static class ExitTrappedException extends SecurityException {
+        final int status;
+        ExitTrappedException(int status) {
+            super("exit "+status);
+            this.status=status;
+        }
+    }
+
+    static class TrapExit extends SecurityManager {
+        volatile boolean trapping=false;
+        public void checkExit(int status) {
+            if(trapping)
+                throw new ExitTrappedException(status);
+        }
+        public void checkPermission(Permission perm) {}
+        public void checkPermission(Permission perm,Object context) {}
+    }
+
+    // Build a compact sub-experiment (<experiment.json>:<start>:<end>) with parse-experiment.py
+    // as runabm.sh does, returns the experiment file and the names of its experiments
+    static String[] materialize(String bindir,String expfile,String experiment,String dir) throws Exception {
+        ProcessBuilder pb=new ProcessBuilder(bindir+"/parse-experiment.py","--materialize="+expfile,"--name="+experiment,"-d",dir);
+        pb.redirectError(ProcessBuilder.Redirect.INHERIT);
+        Process p=pb.start();
+        BufferedReader in=new BufferedReader(new InputStreamReader(p.getInputStream()));
+        StringBuilder names=new StringBuilder();
+        String line;
+        while((line=in.readLine())!=null)
+            names.append(line).append(" ");
+        if(p.waitFor()!=0)
+            throw new Exception("Problem building sub-experiment : "+expfile);
+        return new String[] {dir+"/subexperiment."+experiment+".xml",names.toString().trim()};
+    }
+
+    static int runtask(TrapExit trap,String bindir,String jobid,String pid,String[] fields) throws Exception {
+        if(jobid.equals(""))
+            jobid=fields[0]; // The task id, as runabm.sh does without a PBS job id
+        String model=fields[1];
+        String expfile=fields[2];
+        String experiment=fields[3];
+        String threads=fields[4];
+        String experiments=experiment;
+        if(!new File(model).exists()) {
+            System.err.println("Netlogo model not found : "+model);
+            return 2;
+        }
+        if(expfile.matches(".*\\.json:[0-9]+:[0-9]+")) {
+            String dir=System.getenv("TMPDIR")!=null ? System.getenv("TMPDIR") : ".";
+            String[] built=materialize(bindir,expfile,experiment,dir);
+            expfile=built[0];
+            experiments=built[1];
+        }
+        if(!new File(expfile).exists()) {
+            System.err.println("Experiment file not found : "+expfile);
+            return 3;
+        }
+        for(String name : experiments.split("\\s+")) {
+            // As in runabm.sh the table is renamed once complete
+            File table=new File("out.table."+model+"."+name+"."+jobid+".csv");
+            File parttable=new File(table.getPath()+".part"+pid);
+            String[] args={"--model",model,"--experiment",name,"--setup-file",expfile,"--threads",threads,
+                           "--table",parttable.getPath()};
+            System.err.println("Running experiment : "+name);
+            long start=System.currentTimeMillis();
+            trap.trapping=true;
+            try {
+                org.nlogo.headless.Main.main(args);
+            } catch(ExitTrappedException e) {
+                if(e.status!=0) {
+                    parttable.delete();
+                    return 100;
+                }
+            } finally {
+                trap.trapping=false;
+            }
+            if(!parttable.renameTo(table))
+                throw new Exception("Cannot rename "+parttable+" to "+table);
+            System.err.println("Finished experiment : "+name+" in "+(System.currentTimeMillis()-start)/1000.0+" s");
+        }
+        return 0;
+    }
+
+    public static void main(String[] argv) throws Exception {
+        // Usage: NetLogoWorker <NAWS bin directory> <job id, or "" to use the task ids> <pid of the worker>
+        String bindir=argv.length>0 ? argv[0] : ".";
+        String jobid=argv.length>1 ? argv[1] : "";
+        String pid=argv.length>2 ? argv[2] : "0";
+
+        PrintStream replies=System.out;
+        System.setOut(System.err);
+        TrapExit trap=new TrapExit();
+        System.setSecurityManager(trap);
+
+        BufferedReader in=new BufferedReader(new InputStreamReader(System.in));
+        String line;
+        while((line=in.readLine())!=null) {
+            String[] fields=line.split("\t");
+            int returncode;
+            if(fields.length!=5) {
+                System.err.println(" [ ERROR ] Bad task : "+line);
+                returncode=1;
+            } else {
+                try {
+                    returncode=runtask(trap,bindir,jobid,pid,fields);
+                } catch(Exception e) {
+                    System.err.println(" [ ERROR ] Task "+fields[0]+" failed : "+e);
+                    returncode=1;
+                }
+            }
+            replies.println(fields[0]+"\t"+returncode);
+            replies.flush();
+        }
+    }
+}
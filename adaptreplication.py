@@ -0,0 +1,284 @@
+#!/usr/bin/python
+"""
+Copyright (c) 2014 High-Performance Computing and GIS (HPCGIS) Laboratory. All rights reserved.
+Use of this source code is governed by a BSD-style license that can be found in the LICENSE file.
+Authors and contributors: Eric Shook (eshook@kent.edu)
+"""
+
+import os
+import sys,getopt
+import json
+import glob
+import math
+import time
+import itertools
+
+import parseexperiment
+import generatetasks
+import collectresults
+
+'''
+Adaptive replication runs the repetitions of an experiment in rounds instead of all at once :
+ 1. the first round runs a batch of repetitions of every combination (fewer when the result cache holds some)
+ 2. when a round has finished, the task of the next stage of the shared queue (adapt-replication.py) collects its
+    tables into the result store and computes, for every combination, the confidence interval of the mean of the
+    chosen metrics (their value at the last step of each run)
+ 3. a combination whose intervals are all narrower than the target width has converged, the others get another
+    batch of repetitions (up to the repetitions of the experiment) in a new round added to the queue
+so the simulations the fixed repetitions would spend on converged combinations go to the noisy ones.
+The jobs pull the new rounds from the queue while they run and wait for the deciding task instead of stopping.
+The rounds are recorded in adaptive.json in the workflow directory and adapt-replication.py --report compares
+the simulations run (and their core-hours, from the accounting of the jobs) with the fixed-repetition plan.
+From Python, runexperiment.py starts the first round with newstate, roundneeds and roundtasks
+'''
+
+# The p quantile (p above 0.5) of Student's t distribution with dof degrees of freedom, found by bisection
+# on its distribution function (the density integrated with Simpson's rule)
+tquantiles={}
+def tquantile(p,dof):
+    if (p,dof) not in tquantiles:
+        scale=math.exp(math.lgamma((dof+1)/2.0)-math.lgamma(dof/2.0))/math.sqrt(dof*math.pi)
+        density=lambda x: scale*(1+x*x/dof)**(-(dof+1)/2.0)
+        def distribution(x):
+            steps=200
+            h=x/steps
+            return 0.5+h/3*(density(0)+density(x)+sum((4 if i%2 else 2)*density(i*h) for i in xrange(1,steps)))
+        low,high=0.0,1.0
+        while distribution(high)<p:
+            low,high=high,high*2
+        for i in xrange(50):
+            middle=(low+high)/2
+            if distribution(middle)<p:
+                low=middle
+            else:
+                high=middle
+        tquantiles[(p,dof)]=(low+high)/2
+    return tquantiles[(p,dof)]
+
+# The mean of values and the width of its confidence interval (None for less than 2 values)
+def interval(values,confidence):
+    n=len(values)
+    mean=sum(values)/float(n)
+    if n<2:
+        return mean,None
+    variance=sum((value-mean)**2 for value in values)/(n-1)
+    return mean,2*tquantile(0.5+confidence/2,n-1)*math.sqrt(variance/n)
+
+# Whether the runs of a combination (the metrics each run ended with) have converged : the interval of every metric
+# is at most width wide (a fraction of the absolute mean when relative). Metrics that are not numbers in every run
+# (strings, lists, missing) do not decide, and the runs have not converged when no metric does
+def converged(runs,width,relative,confidence):
+    if len(runs)<2:
+        return False
+    tested=0
+    for values in zip(*runs):
+        if not all(isinstance(value,(int,long,float)) and not isinstance(value,bool) and value==value for value in values):
+            continue
+        mean,actualwidth=interval(values,confidence)
+        if actualwidth>(width*abs(mean) if relative else width):
+            return False
+        tested+=1
+    return tested>0
+
+# The state of an adaptive sweep (written to adaptive.json in the workflow directory) : what the rounds run and
+# how, the convergence settings and the rounds so far
+def newstate(spec,netlogomodel,execdir,storefile,queuefile,runabmexec,adaptexec,numberofthreads,numberofsubexperiments,compact,
+             metrics,width,relative,confidence,batch,secondspersimulation=None,partition="tile",costmodel=None,seed=None):
+    return {"spec":spec,"model":netlogomodel,"execdir":execdir,"store":storefile,"queue":queuefile,"runabm":runabmexec,"adapt":adaptexec,
+            "threads":numberofthreads,"subexperiments":numberofsubexperiments,"compact":compact,"partition":partition,"costmodel":costmodel,
+            "seed":seed,"metrics":metrics,"width":width,"relative":relative,
+            "confidence":confidence,"batch":batch,"secondspersimulation":secondspersimulation,"round":0,"fixedplan":None,"rounds":[],"tasks":{},
+            "storedruns":0,"pending":None,"started":time.time(),"finished":False}
+
+def readstate(workflowdir):
+    with open(workflowdir+"/adaptive.json",'r') as f:
+        return json.load(f)
+
+def writestate(workflowdir,state):
+    with open(workflowdir+"/adaptive.json.part",'w') as f:
+        json.dump(state,f,indent=1,sort_keys=True)
+    os.rename(workflowdir+"/adaptive.json.part",workflowdir+"/adaptive.json")
+
+# Collect the tables of the sweep in the exec directory into the result store (unless collect is False) and read
+# the outcome of every run of the experiment (see collectresults.runoutcomes). The metrics are all those of the store unless chosen
+# The tables left in the exec directory by earlier sweeps (which may have the names of this one) are not collected
+def collectoutcomes(state,collect=True):
+    spec=state["spec"]
+    db=collectresults.openstore(state["store"])
+    try:
+        if collectresults.describestore(db,state["model"],spec)==None:
+            print " [ ERROR ] The store",state["store"],"holds the results of another model or experiment"
+            sys.exit(1)
+        if collect:
+            print "Collecting tables from",state["execdir"],"into",state["store"]
+            tablefiles=[tablefile for tablefile in collectresults.findtables(state["execdir"],state["model"]) if os.path.getmtime(tablefile)>=state["started"]]
+            collectresults.collecttables(db,tablefiles,state["model"],spec["name"],spec["repetitions"])
+        metrics=state["metrics"] or [name for position,name,kind in collectresults.readcolumns(db) if kind=="metric"]
+        return collectresults.runoutcomes(db,spec,metrics)
+    finally:
+        db.close()
+
+# The repetitions each combination needs in the next round (by its value indices, only those that need some):
+# a batch for those that have not converged, up to the repetitions of the experiment. A combination needs at least
+# a batch (and 2 runs) before it may converge. Returns the needs, the number of combinations that converged and
+# the number that reached the repetitions without converging
+def roundneeds(state,outcomes):
+    spec=state["spec"]
+    sizes=[len(valueset) for valueset in parseexperiment.experimentvaluesets(spec)]
+    needs={}
+    convergedcount=0
+    capped=0
+    for combination in itertools.product(*[xrange(size) for size in sizes]):
+        runs=outcomes.get(combination,{}).values()
+        if len(runs)>=state["batch"] and converged(runs,state["width"],state["relative"],state["confidence"]):
+            convergedcount+=1
+        elif len(runs)>=spec["repetitions"]:
+            capped+=1
+        else:
+            needs[combination]=min(state["batch"],spec["repetitions"]-len(runs))
+    if state["fixedplan"]==None:
+        # The fixed-repetition plan runs every repetition the result cache does not hold
+        state["fixedplan"]=sum(max(spec["repetitions"]-len(outcomes.get(combination,{})),0)
+                               for combination in itertools.product(*[xrange(size) for size in sizes]))
+    return needs,convergedcount,capped
+
+# Create the sub-experiments of the next round of the sweep (the repetitions in needs) in workflowdir and their tasks,
+# in the stage of the round, followed by the task that decides the round after it (see adapt)
+# The round gets at most numberofsubexperiments sub-experiments, and its runs are seeded after those of the rounds before it
+def roundtasks(workflowdir,state,needs,numberofsubexperiments):
+    state["round"]+=1
+    stage=state["round"]
+    simulations=sum(needs.values())
+    print "Round %i : %i simulations"%(stage,simulations)
+    specs=parseexperiment.partexperiments(state["spec"],needs,0,"_"+str(state["storedruns"])+"_"+str(stage))
+    seed=None
+    if state["seed"]!=None:
+        seed=state["seed"]+sum(previous["simulations"] for previous in state["rounds"])
+    # The combinations left in a late round are scattered, so its parts are many and small and are bundled
+    subexperiments=parseexperiment.createpartsubexperiments(specs,min(numberofsubexperiments,simulations),workflowdir,state["compact"],False,
+                                                            state["partition"],state["costmodel"],seed)
+    tasks=generatetasks.createtasks(subexperiments,state["runabm"],state["model"],state["threads"],stage)
+    for task,subexperiment in zip(tasks,subexperiments):
+        state["tasks"][task["id"]]=subexperiment["simulations"]
+    state["rounds"].append({"round":stage,"simulations":simulations,"combinations":len(needs),"tasks":len(tasks)})
+
+    # The deciding task runs once every task of the round has finished (it is in the next stage) and adds the next
+    # round to the queue, so jobs wait for it (spawns) rather than stop
+    adapttask={"id":str(stage+1)+".0","stage":stage+1,"experiment":state["spec"]["name"]+"_adapt","program":state["adapt"],"args":["-d",workflowdir],
+               "cores":1,"memory":256,"cost":0.0,"spawns":True}
+    return tasks+[adapttask]
+
+# Decide the round after the one that has just finished : collect its results and add the next round to the queue,
+# or finish the sweep when every combination has converged or reached the repetitions of the experiment
+def adapt(workflowdir):
+    state=readstate(workflowdir)
+    if state["finished"]:
+        print "The adaptive sweep has finished"
+        return
+
+    # A round decided by an attempt that stopped before its tasks were surely in the queue is added again
+    # (tasks already there are kept) rather than decided again under the next round number
+    if state["pending"]!=None:
+        print "Round %i was decided by an earlier attempt, adding its tasks to the queue"%state["round"]
+        generatetasks.appendqueue(state["queue"],state["pending"])
+        state["pending"]=None
+        writestate(workflowdir,state)
+        return
+
+    outcomes=collectoutcomes(state)
+    needs,convergedcount,capped=roundneeds(state,outcomes)
+    if len(state["rounds"])>0:
+        state["rounds"][-1].update({"converged":convergedcount,"capped":capped})
+    print "After round %i : %i combinations converged, %i reached %i repetitions without converging, %i need more repetitions"%(
+        state["round"],convergedcount,capped,state["spec"]["repetitions"],len(needs))
+
+    if len(needs)==0:
+        state["finished"]=True
+        writestate(workflowdir,state)
+        report(workflowdir,state)
+        return
+
+    # The round and its tasks are recorded before they are added to the queue, so an attempt that stops in between
+    # leaves them for the next attempt (see above)
+    state["pending"]=roundtasks(workflowdir,state,needs,state["subexperiments"])
+    writestate(workflowdir,state)
+    generatetasks.appendqueue(state["queue"],state["pending"])
+    state["pending"]=None
+    writestate(workflowdir,state)
+
+# The core seconds a simulation takes, from the accounting of the jobs (see workflow.Accounting) for the tasks of the
+# sweep that finished, or as configured or calibrated. None when unknown
+def coresecondspersimulation(state):
+    coreseconds=0.0
+    simulations=0
+    for accountingfile in glob.glob(state["queue"]+".*.accounting.jsonl"):
+        with open(accountingfile,'r') as f:
+            for line in f:
+                try:
+                    entry=json.loads(line)
+                except ValueError:
+                    continue # A record being written
+                if entry["id"] not in state["tasks"]:
+                    continue
+                coreseconds+=entry["wall"]*entry["cores"]
+                if entry["result"]=="done":
+                    simulations+=state["tasks"][entry["id"]]
+    if simulations>0:
+        return coreseconds/simulations
+    return state["secondspersimulation"]
+
+# Print the rounds of the sweep and the simulations (and core-hours) saved against the fixed-repetition plan
+def report(workflowdir,state=None):
+    if state==None:
+        state=readstate(workflowdir)
+    print "Adaptive replication of",state["spec"]["name"],":","finished" if state["finished"] else "running"
+    for entry in state["rounds"]:
+        line=" round %i : %i simulations of %i combinations in %i tasks"%(entry["round"],entry["simulations"],entry["combinations"],entry["tasks"])
+        if "converged" in entry:
+            line+=", then %i combinations converged and %i reached the repetitions"%(entry["converged"],entry["capped"])
+        print line
+    run=sum(entry["simulations"] for entry in state["rounds"])
+    fixedplan=state["fixedplan"] or 0
+    print "Simulations : %i run, %i in the fixed-repetition plan (%i repetitions)"%(run,fixedplan,state["spec"]["repetitions"])
+    if fixedplan>0:
+        print "Saved : %i simulations (%.1f %%)"%(fixedplan-run,100.0*(fixedplan-run)/fixedplan)
+    seconds=coresecondspersimulation(state)
+    if seconds!=None:
+        print "Core-hours : %.2f run, %.2f in the fixed-repetition plan, %.2f saved (%.1f core seconds per simulation)"%(
+            run*seconds/3600,fixedplan*seconds/3600,(fixedplan-run)*seconds/3600,seconds)
+
+# Main program code
+def main():
+
+    usage="adapt-replication.py -d <workflow directory> [--report]"
+
+    try:
+        opts,args=getopt.getopt(sys.argv[1:],"d:",["dir=","report"])
+    except getopt.GetoptError:
+        print usage
+        sys.exit(1)
+
+    workflowdir=""
+    reportonly=False # Print the savings of the sweep so far instead of deciding a round
+    for opt, arg in opts:
+        if opt in ("-d", "--dir"):
+            workflowdir=arg
+        if opt=="--report":
+            reportonly=True
+
+    if workflowdir=="":
+        print " [ ERROR ] No workflow directory"
+        print usage
+        sys.exit(1)
+    if not os.path.exists(workflowdir+"/adaptive.json"):
+        print " [ ERROR ] No adaptive sweep in",workflowdir,"(see runexperiment.py --adaptive)"
+        sys.exit(1)
+
+    if reportonly:
+        report(workflowdir)
+    else:
+        adapt(workflowdir)
+
+# Run main
+if __name__=="__main__":
+   main()
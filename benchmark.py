@@ -0,0 +1,309 @@
+#!/usr/bin/python
+"""
+Copyright (c) 2014 High-Performance Computing and GIS (HPCGIS) Laboratory. All rights reserved.
+Use of this source code is governed by a BSD-style license that can be found in the LICENSE file.
+Authors and contributors: Eric Shook (eshook@kent.edu)
+"""
+
+import os
+import json
+import time
+import shutil
+import tempfile
+import subprocess
+import multiprocessing
+import parseexperiment
+import generatetasks
+import sys,getopt
+
+'''
+The benchmark script measures the overhead of NAWS itself, without NetLogo or a cluster:
+ 1. it writes a synthetic model whose experiment has a given number of parameter combinations
+ 2. it times parsing and decomposing the experiment and generating its tasks (in this process, with the
+    parseexperiment and generatetasks modules) and running them with workflow.py, with fake-netlogo.py standing in
+    for runabm.sh (sleeping or burning CPU for a cost drawn per parameter combination)
+ 3. it reports the partition quality : redundant simulations and imbalance, as predicted by parse-experiment.py
+    and as measured from the accounting of workflow.py, and the throughput and idle time of the scheduler
+ 4. it compares the results with an earlier run (--baseline) so regressions in the hot paths are caught
+'''
+
+bindir=os.path.dirname(os.path.abspath(__file__))
+stages=["parse","tasks","workflow"]
+
+# The sizes of the value sets of an experiment with the given number of parameter combinations
+# The prime factors are grouped into value sets of at most 10 values (a larger prime is a value set of its own)
+def valuesetsizes(combinations):
+    factors=[]
+    factor=2
+    while combinations>1:
+        while combinations%factor==0:
+            factors.append(factor)
+            combinations//=factor
+        factor+=1
+        if factor*factor>combinations and combinations>1:
+            factors.append(combinations)
+            break
+    sizes=[]
+    for factor in sorted(factors,reverse=True):
+        for i in range(len(sizes)):
+            if sizes[i]*factor<=10:
+                sizes[i]*=factor
+                break
+        else:
+            sizes.append(factor)
+    return sizes
+
+# Write a model with the experiment "benchmark" of the given number of parameter combinations
+# The first value set is stepped and the others enumerated, so both kinds are exercised
+def writemodel(modelfile,combinations,repetitions):
+    sizes=valuesetsizes(combinations)
+    with open(modelfile,'w') as f:
+        f.write("to setup\n  clear-all\n  reset-ticks\nend\n\nto go\n  tick\nend\n")
+        f.write("@#$#@#$#@\n"*7)
+        f.write("<experiments>\n")
+        f.write('  <experiment name="benchmark" repetitions="%i" runMetricsEveryStep="false">\n'%repetitions)
+        f.write("    <setup>setup</setup>\n    <go>go</go>\n    <timeLimit steps=\"1\"/>\n    <metric>ticks</metric>\n")
+        for i,size in enumerate(sizes):
+            if i==0:
+                f.write('    <steppedValueSet variable="x%i" first="0" step="1" last="%i"/>\n'%(i,size-1))
+                continue
+            f.write('    <enumeratedValueSet variable="x%i">\n'%i)
+            for value in range(size):
+                f.write('      <value value="%i"/>\n'%value)
+            f.write("    </enumeratedValueSet>\n")
+        f.write("  </experiment>\n</experiments>\n")
+        f.write("@#$#@#$#@\n")
+    return sizes
+
+# Run a stage, with its output in logfile. Returns its return code and elapsed time
+def runstage(command,logfile,cwd=None):
+    with open(logfile,'w') as log:
+        start=time.time()
+        status=subprocess.call(command,stdout=log,stderr=subprocess.STDOUT,cwd=cwd)
+        elapsed=time.time()-start
+    return status,elapsed
+
+# Time a stage called in this process, with what it prints in logfile. Returns its result and elapsed time
+def timestage(logfile,function,*args):
+    stdout=sys.stdout
+    with open(logfile,'w') as log:
+        sys.stdout=log
+        try:
+            start=time.time()
+            result=function(*args)
+            elapsed=time.time()-start
+        finally:
+            sys.stdout=stdout
+    return result,elapsed
+
+# The scheduling statistics of a workflow run from its accounting file (see workflow.py)
+def workflowstats(accountingfile,cores,elapsed):
+    attempts=[json.loads(line) for line in open(accountingfile) if line.strip()!=""]
+    durations=[attempt["end"]-attempt["start"] for attempt in attempts]
+    busy=sum(duration*attempt.get("cores",1) for duration,attempt in zip(durations,attempts))
+    stats={}
+    stats["attempts"]=len(attempts)
+    stats["throughput"]=len(attempts)/elapsed # Tasks per second
+    stats["idle"]=cores*elapsed-busy # Core seconds no task ran
+    stats["utilization"]=busy/(cores*elapsed)
+    # The overhead is how much longer the run took than a perfect packing of its tasks
+    stats["overhead"]=elapsed-max(busy/cores,max(durations) if durations else 0.0)
+    # The measured imbalance is the longest task over the average one, with the real costs of the combinations
+    stats["measuredimbalance"]=max(durations)/(sum(durations)/len(durations)) if sum(durations)>0 else None
+    return stats
+
+# Benchmark the stages on an experiment of the given number of combinations in directory
+def benchmark(directory,combinations,repetitions,numberofsubexperiments,threads,cores,runner,compact,until):
+    os.makedirs(directory)
+    model="benchmark.nlogo"
+    sizes=writemodel(directory+"/"+model,combinations,repetitions)
+    result={"combinations":combinations,"simulations":combinations*repetitions,"valuesets":sizes}
+
+    # Parsing includes reading the model (the cache is not used) and decomposing the experiment
+    def parse():
+        spec=parseexperiment.loadexperiment(directory+"/"+model,"benchmark","")
+        return parseexperiment.createsubexperiments(spec,numberofsubexperiments,directory,compact)
+    subexperiments,result["parse"]=timestage(directory+"/parse.log",parse)
+    costs=[subexperiment["cost"] for subexperiment in subexperiments]
+    result["subexperiments"]=len(subexperiments)
+    result["redundant"]=sum(subexperiment["simulations"] for subexperiment in subexperiments)-combinations*repetitions
+    result["imbalance"]=max(costs)/(sum(costs)/len(costs)) if sum(costs)>0 else None
+    if stages.index(until)<stages.index("tasks"):
+        return result
+
+    def tasks():
+        tasks=generatetasks.createtasks(subexperiments,runner,model,threads)
+        return generatetasks.writetasks(directory,tasks,1,threads,cores)
+    tasklistfiles,result["tasks"]=timestage(directory+"/tasks.log",tasks)
+    if stages.index(until)<stages.index("workflow"):
+        return result
+
+    # Every task runs once, so the measured times are not blurred by retries or speculative duplicates
+    tasklistfile=tasklistfiles[0]
+    command=[bindir+"/workflow.py","-t",tasklistfile,"-c",str(cores),"--retries=0","--speculate=0"]
+    status,result["workflow"]=runstage(command,directory+"/workflow.log",directory)
+    if status!=0:
+        print " [ ERROR ] workflow.py failed, see",directory+"/workflow.log"
+        sys.exit(1)
+    result.update(workflowstats(tasklistfile+".accounting.jsonl",cores,result["workflow"]))
+    return result
+
+# Print a table of the results (a dash where a stage did not run)
+def printresults(results):
+    columns=[("combinations","combinations","%12i"),("parse","parse","%9.3f"),("tasks","tasks","%9.3f"),("workflow","workflow","%9.3f"),
+             ("throughput","throughput","%10.1f"),("idle","idle","%9.1f"),("overhead","overhead","%9.3f"),("redundant","redundant","%9i"),
+             ("imbalance","imbalance","%9.3f"),("measuredimbalance","measured","%9.3f")]
+    print " ".join("%*s"%(len(form%0),title) for name,title,form in columns)
+    for result in results:
+        print " ".join(form%result[name] if result.get(name)!=None else "%*s"%(len(form%0),"-") for name,title,form in columns)
+
+# Compare results with a baseline, a stage is slower, or a partition worse, when it is more than tolerance above
+# the baseline (and times by more than slack seconds, so noise on tiny times is not reported). Returns the regressions
+def compare(results,baseline,tolerance,slack=0.05):
+    regressions=[]
+    baselines=dict((result["combinations"],result) for result in baseline)
+    for result in results:
+        previous=baselines.get(result["combinations"])
+        if previous==None:
+            continue
+        # The workflow time includes the simulations, its overhead is what NAWS adds to them
+        for name in ("parse","tasks","overhead","redundant","imbalance","measuredimbalance"):
+            if result.get(name)==None or previous.get(name)==None:
+                continue
+            allowed=previous[name]*(1.0+tolerance)
+            if name in ("parse","tasks","overhead"):
+                allowed=max(allowed,previous[name]+slack)
+            if result[name]>allowed:
+                regressions.append("%s at %i combinations : %g (baseline %g)"%(name,result["combinations"],result[name],previous[name]))
+    return regressions
+
+# Main program code
+def main():
+    usage="benchmark.py [-c <combinations,...>] [-r <repetitions>] [-n <number of sub-experiments>] [-t <threads per task>] [--cores=<cores>]\n"
+    usage+="             [--runtime=<mean seconds per simulation>] [--startup=<seconds per task>] [--cost=constant|uniform|lognormal|pareto] [--burn]\n"
+    usage+="             [--compact] [--until=parse|tasks|workflow] [-d <scratch directory>] [--keep] [-o <results json>] [--baseline=<results json>] [--tolerance=<fraction>]"
+    try:
+        opts,args=getopt.getopt(sys.argv[1:],"c:r:n:t:d:o:",["combinations=","repetitions=","num=","threads=","cores=","runtime=","startup=","cost=","burn",
+                                                            "compact","until=","dir=","keep","output=","baseline=","tolerance="])
+    except getopt.GetoptError:
+        print usage
+        sys.exit(1)
+
+    combinationcounts=[1000,10000,100000,1000000]
+    repetitions=1
+    numberofsubexperiments=64
+    threads=1
+    cores=multiprocessing.cpu_count()
+    runtime=0.00001 # Small enough to measure the overhead of NAWS rather than the simulations
+    startup=0.0
+    distribution="lognormal"
+    burncpu=False
+    compact=False
+    until="workflow" # The last stage to run
+    scratchdir=""
+    keep=False
+    resultsfile=""
+    baselinefile=""
+    tolerance=0.2
+    for opt, arg in opts:
+        if opt in ("-c", "--combinations"):
+            combinationcounts=[int(count) for count in arg.split(",")]
+        if opt in ("-r", "--repetitions"):
+            repetitions=int(arg)
+        if opt in ("-n", "--num"):
+            numberofsubexperiments=int(arg)
+        if opt in ("-t", "--threads"):
+            threads=int(arg)
+        if opt=="--cores":
+            cores=int(arg)
+        if opt=="--runtime":
+            runtime=float(arg)
+        if opt=="--startup":
+            startup=float(arg)
+        if opt=="--cost":
+            distribution=arg
+        if opt=="--burn":
+            burncpu=True
+        if opt=="--compact":
+            compact=True
+        if opt=="--until":
+            until=arg
+        if opt in ("-d", "--dir"):
+            scratchdir=arg
+        if opt=="--keep":
+            keep=True
+        if opt in ("-o", "--output"):
+            resultsfile=arg
+        if opt=="--baseline":
+            baselinefile=arg
+        if opt=="--tolerance":
+            tolerance=float(arg)
+    err=0
+    if min(combinationcounts+[repetitions,numberofsubexperiments,threads,cores])<=0:
+        print " [ ERROR ] Combinations, repetitions, sub-experiments, threads and cores must be greater than 0"
+        err=1
+    if until not in stages:
+        print " [ ERROR ] Until must be one of",", ".join(stages)
+        err=1
+    if distribution not in ("constant","uniform","lognormal","pareto"):
+        print " [ ERROR ] Unknown cost distribution",distribution
+        err=1
+    if err==1:
+        print usage
+        sys.exit(1)
+
+    baseline=None
+    if baselinefile!="":
+        try:
+            with open(baselinefile,'r') as f:
+                baseline=json.load(f)
+        except (IOError,ValueError):
+            print " [ ERROR ] Cannot read baseline",baselinefile
+            sys.exit(1)
+
+    if scratchdir=="":
+        scratchdir=tempfile.mkdtemp(prefix="naws-benchmark.")
+    elif not os.path.exists(scratchdir):
+        os.makedirs(scratchdir)
+    scratchdir=os.path.abspath(scratchdir)
+    print "Benchmarking in",scratchdir
+
+    # fake-netlogo.py with the benchmark options stands in for runabm.sh
+    runner=scratchdir+"/runabm-benchmark.sh"
+    with open(runner,'w') as f:
+        f.write("#!/bin/sh\nexec %s/fake-netlogo.py --startup=%r --runtime=%r --cost=%s%s \"$@\"\n"%(bindir,startup,runtime,distribution," --burn" if burncpu else ""))
+    os.chmod(runner,0755)
+
+    settings={"repetitions":repetitions,"subexperiments":numberofsubexperiments,"threads":threads,"cores":cores,"runtime":runtime,
+              "startup":startup,"cost":distribution,"burn":burncpu,"compact":compact,"host":os.uname()[1]}
+    print "Settings :",json.dumps(settings,sort_keys=True)
+    results=[]
+    for combinations in combinationcounts:
+        print "Benchmarking",combinations,"combinations"
+        results.append(benchmark(scratchdir+"/"+str(combinations),combinations,repetitions,numberofsubexperiments,threads,cores,runner,compact,until))
+
+    print
+    printresults(results)
+    print "(times in seconds, throughput in tasks per second, idle in core seconds, imbalance predicted and measured)"
+
+    if resultsfile!="":
+        with open(resultsfile,'w') as f:
+            json.dump({"settings":settings,"results":results},f,indent=1,sort_keys=True)
+        print "Results written to",resultsfile
+
+    if not keep:
+        shutil.rmtree(scratchdir)
+
+    if baseline!=None:
+        if baseline.get("settings")!=settings:
+            print " [ WARNING ] The baseline was run with other settings :",json.dumps(baseline.get("settings"),sort_keys=True)
+        regressions=compare(results,baseline["results"],tolerance)
+        for regression in regressions:
+            print " [ REGRESSION ]",regression
+        if len(regressions)>0:
+            sys.exit(1)
+        print "No regression against",baselinefile
+
+# Run main
+if __name__=="__main__":
+   main()
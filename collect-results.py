@@ -0,0 +1,13 @@
+#!/usr/bin/python
+"""
+Copyright (c) 2014 High-Performance Computing and GIS (HPCGIS) Laboratory. All rights reserved.
+Use of this source code is governed by a BSD-style license that can be found in the LICENSE file.
+Authors and contributors: Eric Shook (eshook@kent.edu)
+"""
+
+# The command-line script of collectresults.py, whose functions can also be called from Python
+import collectresults
+
+# Run main
+if __name__=="__main__":
+   collectresults.main()
@@ -0,0 +1,525 @@
+#!/usr/bin/python
+"""
+Copyright (c) 2014 High-Performance Computing and GIS (HPCGIS) Laboratory. All rights reserved.
+Use of this source code is governed by a BSD-style license that can be found in the LICENSE file.
+Authors and contributors: Eric Shook (eshook@kent.edu)
+"""
+
+import os
+import re
+import csv
+import glob
+import json
+import zlib
+import hashlib
+import time
+import sqlite3
+import sys,getopt
+
+import parseexperiment
+from generatetasks import naturalkey
+
+'''
+The collect results script merges the tables NetLogo writes for the sub-experiments (out.table.*.csv in the
+exec directory) into one result store, an SQLite file in which :
+ 1. every parameter combination is a row of the combinations table, indexed by each parameter
+ 2. the rows of a table are kept in chunks of consecutive rows, with one compressed blob per column (combination,
+    repetition, step and each metric), and the chunks are indexed by combination, repetitions and steps
+so reading a slice of the parameter space only decompresses the chosen columns of the chunks holding its combinations.
+Tables are streamed one at a time and each is collected in one transaction, so collecting can be run again as
+more jobs finish : partial tables (.part) and tables already collected (same rows, wherever they are) are skipped.
+A table is known by the digest of its rows rather than by its name, as a later sweep may write a table of the same name.
+A run is numbered by its repetition among the collected runs of its combination. It is known by its source, the name
+of its table and its run number in it, so a run collected again (from a copy of its table, or from the table a task
+run again writes over it) is dropped as a duplicate, as are runs beyond the repetitions of the experiment
+(redundant or overlapping sub-experiments). The follow-up sweeps name their sub-experiments after the runs in the
+cache they were planned from (see parseexperiment.uncachedexperiments), so their tables have sources of their own.
+The store of a model and experiment is also the result cache : it lives in ~/.naws/results, named after the
+hashes of the model and of the experiment, and parse-experiment.py drops the runs it already holds from a sweep,
+so after a follow-up sweep is collected the store covers the whole experiment.
+From Python, collecttables adds tables to a store, selectruns reads a slice of it, cachedrepetitions tells
+which runs of an experiment it holds and runoutcomes the metrics each run ended with (see adaptreplication.py)
+'''
+
+# Store layout :
+#   info (name, value)                      model, experiment, modelhash, experimenthash and repetitions of the results
+#   columns (position, name, kind)          parameter, index ([repetition] and [step]) or metric columns
+#   tables (digest, file, size, mtime, experiment, runs, rows, duplicates, collected)
+#   combinations (id, key, p0, p1, ..., repetitions)  p<i> is the parameter at position i, key its values as JSON
+#   runs (source, combination, repetition)  the source of each repetition (<table file name>:<run number>)
+#   chunks (id, firststep, laststep, rows)
+#   chunkcombinations (combination, chunk, firstrepetition, lastrepetition)  the combinations in each chunk
+#   chunkcolumns (chunk, position, data)    data is the zlib compressed JSON list of the values of a column
+#                                           (position -1 holds the combination of each row)
+def openstore(storefile):
+    storedir=os.path.dirname(os.path.abspath(storefile))
+    if not os.path.exists(storedir):
+        os.makedirs(storedir)
+    db=sqlite3.connect(storefile)
+    db.execute("CREATE TABLE IF NOT EXISTS info (name TEXT PRIMARY KEY, value TEXT)")
+    db.execute("CREATE TABLE IF NOT EXISTS columns (position INTEGER PRIMARY KEY, name TEXT, kind TEXT)")
+    db.execute("""CREATE TABLE IF NOT EXISTS tables (digest TEXT PRIMARY KEY, file TEXT, size INTEGER, mtime REAL, experiment TEXT,
+        runs INTEGER, rows INTEGER, duplicates INTEGER, collected REAL)""")
+    db.execute("CREATE INDEX IF NOT EXISTS tablesbyfile ON tables (file)")
+    db.execute("CREATE TABLE IF NOT EXISTS runs (source TEXT PRIMARY KEY, combination INTEGER, repetition INTEGER)")
+    db.execute("CREATE TABLE IF NOT EXISTS chunks (id INTEGER PRIMARY KEY, firststep INTEGER, laststep INTEGER, rows INTEGER)")
+    db.execute("""CREATE TABLE IF NOT EXISTS chunkcombinations (combination INTEGER, chunk INTEGER, firstrepetition INTEGER, lastrepetition INTEGER,
+        PRIMARY KEY (combination,chunk))""")
+    db.execute("CREATE TABLE IF NOT EXISTS chunkcolumns (chunk INTEGER, position INTEGER, data BLOB, PRIMARY KEY (chunk,position))")
+    db.commit()
+    return db
+
+# The result cache of an experiment (described by spec) of a model, named after the hashes of the code of the model
+# and of what the experiment runs, so widening the value sets or adding repetitions keeps the same cache
+def resultcachefile(netlogomodel,spec):
+    return os.path.expanduser("~/.naws/results")+"/"+parseexperiment.hashmodelcode(netlogomodel)+"."+parseexperiment.experimenthash(spec)+".db"
+
+# The settings of a store (see openstore)
+def readinfo(db):
+    return dict(db.execute("SELECT name,value FROM info").fetchall())
+
+# Record the model and experiment of the results, and the repetitions runs are capped to
+def writeinfo(db,info):
+    db.executemany("INSERT OR REPLACE INTO info (name,value) VALUES (?,?)",[(name,str(value)) for name,value in info.items()])
+    db.commit()
+
+# The columns of a store as (position, name, kind), in position order
+def readcolumns(db):
+    return db.execute("SELECT position,name,kind FROM columns ORDER BY position").fetchall()
+
+# Define the columns of a store from the first table collected into it
+def createcolumns(db,parameters,metrics):
+    columns=[(name,"parameter") for name in parameters]+[("[repetition]","index"),("[step]","index")]+[(name,"metric") for name in metrics]
+    db.executemany("INSERT INTO columns (position,name,kind) VALUES (?,?,?)",[(position,name,kind) for position,(name,kind) in enumerate(columns)])
+    db.execute("CREATE TABLE combinations (id INTEGER PRIMARY KEY, key TEXT UNIQUE, "+"".join("p%i, "%position for position in range(len(parameters)))+"repetitions INTEGER)")
+    for position in range(len(parameters)):
+        db.execute("CREATE INDEX combinationsbyp%i ON combinations (p%i)"%(position,position))
+    db.commit()
+
+# A value of a table as a number when it is one (so slices compare numbers), otherwise as its text
+def tovalue(text):
+    try:
+        return int(text)
+    except ValueError:
+        pass
+    try:
+        return float(text)
+    except ValueError:
+        return text
+
+# Read a table written by NetLogo (the BehaviorSpace header block, the column names, a row per run and step)
+# Returns (experiment, parameters, metrics, runs, digest) where runs maps each run number to its rows by step
+# (a row written twice for a run and step is only kept once) and digest hashes the rows, or None if the file is not a table
+def readtable(tablefile):
+    header=[]
+    digest=hashlib.sha1()
+    with open(tablefile,'rb') as f:
+        reader=csv.reader(f)
+        for row in reader:
+            if len(row)>0 and row[0]=="[run number]":
+                columns=row
+                break
+            header.append(row)
+        else:
+            return None
+        if "[step]" not in columns:
+            return None
+        stepindex=columns.index("[step]")
+        runs={}
+        for row in reader:
+            if len(row)!=len(columns): # The unfinished last line of a table that was cut short
+                continue
+            digest.update("\0".join(row)+"\n")
+            runs.setdefault(int(row[0]),{})[int(row[stepindex])]=[tovalue(value) for value in row[1:stepindex]+row[stepindex+1:]]
+    # The third line of the header block is the name of the experiment, otherwise use the table name
+    if len(header)>=3 and len(header[0])>0 and header[0][0].startswith("BehaviorSpace results") and len(header[2])>0:
+        experiment=header[2][0]
+    else:
+        experiment=os.path.basename(tablefile)
+    return experiment,columns[1:stepindex],columns[stepindex+1:],runs,digest.hexdigest()
+
+# Compress the values of a column of a chunk
+def packcolumn(values):
+    return sqlite3.Binary(zlib.compress(json.dumps(values,separators=(",",":"))))
+
+def unpackcolumn(data):
+    return json.loads(zlib.decompress(str(data)))
+
+# Write the rows (combination, repetition, step, metrics) of a table as chunks of at most chunkrows rows
+# The columns from repetition on are stored at their position in the store, after the parameters
+def writechunks(db,rows,numberofparameters,chunkrows):
+    rows.sort(key=lambda row: (row[0],row[1],row[2]))
+    for start in range(0,len(rows),chunkrows):
+        chunk=rows[start:start+chunkrows]
+        steps=[row[2] for row in chunk]
+        chunkid=db.execute("INSERT INTO chunks (firststep,laststep,rows) VALUES (?,?,?)",(min(steps),max(steps),len(chunk))).lastrowid
+        repetitions={}
+        for row in chunk:
+            lowest,highest=repetitions.get(row[0],(row[1],row[1]))
+            repetitions[row[0]]=(min(lowest,row[1]),max(highest,row[1]))
+        db.executemany("INSERT INTO chunkcombinations (combination,chunk,firstrepetition,lastrepetition) VALUES (?,?,?,?)",
+                       [(combination,chunkid)+repetitions[combination] for combination in repetitions])
+        columns=zip(*chunk)
+        db.executemany("INSERT INTO chunkcolumns (chunk,position,data) VALUES (?,?,?)",
+                       [(chunkid,position,packcolumn(list(values))) for position,values in zip([-1]+range(numberofparameters,numberofparameters+len(columns)-1),columns)])
+
+# Whether the experiment named in the header of a table is experimentname or one of its sub-experiments (see
+# collecttables), and not another experiment of the model (otherexperiments) whose name looks like one
+def subexperimentof(name,experimentname,otherexperiments=()):
+    if name in otherexperiments:
+        return False
+    return re.match(re.escape(experimentname)+r"((_\d+)*_?\d+(\.\d+)?)?$",name)!=None
+
+# Collect a table into the store. Returns (runs, duplicates) collected and dropped, or None when the table
+# was skipped (already collected, a copy of a table collected, not a table, of another experiment than experimentname
+# or with other columns than the store)
+def collecttable(db,tablefile,repetitions=None,chunkrows=10000,experimentname=None,otherexperiments=()):
+    # A table collected and unchanged since is skipped without reading it
+    stat=os.stat(tablefile)
+    if db.execute("SELECT 1 FROM tables WHERE file=? AND size=? AND mtime=?",(os.path.abspath(tablefile),stat.st_size,stat.st_mtime)).fetchone()!=None:
+        return None
+    table=readtable(tablefile)
+    if table==None:
+        print " [ WARNING ] Not a NetLogo table :",tablefile
+        return None
+    experiment,parameters,metrics,runs,digest=table
+    if experimentname!=None and not subexperimentof(experiment,experimentname,otherexperiments):
+        print " [ WARNING ] Skipping",tablefile,"of experiment",experiment,"(not",experimentname+")"
+        return None
+    if db.execute("SELECT 1 FROM tables WHERE digest=?",(digest,)).fetchone()!=None:
+        print " Skipping",tablefile,"(the same runs of",experiment,"are already collected)"
+        return None
+    columns=readcolumns(db)
+    if len(columns)==0:
+        createcolumns(db,parameters,metrics)
+    elif [name for position,name,kind in columns]!=parameters+["[repetition]","[step]"]+metrics:
+        print " [ WARNING ] Skipping",tablefile,"whose columns differ from the store"
+        return None
+
+    # Group the runs by combination, in run number order
+    combinations={}
+    order=[]
+    for run in sorted(runs):
+        steps=runs[run]
+        values=steps[min(steps)][:len(parameters)]
+        key=json.dumps(values)
+        if key not in combinations:
+            combinations[key]=(values,[])
+            order.append(key)
+        combinations[key][1].append(run)
+
+    try:
+        collected=0
+        duplicates=0
+        rows=[]
+        for key in order:
+            values,combinationruns=combinations[key]
+            row=db.execute("SELECT id,repetitions FROM combinations WHERE key=?",(key,)).fetchone()
+            if row==None:
+                cursor=db.execute("INSERT INTO combinations (key,"+"".join("p%i,"%position for position in range(len(parameters)))+"repetitions) VALUES (?,"+"?,"*len(parameters)+"0)",
+                                  [key]+values)
+                row=(cursor.lastrowid,0)
+            combination,repetition=row
+            for run in combinationruns:
+                source=os.path.basename(tablefile)+":"+str(run)
+                if db.execute("SELECT 1 FROM runs WHERE source=?",(source,)).fetchone()!=None or (repetitions!=None and repetition>=repetitions):
+                    duplicates+=1
+                    continue
+                db.execute("INSERT INTO runs (source,combination,repetition) VALUES (?,?,?)",(source,combination,repetition))
+                for step,values in runs[run].items():
+                    rows.append([combination,repetition,step]+values[len(parameters):])
+                repetition+=1
+                collected+=1
+            db.execute("UPDATE combinations SET repetitions=? WHERE id=?",(repetition,combination))
+        numberofrows=len(rows)
+        if numberofrows>0:
+            writechunks(db,rows,len(parameters),chunkrows)
+        db.execute("INSERT INTO tables (digest,file,size,mtime,experiment,runs,rows,duplicates,collected) VALUES (?,?,?,?,?,?,?,?,?)",
+                   (digest,os.path.abspath(tablefile),stat.st_size,stat.st_mtime,experiment,collected,numberofrows,duplicates,time.time()))
+        db.commit()
+    except:
+        db.rollback()
+        raise
+    return collected,duplicates
+
+# Find the complete tables of a model (or of every model) in tabledir, in sub-experiment order
+# Tables being written end in .part<pid> until they are complete, so they never match
+def findtables(tabledir,netlogomodel=None):
+    pattern="out.table."+(os.path.basename(netlogomodel)+"." if netlogomodel!=None else "")+"*.csv"
+    return sorted(glob.glob(os.path.join(tabledir,pattern)),key=naturalkey)
+
+# Collect tables into the store, skipping those of other experiments when the model and experimentname are given
+# (the tables of its sub-experiments are named <experimentname><number>, <experimentname><number>.<box> and,
+# for the parts of a sweep left to run after the result cache, <experimentname>_<cached runs>_<part>_<number>... or
+# <experimentname>_<stored runs>_<round>_<part>_<number>... for the rounds of adaptive replication). The experiment named in the
+# header of a table must be one of these too, and not another experiment of the model such as <experimentname>20
+def collecttables(db,tablefiles,netlogomodel=None,experimentname=None,repetitions=None,chunkrows=10000):
+    tables=0
+    runs=0
+    duplicates=0
+    otherexperiments=set()
+    if experimentname!=None and os.path.exists(netlogomodel):
+        with open(netlogomodel,'r') as f:
+            otherexperiments=set(parseexperiment.experimentnames(f))-set([experimentname])
+    for tablefile in tablefiles:
+        if experimentname!=None:
+            prefix=re.escape("out.table."+os.path.basename(netlogomodel)+"."+experimentname)
+            if re.match(prefix+r"(_\d+)*_?\d+\.",os.path.basename(tablefile))==None:
+                continue
+        result=collecttable(db,tablefile,repetitions,chunkrows,experimentname,otherexperiments)
+        if result==None:
+            continue
+        tables+=1
+        runs+=result[0]
+        duplicates+=result[1]
+        print " Collected",tablefile,":",result[0],"runs",("(%i duplicate runs dropped)"%result[1] if result[1]>0 else "")
+    print "Collected %i tables, %i runs (%i duplicate runs dropped)"%(tables,runs,duplicates)
+    return tables,runs,duplicates
+
+# Record the model and experiment (described by spec) whose results the store holds, with the repetitions wanted
+# (a follow-up sweep may add repetitions, so the latest experiment sets them). Returns the info of the store,
+# None when it holds the results of another model or experiment
+def describestore(db,netlogomodel,spec):
+    info=readinfo(db)
+    modelhash=parseexperiment.hashmodelcode(netlogomodel)
+    experimenthash=parseexperiment.experimenthash(spec)
+    if info.get("modelhash",modelhash)!=modelhash or info.get("experimenthash",experimenthash)!=experimenthash:
+        return None
+    info={"model":os.path.basename(netlogomodel),"experiment":spec["name"],"modelhash":modelhash,"experimenthash":experimenthash,
+          "repetitions":spec["repetitions"]}
+    writeinfo(db,info)
+    return info
+
+# Read a slice of the store : the runs of the combinations whose parameters have the values of parameters
+# (a dictionary of name to value), with only the metrics named (all of them by default) and the repetitions
+# and steps in the (first,last) ranges given. Returns the column names and a generator of rows
+def selectruns(db,parameters={},metrics=None,repetitions=None,steps=None):
+    columns=readcolumns(db)
+    positions=dict((name,position) for position,name,kind in columns)
+    parameternames=[name for position,name,kind in columns if kind=="parameter"]
+    if metrics==None:
+        metrics=[name for position,name,kind in columns if kind=="metric"]
+    for name in parameters.keys()+metrics:
+        if name not in positions:
+            raise KeyError("No column "+name+" in the store")
+
+    # The chunks holding the combinations of the slice (and its repetitions and steps)
+    where=["c.p%i=?"%positions[name] for name in parameters]
+    if repetitions!=None:
+        where.append("cc.lastrepetition>=%i AND cc.firstrepetition<=%i"%repetitions)
+    if steps!=None:
+        where.append("k.laststep>=%i AND k.firststep<=%i"%steps)
+    where=" AND ".join(where) or "1"
+    values=[tovalue(value) if isinstance(value,basestring) else value for value in parameters.values()]
+    combinations=dict(db.execute("SELECT DISTINCT c.id,c.key FROM combinations c JOIN chunkcombinations cc ON cc.combination=c.id JOIN chunks k ON k.id=cc.chunk WHERE "+where,values).fetchall())
+    chunks=[chunk for (chunk,) in db.execute("SELECT DISTINCT cc.chunk FROM combinations c JOIN chunkcombinations cc ON cc.combination=c.id JOIN chunks k ON k.id=cc.chunk WHERE "+where+" ORDER BY cc.chunk",values)]
+    wanted=[-1,positions["[repetition]"],positions["[step]"]]+[positions[name] for name in metrics]
+    columnquery="SELECT position,data FROM chunkcolumns WHERE chunk=? AND position IN ("+",".join(str(position) for position in wanted)+")"
+
+    def rows():
+        keys={}
+        for chunk in chunks:
+            data=dict((position,unpackcolumn(blob)) for position,blob in db.execute(columnquery,(chunk,)))
+            for row in zip(*[data[position] for position in wanted]):
+                if row[0] not in combinations:
+                    continue
+                if repetitions!=None and not repetitions[0]<=row[1]<=repetitions[1]:
+                    continue
+                if steps!=None and not steps[0]<=row[2]<=steps[1]:
+                    continue
+                if row[0] not in keys:
+                    keys[row[0]]=json.loads(combinations[row[0]])
+                yield keys[row[0]]+list(row[1:])
+    return parameternames+["[repetition]","[step]"]+metrics,rows()
+
+# The value indices (in parseexperiment.experimentvaluesets order) of the combinations of the experiment described
+# by spec in the store : a function of the parameter values of a combination (in the order of the parameter columns)
+# that returns None for values the experiment no longer has. None when the store has other parameters than the experiment
+def combinationindexer(db,spec):
+    valuesets=parseexperiment.experimentvaluesets(spec)
+    columns=readcolumns(db)
+    parameters=[name for position,name,kind in columns if kind=="parameter"]
+    if sorted(parameters)!=sorted(valueset.variable for valueset in valuesets):
+        return None
+    indices=[dict((tovalue(valueset[index]),index) for index in xrange(len(valueset))) for valueset in valuesets]
+    order=[parameters.index(valueset.variable) for valueset in valuesets]
+    def indexer(values):
+        try:
+            return tuple(index[values[position]] for index,position in zip(indices,order))
+        except KeyError:
+            return None
+    return indexer
+
+# The runs of the experiment described by spec already in the store : a dictionary from the value indices of a
+# combination (in parseexperiment.experimentvaluesets order) to its repetitions, for parseexperiment.uncachedexperiments
+# Combinations with values the experiment no longer has are left out
+def cachedrepetitions(db,spec):
+    if len(readcolumns(db))==0:
+        return {}
+    indexer=combinationindexer(db,spec)
+    if indexer==None:
+        print " [ WARNING ] The result cache has other parameters than the experiment, it is not used"
+        return {}
+    cached={}
+    for key,repetitions in db.execute("SELECT key,repetitions FROM combinations WHERE repetitions>0"):
+        combination=indexer(json.loads(key))
+        if combination!=None:
+            cached[combination]=repetitions
+    return cached
+
+# The outcome of every run of the experiment described by spec in the store : the metrics named at the last step
+# of the run, as a dictionary from the value indices of a combination to a dictionary from repetition to the metrics
+def runoutcomes(db,spec,metrics):
+    if len(readcolumns(db))==0:
+        return {}
+    indexer=combinationindexer(db,spec)
+    if indexer==None:
+        print " [ WARNING ] The result store has other parameters than the experiment"
+        return {}
+    header,rows=selectruns(db,metrics=metrics)
+    numberofparameters=len(header)-len(metrics)-2
+    laststeps={}
+    outcomes={}
+    for row in rows:
+        combination=indexer(row[:numberofparameters])
+        if combination==None:
+            continue
+        repetition,step=row[numberofparameters:numberofparameters+2]
+        if laststeps.get((combination,repetition),step)>step:
+            continue
+        laststeps[(combination,repetition)]=step
+        outcomes.setdefault(combination,{})[repetition]=row[numberofparameters+2:]
+    return outcomes
+
+# The parts of the experiment described by spec left to run after the runs in the result cache storefile
+# (see parseexperiment.uncachedexperiments), an empty list when every run is cached
+def pendingexperiments(spec,storefile):
+    if not os.path.exists(storefile):
+        return [spec]
+    db=openstore(storefile)
+    cached=cachedrepetitions(db,spec)
+    db.close()
+    specs=parseexperiment.uncachedexperiments(spec,cached)
+    total=parseexperiment.experimentsimulations(spec)
+    pending=sum(parseexperiment.experimentsimulations(part) for part in specs)
+    print "Result cache",storefile,":",total-pending,"of",total,"simulations already run,",len(specs),"parts left to run"
+    return specs
+
+# Parse a range option first:last (one number for a single value)
+def parserange(text):
+    first,_,last=text.partition(":")
+    return (int(first),int(last or first))
+
+# Main program code
+def main():
+
+    usage="collect-results.py [-i <directory of the tables>] [-m <netlogo model> -e <experiment name>] [-s <result store>] [--chunk-rows=<rows>]\n"
+    usage+="collect-results.py [-s <result store>] --query [--where=<parameter>=<value> ...] [--metric=<metric> ...] [--repetitions=<first>:<last>] [--steps=<first>:<last>]"
+
+    try:
+        opts,args=getopt.getopt(sys.argv[1:],"i:s:m:e:",["input=","store=","model=","experiment=","chunk-rows=","query","where=","metric=","repetitions=","steps="])
+    except getopt.GetoptError:
+        print usage
+        sys.exit(1)
+
+    tabledir="."
+    storefile=None # The result cache of the experiment, or results.db without a model and experiment
+    netlogomodel=None
+    experimentname=None
+    chunkrows=10000
+    query=False # Write a slice of the store as CSV instead of collecting
+    parameters={}
+    metrics=None
+    repetitions=None
+    steps=None
+    err=0
+    for opt, arg in opts:
+        if opt in ("-i", "--input"):
+            tabledir=arg
+        if opt in ("-s", "--store"):
+            storefile=arg
+        if opt in ("-m", "--model"):
+            netlogomodel=arg
+        if opt in ("-e", "--experiment"):
+            experimentname=arg
+        if opt=="--chunk-rows":
+            chunkrows=int(arg)
+        if opt=="--query":
+            query=True
+        if opt=="--where":
+            if "=" not in arg:
+                print " [ ERROR ] Expected <parameter>=<value> :",arg
+                err=1
+            name,_,value=arg.partition("=")
+            parameters[name]=value
+        if opt=="--metric":
+            metrics=(metrics or [])+[arg]
+        if opt=="--repetitions":
+            repetitions=parserange(arg)
+        if opt=="--steps":
+            steps=parserange(arg)
+    if chunkrows<=0:
+        print " [ ERROR ] Rows per chunk must be greater than 0"
+        err=1
+    if (netlogomodel==None)!=(experimentname==None):
+        print " [ ERROR ] Must provide both a NetLogo model and an experiment, or neither"
+        err=1
+    if err==1:
+        print usage
+        sys.exit(1)
+
+    spec=None
+    if netlogomodel!=None:
+        stdout=sys.stdout
+        if query:
+            sys.stdout=sys.stderr # The CSV of the slice is alone on stdout
+        try:
+            spec=parseexperiment.loadexperiment(netlogomodel,experimentname,os.path.expanduser("~/.naws/cache"))
+        except IOError:
+            print " [ ERROR ] Cannot open file",netlogomodel
+            sys.exit(1)
+        finally:
+            sys.stdout=stdout
+        if spec==None:
+            print " [ ERROR ] Experiment not found :",experimentname
+            sys.exit(1)
+        if storefile==None:
+            storefile=resultcachefile(netlogomodel,spec)
+    if storefile==None:
+        storefile="results.db"
+    if query and not os.path.exists(storefile):
+        print " [ ERROR ] Result store not found :",storefile
+        sys.exit(1)
+
+    db=openstore(storefile)
+
+    if query:
+        try:
+            header,rows=selectruns(db,parameters,metrics,repetitions,steps)
+        except KeyError as e:
+            print " [ ERROR ]",e.args[0]
+            sys.exit(1)
+        writer=csv.writer(sys.stdout,lineterminator="\n")
+        writer.writerow(header)
+        writer.writerows(rows)
+        return
+
+    # The experiment gives the repetitions wanted, runs beyond them are duplicates
+    info=readinfo(db)
+    if spec!=None:
+        info=describestore(db,netlogomodel,spec)
+        if info==None:
+            print " [ ERROR ] The store",storefile,"holds the results of another model or experiment"
+            sys.exit(1)
+    elif "model" in info:
+        netlogomodel=info["model"]
+        experimentname=info["experiment"]
+    repetitions=int(info["repetitions"]) if "repetitions" in info else None
+
+    print "Collecting tables from",tabledir,"into",storefile
+    collecttables(db,findtables(tabledir,netlogomodel),netlogomodel,experimentname,repetitions,chunkrows)
+    db.close()
+
+# Run main
+if __name__=="__main__":
+   main()
@@ -0,0 +1,134 @@
+#!/usr/bin/python
+"""
+Copyright (c) 2014 High-Performance Computing and GIS (HPCGIS) Laboratory. All rights reserved.
+Use of this source code is governed by a BSD-style license that can be found in the LICENSE file.
+Authors and contributors: Eric Shook (eshook@kent.edu)
+"""
+
+import os
+import json
+import glob
+import sys,getopt
+
+'''
+The export trace script converts the accounting files written by workflow.py (one per tasklist) into
+a trace in the Chrome trace event format (open it in chrome://tracing or https://ui.perfetto.dev):
+ 1. each node (host and job) is a process and each attempt of a task a slice in one of its lanes
+ 2. a counter per node shows the cores in use over time, so idle gaps stand out
+ 3. a summary of the utilization of each node is printed
+'''
+
+# Read the attempts of tasks from accounting files (JSON Lines)
+# The jobs may still be writing them, so a partly written line is skipped
+def readaccounting(accountingfiles):
+    attempts=[]
+    for accountingfile in accountingfiles:
+        with open(accountingfile,'r') as f:
+            for line in f:
+                try:
+                    attempts.append(json.loads(line))
+                except ValueError:
+                    continue # A blank line or a record being written
+    return attempts
+
+# Assign each attempt of a node to the first lane free at its start, so overlapping attempts
+# are drawn on separate rows. Returns the lane of each attempt (in the order given)
+def assignlanes(attempts):
+    lanes=[] # The end of the last attempt in each lane
+    assigned=[None]*len(attempts)
+    for i in sorted(range(len(attempts)),key=lambda i: attempts[i]["start"]):
+        attempt=attempts[i]
+        for lane in range(len(lanes)):
+            if lanes[lane]<=attempt["start"]:
+                break
+        else:
+            lanes.append(None)
+            lane=len(lanes)-1
+        lanes[lane]=attempt["end"]
+        assigned[i]=lane
+    return assigned
+
+# The trace events of the attempts, with times in microseconds since the first attempt started
+def traceevents(attempts):
+    events=[]
+    if len(attempts)==0:
+        return events
+    origin=min(attempt["start"] for attempt in attempts)
+    nodes={}
+    for attempt in attempts:
+        nodes.setdefault((attempt.get("host",""),attempt.get("job","")),[]).append(attempt)
+    for pid,(node,nodeattempts) in enumerate(sorted(nodes.items())):
+        host,job=node
+        events.append({"ph":"M","name":"process_name","pid":pid,"args":{"name":host+(" job "+job if job else "")}})
+        for attempt,lane in zip(nodeattempts,assignlanes(nodeattempts)):
+            args=dict((key,attempt.get(key)) for key in ("experiment","attempt","returncode","result","user","system","maxrss","queuewait","cores","memory","cost"))
+            events.append({"ph":"X","name":attempt["id"],"cat":attempt.get("result","done"),"pid":pid,"tid":lane,
+                           "ts":(attempt["start"]-origin)*1e6,"dur":(attempt["end"]-attempt["start"])*1e6,"args":args})
+        # Cores in use over time
+        changes=[]
+        for attempt in nodeattempts:
+            changes.append((attempt["start"],attempt.get("cores",1)))
+            changes.append((attempt["end"],-attempt.get("cores",1)))
+        inuse=0
+        for when,change in sorted(changes):
+            inuse+=change
+            events.append({"ph":"C","name":"cores in use","pid":pid,"ts":(when-origin)*1e6,"args":{"cores":inuse}})
+    return events
+
+# Print the busy core time, the span and the utilization of each node
+def summarize(attempts,cores):
+    nodes={}
+    for attempt in attempts:
+        nodes.setdefault((attempt.get("host",""),attempt.get("job","")),[]).append(attempt)
+    for (host,job),nodeattempts in sorted(nodes.items()):
+        start=min(attempt["start"] for attempt in nodeattempts)
+        end=max(attempt["end"] for attempt in nodeattempts)
+        busy=sum((attempt["end"]-attempt["start"])*attempt.get("cores",1) for attempt in nodeattempts)
+        lost=sum((attempt["end"]-attempt["start"])*attempt.get("cores",1) for attempt in nodeattempts if attempt.get("result")!="done")
+        line=" %s%s : %i attempts, span %.1f s, busy %.1f core s (%.1f core s not done)"%(host," job "+job if job else "",len(nodeattempts),end-start,busy,lost)
+        if cores>0 and end>start:
+            line+=", utilization %.1f%%"%(100.0*busy/(cores*(end-start)))
+        print line
+
+# Main program code
+def main():
+    usage="export-trace.py -o <trace json> [-c <cores per node>] <accounting files or workflow directory>"
+    try:
+        opts,args=getopt.getopt(sys.argv[1:],"o:c:",["output=","cores="])
+    except getopt.GetoptError:
+        print usage
+        sys.exit(1)
+
+    tracefile=""
+    cores=0 # Only used for the utilization in the summary
+    for opt, arg in opts:
+        if opt in ("-o", "--output"):
+            tracefile=arg
+        if opt in ("-c", "--cores"):
+            cores=int(arg)
+    if tracefile=="" or len(args)==0:
+        print usage
+        sys.exit(1)
+
+    # A workflow directory stands for the accounting files of its tasklists
+    accountingfiles=[]
+    for arg in args:
+        if os.path.isdir(arg):
+            accountingfiles.extend(sorted(glob.glob(arg+"/tasklists/*.accounting.jsonl")))
+        else:
+            accountingfiles.append(arg)
+    if len(accountingfiles)==0:
+        print " [ ERROR ] No accounting files found in",args
+        sys.exit(1)
+
+    attempts=readaccounting(accountingfiles)
+    print "Read",len(attempts),"attempts from",len(accountingfiles),"accounting files"
+    summarize(attempts,cores)
+
+    with open(tracefile,'w') as f:
+        json.dump({"traceEvents":traceevents(attempts),"displayTimeUnit":"ms"},f)
+    print "Wrote",tracefile
+
+# Run main
+if __name__=="__main__":
+   main()
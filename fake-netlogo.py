@@ -0,0 +1,204 @@
+#!/usr/bin/python
+"""
+Copyright (c) 2014 High-Performance Computing and GIS (HPCGIS) Laboratory. All rights reserved.
+Use of this source code is governed by a BSD-style license that can be found in the LICENSE file.
+Authors and contributors: Eric Shook (eshook@kent.edu)
+"""
+
+import os
+import sys,getopt
+import time
+import random
+import zlib
+import itertools
+import csv
+import multiprocessing
+import subprocess
+from decimal import Decimal
+from xml.dom import minidom
+
+'''
+A stand-in for headless NetLogo to test the workflow without NetLogo or Java
+It takes the same arguments as runabm.sh and, like it, runs every experiment of the experiment file
+(building compact sub-experiments with parse-experiment.py --materialize) and writes a table per experiment.
+Instead of simulating, it sleeps a startup time once (the JVM) and a run time per simulation, or burns CPU
+for it with --burn. The run time of a parameter combination is drawn from a cost distribution (--cost), seeded
+by the combination itself, so every sub-experiment holding a combination gives it the same cost (see benchmark.py).
+With --worker it behaves like runabm-worker.sh and runs the tasks it reads on stdin (see WorkerRunner in workflow.py)
+'''
+
+# The cost distributions of parameter combinations, each with a mean of 1
+costdistributions={
+    "constant": lambda rng: 1.0,
+    "uniform": lambda rng: rng.uniform(0.5,1.5),
+    "lognormal": lambda rng: rng.lognormvariate(-0.5,1.0),
+    "pareto": lambda rng: rng.paretovariate(2.0)/2.0,
+}
+
+# The value sets of an experiment as (variable, values) with stepped value sets expanded
+def experimentvaluesets(experiment):
+    valuesets=[]
+    for valueset in experiment.getElementsByTagName("enumeratedValueSet"):
+        valuesets.append((valueset.getAttribute("variable"),[value.getAttribute("value") for value in valueset.getElementsByTagName("value")]))
+    for valueset in experiment.getElementsByTagName("steppedValueSet"):
+        first=Decimal(valueset.getAttribute("first"))
+        step=Decimal(valueset.getAttribute("step"))
+        last=Decimal(valueset.getAttribute("last"))
+        valuesets.append((valueset.getAttribute("variable"),[numbertext(first+i*step) for i in range(int((last-first)/step)+1)]))
+    return valuesets
+
+# A number as NetLogo writes it, without trailing zeros (0.50 -> 0.5 and 1.0 -> 1), so a combination has the same
+# values (and cost) whether its experiment has a stepped or an enumerated value set
+def numbertext(number):
+    text=str(number)
+    if "." in text and "E" not in text:
+        text=text.rstrip("0").rstrip(".")
+    return text
+
+# The variables of an experiment and its parameter combinations, each as (key, values)
+# The key names the combination whatever the order of its value sets in a sub-experiment
+def experimentcombinations(experiment):
+    valuesets=sorted(experimentvaluesets(experiment))
+    variables=[variable for variable,values in valuesets]
+    combinations=[]
+    for combination in itertools.product(*[values for variable,values in valuesets]):
+        combinations.append((";".join(variable+"="+value for variable,value in zip(variables,combination)),combination))
+    return variables,combinations
+
+# The cost of every parameter combination of an experiment (each run of it takes cost times the run time)
+def combinationcosts(experiment,distribution):
+    return [costdistributions[distribution](random.Random(zlib.crc32(key))) for key,values in experimentcombinations(experiment)[1]]
+
+# Write the table of an experiment as headless NetLogo does : the BehaviorSpace header block, then a row per run
+# (per step with runMetricsEveryStep) with its run number, parameter values, step and metrics
+# A metric is 100 times the cost of the combination with some noise, so replicates differ
+def writetable(f,model,name,experiment,distribution):
+    variables,combinations=experimentcombinations(experiment)
+    metrics=[metric.firstChild.data for metric in experiment.getElementsByTagName("metric") if metric.firstChild!=None]
+    repetitions=int(experiment.getAttribute("repetitions") or 1)
+    timelimits=experiment.getElementsByTagName("timeLimit")
+    laststep=int(timelimits[0].getAttribute("steps")) if len(timelimits)>0 else 0
+    steps=range(laststep+1) if experiment.getAttribute("runMetricsEveryStep")=="true" else [laststep]
+    table=csv.writer(f,quoting=csv.QUOTE_ALL,lineterminator="\n")
+    table.writerows([["BehaviorSpace results (fake-netlogo.py)"],[model],[name],[time.strftime("%m/%d/%Y %H:%M:%S")],
+                     ["min-pxcor","max-pxcor","min-pycor","max-pycor"],["-16","16","-16","16"],
+                     ["[run number]"]+variables+["[step]"]+metrics])
+    run=0
+    for key,values in combinations:
+        cost=costdistributions[distribution](random.Random(zlib.crc32(key)))
+        for repetition in range(repetitions):
+            run+=1
+            rng=random.Random(zlib.crc32(key+";"+name+";"+str(run)))
+            for step in steps:
+                table.writerow([run]+list(values)+[step]+["%.4f"%(100.0*cost+rng.gauss(0.0,10.0)) for metric in metrics])
+
+# Keep a CPU busy for a number of seconds
+def burn(seconds):
+    end=time.time()+seconds
+    while time.time()<end:
+        pass
+
+# Run the experiments of a task (the arguments of runabm.sh) and return a return code
+def runtask(args,runtime,jobid,distribution="constant",burncpu=False):
+    if len(args)!=4:
+        print >>sys.stderr," [ ERROR ] Expected <NETLOGO MODEL FILE> <EXPERIMENT FILE> <EXPERIMENT NAME> <NUMBER OF THREADS>"
+        return 1
+    model,expfile,experimentname,threads=args
+    if not os.path.exists(model):
+        print >>sys.stderr,"Netlogo model not found :",model
+        return 2
+    names=experimentname.split() # Several experiments of the file may be named, as runabm.sh allows
+    if expfile.count(":")>=2 and expfile.rsplit(":",2)[0].endswith(".json"):
+        localdir=os.environ.get("TMPDIR",".")
+        command=[os.path.dirname(os.path.abspath(__file__))+"/parse-experiment.py","--materialize="+expfile,"--name="+experimentname,"-d",localdir]
+        try:
+            names=subprocess.check_output(command).split()
+        except subprocess.CalledProcessError:
+            print >>sys.stderr," [ ERROR ] Problem building sub-experiment :",expfile
+            return 4
+        expfile=localdir+"/subexperiment."+experimentname+".xml"
+    if not os.path.exists(expfile):
+        print >>sys.stderr,"Experiment file not found :",expfile
+        return 3
+    experiments=dict((experiment.getAttribute("name"),experiment) for experiment in minidom.parse(expfile).getElementsByTagName("experiment"))
+    for name in names:
+        if name not in experiments:
+            print >>sys.stderr," [ ERROR ] Experiment not found :",name
+            return 100
+        repetitions=int(experiments[name].getAttribute("repetitions") or 1)
+        costs=[cost*runtime for cost in combinationcosts(experiments[name],distribution) for repetition in range(repetitions)]
+        runs=len(costs)
+        threads=max(int(threads),1)
+        print >>sys.stderr,"Running experiment :",name,"with",runs,"simulations on",threads,"threads"
+        # As in runabm.sh the table is renamed once complete
+        table="out.table."+model+"."+name+"."+jobid+".csv"
+        parttable=table+".part"+str(os.getpid())
+        with open(parttable,'w') as f:
+            # The simulations are shared by the threads as NetLogo does
+            if burncpu and threads>1:
+                pool=multiprocessing.Pool(threads)
+                pool.map(burn,costs,chunksize=1)
+                pool.close()
+                pool.join()
+            elif burncpu:
+                burn(sum(costs))
+            else:
+                time.sleep(sum(costs)/threads)
+            writetable(f,model,name,experiments[name],distribution)
+        os.rename(parttable,table)
+    return 0
+
+# Main program code
+def main():
+    options="[--startup=<seconds>] [--runtime=<mean seconds per simulation>] [--cost="+"|".join(sorted(costdistributions))+"] [--burn]"
+    usage="fake-netlogo.py "+options+" <NETLOGO MODEL FILE> <EXPERIMENT FILE> <EXPERIMENT NAME> <NUMBER OF THREADS>\n"
+    usage+="fake-netlogo.py "+options+" --worker"
+    try:
+        opts,args=getopt.getopt(sys.argv[1:],"",["startup=","runtime=","cost=","burn","worker"])
+    except getopt.GetoptError:
+        print >>sys.stderr,usage
+        sys.exit(1)
+
+    startup=1.0 # Roughly what starting a JVM and loading NetLogo costs
+    runtime=0.01
+    distribution="constant"
+    burncpu=False # Sleep unless asked to burn CPU
+    worker=False
+    for opt, arg in opts:
+        if opt=="--startup":
+            startup=float(arg)
+        if opt=="--runtime":
+            runtime=float(arg)
+        if opt=="--cost":
+            distribution=arg
+        if opt=="--burn":
+            burncpu=True
+        if opt=="--worker":
+            worker=True
+    if distribution not in costdistributions or (not worker and len(args)!=4):
+        print >>sys.stderr,usage
+        sys.exit(1)
+
+    # Tables are named after the PBS job id, or the task id given by workflow.py, as in runabm.sh
+    jobid=os.environ.get("PBS_JOBID",os.environ.get("NAWS_TASKID",str(os.getpid())))
+    time.sleep(startup)
+
+    if not worker:
+        sys.exit(runtask(args,runtime,jobid,distribution,burncpu))
+
+    # Worker : one task per line on stdin, one reply per task on stdout
+    replies=sys.stdout
+    sys.stdout=sys.stderr
+    for line in iter(sys.stdin.readline,""):
+        fields=line.rstrip("\n").split("\t")
+        try:
+            returncode=runtask(fields[1:],runtime,os.environ.get("PBS_JOBID",fields[0]),distribution,burncpu)
+        except Exception as e:
+            print >>sys.stderr," [ ERROR ] Task",fields[0],"failed :",e
+            returncode=1
+        replies.write("%s\t%i\n"%(fields[0],returncode))
+        replies.flush()
+
+# Run main
+if __name__=="__main__":
+   main()
@@ -0,0 +1,298 @@
+#!/usr/bin/python
+"""
+Copyright (c) 2014 High-Performance Computing and GIS (HPCGIS) Laboratory. All rights reserved.
+Use of this source code is governed by a BSD-style license that can be found in the LICENSE file.
+Authors and contributors: Eric Shook (eshook@kent.edu)
+"""
+
+
+import os
+import re
+import glob
+import heapq
+import json
+import sqlite3
+import sys,getopt
+
+'''
+The generate tasks script will read the subexperiment.* files in the current working directory and:
+ 1. create a series of tasks one per experiment file 
+ 2. pack the tasks into one task manifest per job in the tasklists directory
+    or, with --queue, put them in a queue shared by every job (tasklists/queue.db)
+From Python, createtasks takes the sub-experiments of parseexperiment.createsubexperiments and writetasks writes them
+'''
+
+# Global variables
+
+# Sort key that orders the numbers inside names by value (subexperiment.exp2 before subexperiment.exp10)
+def naturalkey(name):
+    return [int(part) if part.isdigit() else part for part in re.split(r"(\d+)",name)]
+
+# Read the predicted cost of each sub-experiment from the plan written by parse-experiment.py
+# (lines of: name simulations cost). Returns an empty dictionary if there is no plan
+def readplan(planfile):
+    costs={}
+    if os.path.exists(planfile):
+        with open(planfile,'r') as f:
+            for line in f:
+                name,simulations,cost=line.split()
+                costs[name]=float(cost)
+    return costs
+
+# Longest-processing-time (LPT) bin packing of tasks into tasklists
+# Tasks are taken from the most to the least expensive and each goes to the tasklist with the least work so far,
+# which keeps the total work of the tasklists close to each other. Returns the tasklists and their total cost
+def packtasks(tasks,numberofjobs):
+    tasklists=[[] for i in range(numberofjobs)]
+    loads=[(0.0,i) for i in range(numberofjobs)] # A heap of (total cost,tasklist index)
+    for task in sorted(tasks,key=lambda task: (-task["cost"],naturalkey(task["id"]))):
+        load,tasklistindex=heapq.heappop(loads)
+        tasklists[tasklistindex].append(task)
+        heapq.heappush(loads,(load+task["cost"],tasklistindex))
+    totalcosts=[0.0]*numberofjobs
+    for load,tasklistindex in loads:
+        totalcosts[tasklistindex]=load
+    # Tasks are listed in natural task order inside a tasklist
+    for tasklist in tasklists:
+        tasklist.sort(key=lambda task: naturalkey(task["id"]))
+    return tasklists,totalcosts
+
+# Write a tasklist as a task manifest, one task per line in JSON (JSON Lines)
+# An index file (<manifest>.idx) holds the id and byte offset of every task, so a single task
+# can be read without scanning the manifest
+def createtasklist(tasklistfile,tasklist):
+
+    print " Creating",tasklistfile
+
+    with open(tasklistfile,'w') as f, open(tasklistfile+".idx",'w') as idx:
+        offset=0
+        for task in tasklist:
+            line=json.dumps(task,sort_keys=True)+"\n"
+            f.write(line)
+            idx.write("%s %i\n"%(task["id"],offset))
+            offset+=len(line)
+
+# Write the tasks to a queue shared by every job of the workflow, an SQLite database (see SharedQueue in workflow.py)
+# Jobs claim tasks from it while they run instead of running a fixed tasklist each
+def createqueue(queuefile,tasks):
+
+    print " Creating",queuefile
+
+    if os.path.exists(queuefile):
+        os.remove(queuefile)
+    db=sqlite3.connect(queuefile)
+    db.execute("""CREATE TABLE tasks (id TEXT PRIMARY KEY, stage INTEGER, cost REAL, cores INTEGER, memory INTEGER, spawns INTEGER DEFAULT 0,
+        task TEXT, state TEXT DEFAULT 'pending', owner TEXT, heartbeat REAL, attempts INTEGER DEFAULT 0)""")
+    db.execute("CREATE TABLE deps (id TEXT, dep TEXT)")
+    db.execute("CREATE INDEX tasksbystate ON tasks (state,cost)")
+    db.execute("CREATE INDEX depsbyid ON deps (id)")
+    inserttasks(db,tasks)
+    db.commit()
+    db.close()
+
+# Add tasks to a queue while the workflow runs, the jobs claim them like the others
+# A task that adds tasks to the queue itself is marked with "spawns", so jobs wait for it before they stop
+def appendqueue(queuefile,tasks):
+
+    print " Adding",len(tasks),"tasks to",queuefile
+
+    db=sqlite3.connect(queuefile,timeout=300,isolation_level=None)
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        inserttasks(db,tasks)
+        db.execute("COMMIT")
+    except:
+        db.execute("ROLLBACK")
+        raise
+    db.close()
+
+# Insert tasks and their deps in a queue, tasks already in it are kept (adding tasks again is harmless)
+def inserttasks(db,tasks):
+    db.executemany("INSERT OR IGNORE INTO tasks (id,stage,cost,cores,memory,spawns,task) VALUES (?,?,?,?,?,?,?)",
+        [(task["id"],task["stage"],task["cost"],task["cores"],task["memory"],int(task.get("spawns",False)),json.dumps(task,sort_keys=True)) for task in tasks])
+    db.executemany("INSERT INTO deps (id,dep) SELECT ?,? WHERE NOT EXISTS (SELECT 1 FROM deps WHERE id=? AND dep=?)",
+        [(task["id"],dep,task["id"],dep) for task in tasks for dep in task.get("deps",[])])
+
+# The memory (MB) used by a NetLogo task with numberofthreads threads
+# This mirrors the heap, perm and code cache sizes set in runabm.sh
+def taskmemory(numberofthreads):
+    return numberofthreads*512+max(numberofthreads*32,128)+max(numberofthreads*64,256)
+
+# This function creates a task for an experiment file
+# A task holds everything needed to run it: the program, its arguments, its resources and a cost hint
+def createtask(taskid,expfile,runabmexec,netlogomodel,numberofthreads,experimentname=None,cost=1.0):
+
+    if experimentname==None:
+        experimentname=expfile.split(".")[-2].strip() 
+
+    task={}
+    task["id"]=taskid
+    task["stage"]=int(taskid.split(".")[0]) # Tasks of a stage only run after the previous stages
+    task["experiment"]=experimentname
+    task["program"]=runabmexec
+    #<NETLOGO MODEL FILE> <EXPERIMENT FILE> <EXPERIMENT NAME> <NUMBER OF THREADS>
+    task["args"]=[netlogomodel,expfile,experimentname,str(numberofthreads)]
+    task["cores"]=numberofthreads
+    task["memory"]=taskmemory(numberofthreads)
+    task["cost"]=cost
+    # The result tables runabm.sh writes (one per experiment, named after the job), so the workflow
+    # can discard the partial tables of an interrupted task. A task may run several experiments of its
+    # file, named in experimentname separated by spaces
+    task["outputs"]=["out.table."+netlogomodel+"."+name+".*.csv" for name in experimentname.split()]
+    return task
+
+# Read the sub-experiments parse-experiment.py wrote in workflowdir (see parseexperiment.writeplan)
+# Tasks without a predicted cost (no plan) count as one unit of work
+def readsubexperiments(workflowdir):
+    subexperiments=[]
+    rangesfile=workflowdir+"/subexperiments.ranges"
+    if os.path.exists(rangesfile):
+        # Compact sub-experiments are described by a rank range of the experiment in experiment.json (or the
+        # spec file of their part) and the experiment file of a task becomes <experiment.json>:<start>:<end> (see runabm.sh)
+        print "Reading compact sub-experiments from",rangesfile
+        with open(rangesfile,'r') as f:
+            for line in f:
+                fields=line.split()
+                name,start,end=fields[:3]
+                specfilename=fields[3] if len(fields)>3 else "experiment.json"
+                subexperiments.append({"name":name,"expfile":workflowdir+"/"+specfilename+":"+start+":"+end})
+    else:
+        print "dir",workflowdir+"/subexperiment.*"
+        expfiles = glob.glob(workflowdir+"/subexperiment.*") 
+        expfiles.sort(key=naturalkey)
+        for expfile in expfiles:
+            subexperiments.append({"name":expfile.split(".")[-2].strip(),"expfile":expfile})
+
+    print [subexperiment["expfile"] for subexperiment in subexperiments]
+
+    costs=readplan(workflowdir+"/subexperiments.plan")
+    for subexperiment in subexperiments:
+        subexperiment["cost"]=costs.get(subexperiment["name"],1.0)
+    return subexperiments
+
+# Create one task per sub-experiment (as returned by parseexperiment.createsubexperiments or readsubexperiments)
+# The tasks are in stage 1 unless another stage is given
+def createtasks(subexperiments,runabmexec,netlogomodel,numberofthreads,stage=1):
+    tasks=[]
+    expcount=1
+    for subexperiment in subexperiments:
+        taskid=str(stage)+"."+str(expcount)
+        print " Creating task",taskid,"from",subexperiment["expfile"],"using",numberofthreads,"threads"
+        task=createtask(taskid,subexperiment["expfile"],runabmexec,netlogomodel,numberofthreads,subexperiment["name"],subexperiment.get("cost",1.0))
+        tasks.append(task)
+        expcount+=1
+
+    print "Finished generating tasks"
+    return tasks
+
+# Write the tasks for the jobs in workflowdir/tasklists : packed into one tasklist per job or, with queue,
+# in a queue shared by every job. Returns the tasklist files (or the queue file) for submittasklists.submittasklists
+def writetasks(workflowdir,tasks,numberofjobs,numberofthreads,coresperjob=0,queue=False):
+
+    print "Starting to generate task lists"
+
+    print "Creating tasklists directory"
+    tasklistsdir = workflowdir+'/tasklists/'
+    if not os.path.exists(tasklistsdir):
+       os.mkdir(tasklistsdir)
+
+    slots=1
+    if coresperjob>0:
+        slots=max(coresperjob//numberofthreads,1)
+
+    if queue:
+        # Jobs balance the work themselves by pulling from the queue, so the predicted runtime
+        # is the total work shared by every slot of the jobs (but not less than the longest task)
+        createqueue(tasklistsdir+"queue.db",tasks)
+        totalcost=sum(task["cost"] for task in tasks)
+        longest=max(task["cost"] for task in tasks) if len(tasks)>0 else 0
+        print "Predicted work for %i jobs (%i tasks at a time per job)"%(numberofjobs,slots)
+        print " queue : %i tasks, predicted cost %g, predicted runtime %g"%(len(tasks),totalcost,max(totalcost/(slots*numberofjobs),longest))
+        return [tasklistsdir+"queue.db"]
+
+    tasklists,totalcosts=packtasks(tasks,numberofjobs)
+    tasklistfiles=[]
+    for i in range(numberofjobs):
+        tasklist=tasklists[i]
+        tasklistfiles.append(tasklistsdir+"tasklist"+str(i)+".jsonl")
+        createtasklist(tasklistfiles[-1],tasklist)
+
+    # Summarize the predicted work of each tasklist to help size the walltime of the jobs
+    # The cost is in the units of the cost model (seconds when fitted from timings) or in simulations without one
+    # and a job runs cores/threads tasks at a time, so its predicted runtime is its cost divided by that
+    print "Predicted work per tasklist (%i tasks at a time per job)"%slots
+    for i in range(numberofjobs):
+        print " tasklist%i : %i tasks, predicted cost %g, predicted runtime %g"%(i,len(tasklists[i]),totalcosts[i],totalcosts[i]/slots)
+    if sum(totalcosts)>0:
+        print "Predicted imbalance ratio (largest/average tasklist) : %.3f"%(max(totalcosts)/(sum(totalcosts)/numberofjobs))
+    return tasklistfiles
+
+# Main program code
+def main():
+
+    try:
+        opts,args=getopt.getopt(sys.argv[1:],"r:m:n:d:j:c:",["runabmexec=","model=","num=","dir=","jobs=","cores=","queue"])
+    except getopt.GetoptError:
+        print "generate-tasks.py -m <netlogo model> -r <runabmexec> -n <number of threads per task> -d <workflow directory> -j <number of jobs> [-c <cores per node>] [--queue]"
+        sys.exit(1)
+
+    runabmexec=""
+    netlogomodel=""
+    workflowdir=""
+    numberofthreads=0
+    numberofjobs=0
+    coresperjob=0 # Only used to predict the runtime of each tasklist
+    queue=False # One queue shared by the jobs instead of a tasklist per job
+    err=0
+    for opt, arg in opts:
+        if opt in ("-n", "--num"):
+            numberofthreads=int(arg)
+        if opt in ("-m", "--model"):
+            netlogomodel=arg
+        if opt in ("-r", "--runabmexec"):
+            runabmexec=arg
+        if opt in ("-d", "--dir"):
+            workflowdir=arg
+        if opt in ("-j", "--jobs"):
+            numberofjobs=int(arg)
+        if opt in ("-c", "--cores"):
+            coresperjob=int(arg)
+        if opt=="--queue":
+            queue=True
+    if numberofthreads<=0:
+        print " [ ERROR ] Number of threads per task must be greater than 0"
+        err=1
+    if runabmexec=="":
+        print " [ ERROR ] Must assign runabmexec"
+        err=1
+    if netlogomodel=="": 
+        print " [ ERROR ] Must assign a netlogo model"
+        err=1
+    if workflowdir=="": 
+        print " [ ERROR ] Must assign a workflow directory"
+        err=1
+    if numberofjobs<=0: 
+        print " [ ERROR ] Number of jobs must be greater than 0" 
+        err=1
+
+    print "Number of threads per task",numberofthreads
+    print "Number of jobs",numberofjobs
+
+    if err==1:
+        print "generate-tasks.py -m <netlogo model> -r <runabmexec> -n <number of threads per task> -d <workflow directory> -j <number of jobs> [-c <cores per node>] [--queue]"
+        sys.exit(1)
+
+    print "Starting to generate tasks"
+
+    pworkflowdir="."
+    os.chdir(pworkflowdir)
+
+    print "Current working directory :",os.getcwd()
+
+    subexperiments=readsubexperiments(workflowdir)
+    tasks=createtasks(subexperiments,runabmexec,netlogomodel,numberofthreads)
+    writetasks(workflowdir,tasks,numberofjobs,numberofthreads,coresperjob,queue)
+
+# Run main
+if __name__=="__main__":
+   main()
@@ -0,0 +1,1053 @@
+#!/usr/bin/python
+"""
+Copyright (c) 2014 High-Performance Computing and GIS (HPCGIS) Laboratory. All rights reserved.
+Use of this source code is governed by a BSD-style license that can be found in the LICENSE file.
+Authors and contributors: Eric Shook (eshook@kent.edu)
+"""
+
+import os
+import sys,getopt
+import json
+import hashlib
+import csv
+import math
+import bisect
+import heapq
+from xml.dom import minidom
+from xml.etree import cElementTree as ElementTree
+from xml.sax.saxutils import escape
+from decimal import Decimal
+
+import collectresults
+
+# Example
+# ./parse-experiment.py -m Ache-v1.1b-test2.nlogo -e experiment60a
+# or from Python (as runexperiment.py does, without writing the plan files between the stages)
+#   spec=parseexperiment.loadexperiment("Ache-v1.1b-test2.nlogo","experiment60a",cachedir)
+#   subexperiments=parseexperiment.createsubexperiments(spec,16,directory)
+# Runs already in the result cache of the experiment (see collect-results.py) are dropped from the sweep
+
+# The 'experiments' section of a NetLogo model as a file-like object
+# Lines are handed out one at a time from <experiments> to </experiments>, ignoring the rest of the file,
+# so the XML parser only sees the experiments and the model is only read as far as the parser asks
+class ExperimentsSection(object):
+    def __init__(self,f):
+        self.lines=iter(f)
+        self.started=False
+        self.finished=False
+
+    def read(self,size=-1):
+        if self.finished:
+            return ""
+        for line in self.lines:
+            if not self.started:
+                if not line.strip().startswith("<experiments"):
+                    continue
+                self.started=True
+            if line.strip() in ("</experiments>","<experiments/>"):
+                self.finished=True
+            return line
+        self.finished=True
+        return ""
+
+# Parse out the experiment named experimentname from the 'experiments' section of a NetLogo model
+# The section is parsed incrementally and parsing stops as soon as the experiment is found,
+# other experiments are discarded as they are passed. Returns the XML of the experiment or None
+def parseexperiment(f,experimentname):
+    print " Parsing experiment"
+
+    try:
+        for event,elem in ElementTree.iterparse(ExperimentsSection(f)):
+            if elem.tag=="experiment":
+                if elem.get("name")==experimentname:
+                    elem.tail=None
+                    return ElementTree.tostring(elem)
+                elem.clear() # Not the experiment we are looking for
+    except SyntaxError: # ParseError (no experiments section or malformed XML)
+        pass
+    return None
+
+# The names of the experiments in the 'experiments' section of a NetLogo model
+def experimentnames(f):
+    names=[]
+    try:
+        for event,elem in ElementTree.iterparse(ExperimentsSection(f)):
+            if elem.tag=="experiment":
+                names.append(elem.get("name"))
+                elem.clear()
+    except SyntaxError: # ParseError (no experiments section or malformed XML)
+        pass
+    return names
+
+# Turn the XML of an experiment into a description of it (a spec) that can be cached
+# The master is the experiment without its value sets, which are kept separately in the spec
+def readexperiment(exptext):
+    experiment=minidom.parseString(exptext).documentElement
+
+    valuesets=[]
+    # Iterate over each enumeraed value set to find all parameter combinations
+    for evs in experiment.getElementsByTagName('enumeratedValueSet'):
+        values=[]
+        for val in evs.getElementsByTagName('value'): # for each parameter value
+            values.append(val.attributes["value"].value)
+        valuesets.append(EnumeratedValueSet(evs.attributes["variable"].value,values).tospec())
+
+    # Stepped value sets are kept as first/step/last and expanded on demand
+    for svs in experiment.getElementsByTagName('steppedValueSet'):
+        valuesets.append(SteppedValueSet(svs.attributes["variable"].value,svs.attributes["first"].value,svs.attributes["step"].value,svs.attributes["last"].value).tospec())
+
+    # Remove all enumerated and stepped value sets from experiment (which are grouped currently)
+    # This is necessary, because we will add them back one at a time to represent a single sub-experiment
+    for evs in experiment.getElementsByTagName('enumeratedValueSet')+experiment.getElementsByTagName('steppedValueSet'):
+        experiment.removeChild(evs)
+        evs.unlink()
+
+    spec={}
+    spec["name"]=experiment.attributes["name"].value
+    spec["repetitions"]=int(experiment.attributes["repetitions"].value) # The number of repititions for each parameter combination
+    spec["master"]=experiment.toxml()
+    spec["valuesets"]=valuesets
+    return spec
+
+# Hash the content of a model, so a cached experiment is only used for the exact same model
+def hashmodel(modelfilename):
+    sha=hashlib.sha1()
+    with open(modelfilename,'rb') as f:
+        for chunk in iter(lambda: f.read(1<<20),""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+# Hash a model without its experiments (the lines from <experiments> to </experiments>), so editing the
+# BehaviorSpace experiments of a model keeps the results of its code in the result cache
+def hashmodelcode(modelfilename):
+    sha=hashlib.sha1()
+    inexperiments=False
+    with open(modelfilename,'rb') as f:
+        for line in f:
+            if line.strip().startswith("<experiments"):
+                inexperiments=True
+            if not inexperiments:
+                sha.update(line)
+            if line.strip() in ("</experiments>","<experiments/>"):
+                inexperiments=False
+    return sha.hexdigest()
+
+# Hash what an experiment runs apart from its name, value sets and repetitions (setup, go, metrics, time limit...),
+# so the results of a widened, extended or renamed experiment are still found in the result cache
+def experimenthash(spec):
+    master=minidom.parseString(spec["master"].encode("utf-8")).documentElement
+    for attribute in ("name","repetitions"):
+        if master.hasAttribute(attribute):
+            master.removeAttribute(attribute)
+    for node in list(master.childNodes): # The blanks left by the value sets
+        if node.nodeType==node.TEXT_NODE and node.data.strip()=="":
+            master.removeChild(node)
+    return hashlib.sha1(master.toxml().encode("utf-8")).hexdigest()
+
+# Load the spec of an experiment from a model
+# Specs are cached in cachedir by model content hash and experiment name, so re-launching
+# the same sweep does not parse the model again. An empty cachedir disables the cache
+def loadexperiment(modelfilename,experimentname,cachedir):
+    cachefile=None
+    if cachedir!="":
+        cachefile=os.path.join(cachedir,hashmodel(modelfilename)+"."+hashlib.sha1(experimentname).hexdigest()+".json")
+        try:
+            with open(cachefile,'r') as f:
+                spec=json.load(f)
+            print " Using cached experiment",cachefile
+            return spec
+        except (IOError,ValueError): # Not cached yet (or unreadable), so parse it
+            pass
+
+    with open(modelfilename,'r') as f:
+        exptext=parseexperiment(f,experimentname)
+    if exptext==None:
+        return None
+    spec=readexperiment(exptext)
+
+    if cachefile!=None:
+        try:
+            if not os.path.exists(cachedir):
+                os.makedirs(cachedir)
+            # Write to a temporary file and rename it so a concurrent launch never reads half a spec
+            tmpfile=cachefile+"."+str(os.getpid())
+            with open(tmpfile,'w') as f:
+                json.dump(spec,f)
+            os.rename(tmpfile,cachefile)
+        except (IOError,OSError):
+            print " [ WARNING ] Cannot write experiment cache",cachefile
+    return spec
+
+# From a list of xml.dom experiments write them to a file with the appropriate header/footer
+# to be used by NetLogo to execute sub-experiments
+def writeexperimentsfile(experiments,experimentfilename):
+    f=open(experimentfilename,'w')
+    f.write("<?xml version=\"1.0\" encoding=\"us-ascii\"?>\n<!DOCTYPE experiments SYSTEM \"behaviorspace.dtd\">\n<experiments>\n")
+    for experiment in experiments:
+        f.write(experiment.toxml())
+        f.write("\n")
+    f.write("</experiments>\n")
+    f.close()
+
+# From an xml.dom experiment write it to a file with the appropriate header/footer
+# to be used by NetLogo to execute a sub-experiment
+def writeexperimentfile(experiment,subexperimentdirectory):
+    # Print the experiment file to XML
+    experimentfilename=subexperimentdirectory+"/subexperiment."+experiment.attributes["name"].value+".xml"
+    writeexperimentsfile([experiment],experimentfilename)
+
+# An enumeratedValueSet holds an explicit list of values for a variable
+class EnumeratedValueSet(object):
+    def __init__(self,variable,values):
+        self.variable=variable
+        self.values=values
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self,index):
+        return self.values[index]
+
+    def tospec(self):
+        return {"type":"enumerated","variable":self.variable,"values":self.values}
+
+    # Write the values in [start,end) as an enumeratedValueSet
+    def toxml(self,start,end):
+        string=" \n <enumeratedValueSet variable=\""+self.variable+"\">\n" 
+        for value in self.values[start:end]:
+            val=escape(value,{"\"":"&quot;"}) # NetLogo handles strings using HTML formatting, but Python auto-changes them upon read
+            string+=" <value value=\""+val+"\"/>\n" 
+        string+="</enumeratedValueSet> \n "
+        return string
+
+# A steppedValueSet holds the values first, first+step, ... up to last
+# Values are never materialized, the i-th value is computed on demand (first+i*step)
+# Decimal arithmetic keeps values such as 0.1 exact, so the count and the values match what was written in the model
+class SteppedValueSet(object):
+    def __init__(self,variable,first,step,last):
+        self.variable=variable
+        self.first=Decimal(first)
+        self.step=Decimal(step)
+        self.last=Decimal(last)
+        if self.step==0:
+            raise Exception("steppedValueSet has a step of 0",variable)
+        self.count=max(int((self.last-self.first)/self.step)+1,0)
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self,index):
+        if index<0:
+            index+=self.count
+        if index<0 or index>=self.count:
+            raise IndexError(index)
+        value=str(self.first+index*self.step)
+        if "." in value and "E" not in value:
+            value=value.rstrip("0").rstrip(".") # 0.50 -> 0.5 and 1.00 -> 1
+        return value
+
+    def tospec(self):
+        return {"type":"stepped","variable":self.variable,"first":str(self.first),"step":str(self.step),"last":str(self.last)}
+
+    # Write the values in [start,end) in the compact stepped form (a contiguous range is itself a stepped range)
+    def toxml(self,start,end):
+        return " \n <steppedValueSet variable=\""+self.variable+"\" first=\""+self[start]+"\" step=\""+str(self.step)+"\" last=\""+self[end-1]+"\"/> \n "
+
+# Re-create a value set from its spec
+def valuesetfromspec(valuesetspec):
+    if valuesetspec["type"]=="stepped":
+        return SteppedValueSet(valuesetspec["variable"],valuesetspec["first"],valuesetspec["step"],valuesetspec["last"])
+    return EnumeratedValueSet(valuesetspec["variable"],valuesetspec["values"])
+
+# The value sets of an experiment spec, sorted by variable name so try to align similar experiments
+# The order defines the parameter space, so everything working on ranks or boxes must use this order
+def experimentvaluesets(spec):
+    valuesets=[valuesetfromspec(valuesetspec) for valuesetspec in spec["valuesets"]]
+    valuesets.sort(key=lambda valueset: valueset.variable)
+    return valuesets
+
+# The number of simulations of the experiment described by spec
+def experimentsimulations(spec):
+    simulations=spec["repetitions"]
+    for valueset in experimentvaluesets(spec):
+        simulations*=len(valueset)
+    return simulations
+
+# The metrics of the experiment described by spec, as named in the header of its result tables
+def experimentmetrics(spec):
+    master=minidom.parseString(spec["master"].encode("utf-8")).documentElement
+    return [metric.firstChild.data for metric in master.getElementsByTagName("metric") if metric.firstChild!=None]
+
+# Transform a box (one index range per value set) to XML and add to the experimentmaster xml.dom to create a subexperiment
+# The sub-experiment lists exactly the values inside the box, so its cross product is exactly the box
+def createexperiment(box,valuesets,experimentmaster,experimentgroupcount,repetitions=None,seed=None):
+    # Define a new experiment based on master and append to the name the experimentgroup count for a unique name
+    experiment=experimentmaster.cloneNode(True) # Duplicate master
+    experiment.attributes["name"].value+=str(experimentgroupcount)
+    # A sub-experiment may only run a slice of the repetitions
+    if repetitions!=None:
+        experiment.attributes["repetitions"].value=str(repetitions)
+    # Seed every run with seed+behaviorspace-run-number, where seed already includes the number of runs
+    # planned before this sub-experiment, so no two runs of the whole experiment share a seed
+    if seed!=None:
+        seedcommand="random-seed ("+str(seed)+" + behaviorspace-run-number)\n"
+        setups=experiment.getElementsByTagName('setup')
+        if len(setups)==0:
+            setup=experiment.ownerDocument.createElement('setup')
+            experiment.insertBefore(setup,experiment.firstChild)
+        else:
+            setup=setups[0]
+        setup.normalize()
+        if setup.firstChild==None:
+            setup.appendChild(experiment.ownerDocument.createTextNode(seedcommand))
+        else:
+            setup.firstChild.data=seedcommand+setup.firstChild.data
+    for (start,end),valueset in zip(box,valuesets): # Iterate over each value set and add the values inside the box
+        string=valueset.toxml(start,end)
+        #print "string=",string
+        evsnode=minidom.parseString(string).firstChild # Extract out the XML from the dom
+        #print evsnode.toxml()
+        experiment.appendChild(evsnode) # Add it to the larger subexperiment
+    return experiment
+
+# The number of parameter combinations covered by a box
+def boxsize(box):
+    size=1
+    for start,end in box:
+        size*=end-start
+    return size
+
+# The cost of the [start,end) side of a box along one value set
+# prefix holds the running sum of the cost weights of the value set (None when every value costs the same)
+def sidecost(prefix,start,end):
+    if prefix==None:
+        return float(end-start)
+    return prefix[end]-prefix[start]
+
+# The predicted cost of a box, with the cost of a combination being the product of the weights of its values
+def boxcost(box,prefixes):
+    cost=1.0
+    for (start,end),prefix in zip(box,prefixes):
+        cost*=sidecost(prefix,start,end)
+    return cost
+
+# Split the parameter space into (at most) numberofsubexperiments boxes by recursive bisection
+# A box holds one (start,end) index range per value set, so its cross product is a hyper-rectangle
+# Every cut is made along a single value set, which means the boxes tile the original experiment exactly:
+# each parameter combination belongs to one and only one sub-experiment
+# Without prefixes the cuts balance the number of combinations, with prefixes (see costprefixes) they balance the predicted cost
+# Boxes are yielded one at a time and only the pending halves are kept, so memory does not grow with the sweep
+def tileexperiments(sizes,numberofsubexperiments,prefixes=None):
+    if prefixes==None:
+        prefixes=[None]*len(sizes)
+    stack=[([(0,size) for size in sizes],numberofsubexperiments)]
+    while len(stack)>0:
+        box,parts=stack.pop()
+
+        # Find the value set whose cut best matches the share of sub-experiments going to the left half
+        # (ties go to the longest value set to keep boxes compact)
+        leftparts=parts//2
+        fraction=float(leftparts)/float(max(parts,1))
+        bestdim=-1
+        besterror=None
+        for dim,(start,end) in enumerate(box):
+            length=end-start
+            if length<2:
+                continue # A value set with a single value cannot be split
+            prefix=prefixes[dim]
+            if prefix==None or sidecost(prefix,start,end)<=0:
+                prefix=None
+                cut=start+min(max(int(round(length*fraction)),1),length-1)
+            else:
+                # The running sum is increasing, so search for the cut closest to the target cost
+                target=prefix[start]+sidecost(prefix,start,end)*fraction
+                cut=bisect.bisect_left(prefix,target,start+1,end)
+                if cut>start+1 and target-prefix[cut-1]<prefix[cut]-target:
+                    cut-=1
+                cut=min(max(cut,start+1),end-1)
+            error=abs(sidecost(prefix,start,cut)/sidecost(prefix,start,end)-fraction)
+            if besterror==None or error<besterror or (error==besterror and length>box[bestdim][1]-box[bestdim][0]):
+                bestdim=dim
+                besterror=error
+                bestcut=cut
+
+        if parts<=1 or bestdim<0: # Nothing left to split (either one part requested or a single combination)
+            yield box
+            continue
+
+        left=list(box)
+        right=list(box)
+        left[bestdim]=(box[bestdim][0],bestcut)
+        right[bestdim]=(bestcut,box[bestdim][1])
+        # Push the right half first so boxes come out in parameter order
+        stack.append((right,parts-leftparts))
+        stack.append((left,leftparts))
+
+# Split the ranks [start,end) of a mixed-radix space into boxes (the last size varies fastest)
+# A contiguous range of ranks is the union of at most 2*len(sizes)-1 boxes, which are yielded in rank order
+def rangeboxes(sizes,start,end):
+    if start>=end:
+        return
+    if len(sizes)==0:
+        yield []
+        return
+    stride=1
+    for size in sizes[1:]:
+        stride*=size
+    first,firstoffset=divmod(start,stride)
+    last,lastoffset=divmod(end,stride)
+    if first==last: # The whole range shares the same first index
+        for box in rangeboxes(sizes[1:],firstoffset,lastoffset):
+            yield [(first,first+1)]+box
+        return
+    if firstoffset>0: # Partial head
+        for box in rangeboxes(sizes[1:],firstoffset,stride):
+            yield [(first,first+1)]+box
+        first+=1
+    if last>first: # Full middle
+        yield [(first,last)]+[(0,size) for size in sizes[1:]]
+    if lastoffset>0: # Partial tail
+        for box in rangeboxes(sizes[1:],0,lastoffset):
+            yield [(last,last+1)]+box
+
+# The predicted cost of the ranks [0,rank) of a mixed-radix space
+def rankcost(sizes,prefixes,rank):
+    cost=0.0
+    for box in rangeboxes(sizes,0,rank):
+        cost+=boxcost(box,prefixes)
+    return cost
+
+# Choose how many parts to split the combinations into and how many slices to split the repetitions into
+# When there are at least as many combinations as sub-experiments only the combinations are split (one slice),
+# otherwise the repetitions are sliced too, so experiments with few combinations but many repetitions
+# can still use every sub-experiment. Returns (parts,slices) with parts*slices<=numberofsubexperiments
+def splitrepetitions(count,numberofrepetitions,numberofsubexperiments):
+    if count>=numberofsubexperiments or numberofrepetitions<=1:
+        return (min(count,numberofsubexperiments),1)
+    best=(count,1)
+    for parts in xrange(count,0,-1): # Prefer splitting combinations over splitting repetitions
+        slices=min(numberofrepetitions,numberofsubexperiments//parts)
+        if parts*slices>best[0]*best[1]:
+            best=(parts,slices)
+    return best
+
+# Share numberofsubexperiments slices of repetitions between boxes of the given predicted costs (for one repetition),
+# at least one and at most numberofrepetitions each : one slice at a time goes to the box with the costliest slice
+# (its cost times the repetitions of its largest slice)
+def costslices(costs,numberofrepetitions,numberofsubexperiments):
+    slices=[1]*len(costs)
+    heap=[(-cost*numberofrepetitions,index) for index,cost in enumerate(costs)]
+    heapq.heapify(heap)
+    for extra in xrange(numberofsubexperiments-len(costs)):
+        while len(heap)>0 and slices[heap[0][1]]>=numberofrepetitions:
+            heapq.heappop(heap)
+        if len(heap)==0:
+            break
+        cost,index=heapq.heappop(heap)
+        slices[index]+=1
+        heapq.heappush(heap,(-costs[index]*(-(-numberofrepetitions//slices[index])),index))
+    return slices
+
+# Read a cost model from a JSON file
+# The predicted cost of a simulation is scale times the product of one weight per variable:
+#   {"scale": 12.5,
+#    "variables": {"population": {"exponent": 1.5, "reference": 100},
+#                  "scenario": {"weights": {"\"low\"": 1.0, "\"high\"": 3.0}}}}
+# An exponent gives the weight (value/reference)**exponent, weights give it per value
+# Variables (and values) missing from the model have a weight of 1
+def loadcostmodel(costmodelfilename):
+    with open(costmodelfilename,'r') as f:
+        costmodel=json.load(f)
+    costmodel.setdefault("scale",1.0)
+    costmodel.setdefault("variables",{})
+    return costmodel
+
+# Fit a cost model from past run timings
+# The timings file is a CSV file with a header, one column per variable and a runtime column (or the last column)
+# The model is fitted on the log scale: log(runtime) = log(scale) + sum of log(weight) of each variable,
+# numeric variables get a power law (exponent) and other variables get one weight per value
+def fitcostmodel(timingsfilename):
+    with open(timingsfilename,'r') as f:
+        reader=csv.reader(f)
+        header=[column.strip() for column in next(reader,[])]
+        runtimecolumn=len(header)-1
+        for i,column in enumerate(header):
+            if column.lower()=="runtime":
+                runtimecolumn=i
+        rows=[]
+        for row in reader:
+            if len(row)==len(header) and float(row[runtimecolumn])>0:
+                rows.append(row)
+    if len(rows)==0:
+        raise ValueError("No timings found in "+timingsfilename)
+
+    logtimes=[math.log(float(row[runtimecolumn])) for row in rows]
+    meanlogtime=sum(logtimes)/len(logtimes)
+    costmodel={"scale":math.exp(meanlogtime),"variables":{}}
+    for i,variable in enumerate(header):
+        if i==runtimecolumn:
+            continue
+        values=[row[i].strip() for row in rows]
+        try:
+            logvalues=[math.log(float(value)) for value in values]
+        except ValueError: # Not a (positive) number, so fit one weight per value
+            logvalues=None
+        if logvalues!=None and len(set(logvalues))>1:
+            meanlogvalue=sum(logvalues)/len(logvalues)
+            covariance=sum((x-meanlogvalue)*(y-meanlogtime) for x,y in zip(logvalues,logtimes))
+            variance=sum((x-meanlogvalue)**2 for x in logvalues)
+            costmodel["variables"][variable]={"exponent":covariance/variance,"reference":math.exp(meanlogvalue)}
+        else:
+            logtimesbyvalue={}
+            for value,logtime in zip(values,logtimes):
+                logtimesbyvalue.setdefault(value,[]).append(logtime)
+            weights={}
+            for value in logtimesbyvalue:
+                weights[value]=math.exp(sum(logtimesbyvalue[value])/len(logtimesbyvalue[value])-meanlogtime)
+            costmodel["variables"][variable]={"weights":weights}
+    return costmodel
+
+# The cost weight of a value of a variable in the cost model
+def costweight(costmodel,variable,value):
+    if variable not in costmodel["variables"]:
+        return 1.0
+    model=costmodel["variables"][variable]
+    if "exponent" in model:
+        try:
+            return (float(value)/float(model.get("reference",1.0)))**float(model["exponent"])
+        except ValueError:
+            return 1.0
+    return float(model.get("weights",{}).get(value,1.0))
+
+# Build the running sums of the cost weights of each value set for tileexperiments
+# Value sets without a cost in the model get None, so they are never expanded
+def costprefixes(costmodel,valuesets):
+    prefixes=[]
+    for valueset in valuesets:
+        if valueset.variable not in costmodel["variables"]:
+            prefixes.append(None)
+            continue
+        prefix=[0.0]
+        for i in xrange(len(valueset)):
+            prefix.append(prefix[-1]+costweight(costmodel,valueset.variable,valueset[i]))
+        prefixes.append(prefix)
+    return prefixes
+
+# Decompose the experiment described by spec into rank ranges instead of sub-experiment files
+# A run is ranked by its combination in the parameter space (value sets in experimentvaluesets order)
+# followed by its repetition, and a sub-experiment is only described by its [start,end) range of ranks.
+# Only the spec (experiment.json) and one line per sub-experiment (subexperiments.ranges) are written,
+# the sub-experiment XML is built on the compute node just before launch (see materializeexperiment)
+def generatecompactexperiments(spec,numberofsubexperiments,subexperimentdirectory,planonly=False,partition="tile",costmodel=None,seed=None):
+    experimentname=spec["name"]
+    numberofrepetitions=spec["repetitions"]
+    valuesets=experimentvaluesets(spec)
+    sizes=[len(valueset) for valueset in valuesets]+[numberofrepetitions]
+    numberofruns=1
+    for size in sizes:
+        numberofruns*=size
+    numberofsubexperiments=min(numberofsubexperiments,numberofruns)
+
+    prefixes=[None]*len(sizes)
+    if costmodel!=None:
+        prefixes=costprefixes(costmodel,valuesets)+[None]
+    totalcost=rankcost(sizes,prefixes,numberofruns)
+
+    # Find the start rank of every sub-experiment
+    # tile : every sub-experiment gets the same number of runs
+    # cost : every sub-experiment gets the same predicted cost (binary search on the cost of the ranks before it)
+    starts=[]
+    for i in xrange(numberofsubexperiments):
+        if partition=="cost" and totalcost>0:
+            target=totalcost*i/numberofsubexperiments
+            low,high=0,numberofruns
+            while low<high:
+                middle=(low+high)//2
+                if rankcost(sizes,prefixes,middle)<target:
+                    low=middle+1
+                else:
+                    high=middle
+            starts.append(low)
+        else:
+            starts.append(i*numberofruns//numberofsubexperiments)
+    starts.append(numberofruns)
+
+    # The parts of an experiment left to run each have their own spec file (see uncachedexperiments)
+    specfilename=subexperimentdirectory+"/"+spec.get("specfile","experiment.json")
+    if not planonly:
+        compactspec=dict(spec)
+        compactspec["seed"]=seed
+        with open(specfilename,'w') as f:
+            json.dump(compactspec,f)
+
+    subexperiments=[]
+    experimentgroupcount=0
+    largestcost=0.0
+    for start,end in zip(starts[:-1],starts[1:]):
+        if start>=end:
+            continue
+        groupcost=(rankcost(sizes,prefixes,end)-rankcost(sizes,prefixes,start))
+        if costmodel!=None:
+            groupcost*=costmodel["scale"]
+        name=experimentname+str(experimentgroupcount)
+        if planonly:
+            print " Sub-experiment %s : runs %i-%i, %i simulations, predicted cost %g"%(name,start,end-1,end-start,groupcost)
+        subexperiments.append({"name":name,"expfile":specfilename+":%i:%i"%(start,end),"start":start,"end":end,
+                               "simulations":end-start,"cost":groupcost})
+        experimentgroupcount+=1
+        largestcost=max(largestcost,groupcost)
+
+    if planonly:
+        print "Simulation ranges planned (nothing written) :",experimentgroupcount
+    else:
+        print "Simulation ranges planned :",experimentgroupcount
+    print "Simulations planned across sub-experiments : %i of %i (redundant simulations: 0)"%(numberofruns,numberofruns)
+    if totalcost>0:
+        if costmodel!=None:
+            totalcost*=costmodel["scale"]
+        print "Predicted imbalance ratio (largest/average sub-experiment cost) : %.3f"%(largestcost/(totalcost/experimentgroupcount))
+    return subexperiments
+
+# The experiments of a compact sub-experiment (the runs [start,end) of the experiment described by spec)
+# The range is split into boxes and each box becomes an experiment named <name>.<box number>
+def rangeexperiments(spec,start,end,name):
+    valuesets=experimentvaluesets(spec)
+    sizes=[len(valueset) for valueset in valuesets]+[spec["repetitions"]]
+    experimentmaster=minidom.parseString(spec["master"].encode("utf-8")).documentElement
+    experimentmaster.attributes["name"].value=name+"."
+
+    experiments=[]
+    runoffset=start
+    for box in rangeboxes(sizes,start,end):
+        repetitions=box[-1][1]-box[-1][0]
+        seed=None
+        if spec.get("seed")!=None:
+            seed=spec["seed"]+runoffset # The seed offset is the rank of the first run in this box
+        experiments.append(createexperiment(box[:-1],valuesets,experimentmaster,len(experiments),repetitions,seed))
+        runoffset+=boxsize(box)
+    return experiments
+
+# Build the XML of a compact sub-experiment in <subexperimentdirectory>/subexperiment.<name>.xml (see rangeexperiments)
+# Returns the names of the experiments in the file
+def materializeexperiment(spec,start,end,name,subexperimentdirectory):
+    experiments=rangeexperiments(spec,start,end,name)
+    writeexperimentsfile(experiments,subexperimentdirectory+"/subexperiment."+name+".xml")
+    return [experiment.attributes["name"].value for experiment in experiments]
+
+# Build the XML of the sub-experiments [start,end) of a bundle (see bundlesubexperiments) in
+# <subexperimentdirectory>/subexperiment.<name>.xml, their experiments renamed <name>.<experiment number>
+# The spec files of its compact sub-experiments are in bundledirectory. Returns the names of the experiments in the file
+def materializebundle(bundle,start,end,name,bundledirectory,subexperimentdirectory):
+    experiments=[]
+    for subexperiment in bundle["bundle"][start:end]:
+        if "experiments" in subexperiment:
+            experiments+=[minidom.parseString(experiment.encode("utf-8")).documentElement for experiment in subexperiment["experiments"]]
+            continue
+        specfilename,subexperimentstart,subexperimentend=subexperiment["expfile"].rsplit(":",2)
+        with open(bundledirectory+"/"+specfilename,'r') as f:
+            spec=json.load(f)
+        experiments+=rangeexperiments(spec,int(subexperimentstart),int(subexperimentend),name)
+    for number,experiment in enumerate(experiments):
+        experiment.setAttribute("name",name+"."+str(number))
+    writeexperimentsfile(experiments,subexperimentdirectory+"/subexperiment."+name+".xml")
+    return [experiment.attributes["name"].value for experiment in experiments]
+
+# Decompose the experiment described by spec into sub-experiments (one per box of the parameter space)
+# Unless writefiles, the files are left to the caller and each sub-experiment keeps what boxexperiment needs to build it
+def generateexperiments(spec,numberofsubexperiments,subexperimentdirectory,planonly=False,partition="tile",costmodel=None,seed=None,writefiles=True):
+
+    print " Generating experiments"
+
+    experimentname=spec["name"]
+    numberofrepetitions=spec["repetitions"]
+    print " Experiment %s found (number of repetitions=%i)"%(experimentname,numberofrepetitions)
+
+    # Store the value sets (enumerated and stepped) of the experiment in a list
+    valuesets=experimentvaluesets(spec)
+
+    numberofexperiments=1
+    for valueset in valuesets:
+        numberofexperiments*=len(valueset)
+    print "The total number of simulations is",numberofexperiments*numberofrepetitions
+
+    # The experiment is the cross product of every value set, so the number of parameter combinations
+    # is simply the product of the value set sizes (no need to enumerate them)
+    count=numberofexperiments
+    print "The total number of experiments generated is",count
+
+    # The master experiment has no value sets, they are added back one box at a time to represent a single sub-experiment
+    experimentmaster=minidom.parseString(spec["master"].encode("utf-8")).documentElement
+
+    # Build a set of sub-experiment (xml) files, one per box of the parameter space
+    # Grouping consecutive combinations of the cross product would not work here, because NetLogo runs the full
+    # cross product of each value set and a group crossing a boundary expands into a superset of its combinations
+    # The boxes come from a generator and each file is written as soon as its box is known
+    # tile : every sub-experiment gets (about) the same number of combinations
+    # cost : every sub-experiment gets (about) the same predicted cost from the cost model
+    # Each box is further split into slices of repetitions when there are fewer combinations than sub-experiments,
+    # the same number for every box (tile) or a number in proportion to the predicted cost of the box (cost)
+    parts,slices=splitrepetitions(count,numberofrepetitions,numberofsubexperiments)
+
+    prefixes=[None]*len(valuesets)
+    if costmodel!=None:
+        prefixes=costprefixes(costmodel,valuesets)
+    if partition=="cost":
+        boxes=tileexperiments([len(valueset) for valueset in valuesets],parts,prefixes)
+    else:
+        boxes=tileexperiments([len(valueset) for valueset in valuesets],parts)
+    boxslices=None
+    if slices>1 and partition=="cost":
+        boxes=list(boxes) # At most numberofsubexperiments boxes
+        boxslices=costslices([boxcost(box,prefixes) for box in boxes],numberofrepetitions,numberofsubexperiments)
+        print "Repetitions split into %i to %i slices per group of combinations (%i groups)"%(min(boxslices),max(boxslices),len(boxes))
+    elif slices>1:
+        print "Repetitions split into %i slices per group of combinations (%i groups)"%(slices,parts)
+
+    subexperiments=[]
+    simulationcount=0 # This parameter counts the number of simulations planned across all sub-experiments
+    experimentgroupcount=0 # This parameter counts the number of experiment groups
+    smallestgroup=None
+    largestgroup=0
+    totalcost=0.0
+    largestcost=0.0
+    for index,box in enumerate(boxes):
+        groupsize=boxsize(box)
+        if boxslices!=None:
+            slices=boxslices[index]
+        for repslice in xrange(slices):
+            # This sub-experiment runs repetitions [firstrepetition,lastrepetition) of every combination in the box
+            firstrepetition=repslice*numberofrepetitions//slices
+            lastrepetition=(repslice+1)*numberofrepetitions//slices
+            repetitions=lastrepetition-firstrepetition
+            groupcost=boxcost(box,prefixes)*repetitions
+            if costmodel!=None:
+                groupcost*=costmodel["scale"]
+            if planonly:
+                print " Sub-experiment %s%i : %i combinations, %i simulations (repetitions %i-%i), predicted cost %g"%(experimentname,experimentgroupcount,groupsize,groupsize*repetitions,firstrepetition+1,lastrepetition,groupcost)
+            subseed=None
+            if seed!=None:
+                subseed=seed+simulationcount # The seed offset is the number of runs planned before this sub-experiment
+            if not planonly and writefiles:
+                experiment=createexperiment(box,valuesets,experimentmaster,experimentgroupcount,repetitions,subseed) # Create a DOM based on the box that can be written
+                writeexperimentfile(experiment,subexperimentdirectory)
+            name=experimentname+str(experimentgroupcount)
+            subexperiments.append({"name":name,"expfile":subexperimentdirectory+"/subexperiment."+name+".xml","simulations":groupsize*repetitions,"cost":groupcost})
+            if not writefiles:
+                subexperiments[-1].update({"spec":spec,"box":box,"number":experimentgroupcount,"repetitions":repetitions,"seed":subseed})
+            simulationcount+=groupsize*repetitions
+            experimentgroupcount+=1
+            totalcost+=groupcost
+            largestcost=max(largestcost,groupcost)
+        if smallestgroup==None or groupsize<smallestgroup:
+            smallestgroup=groupsize
+        largestgroup=max(largestgroup,groupsize)
+
+    if planonly:
+        print "Simulation groups planned (nothing written) :",experimentgroupcount
+    elif not writefiles:
+        print "Simulation groups planned :",experimentgroupcount
+    else:
+        print "Simulation group files written :",experimentgroupcount
+    print "Combinations per sub-experiment : smallest %i, largest %i"%(smallestgroup,largestgroup)
+    print "Simulations planned across sub-experiments : %i of %i (redundant simulations: %i)"%(simulationcount,count*numberofrepetitions,simulationcount-count*numberofrepetitions)
+    # The imbalance ratio is the largest sub-experiment over the average one (1.0 is perfectly balanced)
+    # and it bounds how long the whole experiment waits on its heaviest sub-experiment
+    if totalcost>0:
+        print "Predicted imbalance ratio (largest/average sub-experiment cost) : %.3f"%(largestcost/(totalcost/experimentgroupcount))
+    return subexperiments
+
+# Decompose the experiment described by spec into numberofsubexperiments sub-experiments, written as XML files
+# or, when compact, described by rank ranges of experiment.json (both in subexperimentdirectory)
+# Returns the sub-experiments (name, experiment file, simulations and predicted cost) for generatetasks.createtasks
+# Unless writefiles, the XML files are not written (see generateexperiments)
+def createsubexperiments(spec,numberofsubexperiments,subexperimentdirectory,compact=False,planonly=False,partition="tile",costmodel=None,seed=None,writefiles=True):
+    if compact:
+        return generatecompactexperiments(spec,numberofsubexperiments,subexperimentdirectory,planonly,partition,costmodel,seed)
+    return generateexperiments(spec,numberofsubexperiments,subexperimentdirectory,planonly,partition,costmodel,seed,writefiles)
+
+# The XML experiment of a sub-experiment whose file generateexperiments left to the caller : the repetitions of its box
+def boxexperiment(subexperiment):
+    spec=subexperiment["spec"]
+    experimentmaster=minidom.parseString(spec["master"].encode("utf-8")).documentElement
+    return createexperiment(subexperiment["box"],experimentvaluesets(spec),experimentmaster,subexperiment["number"],subexperiment["repetitions"],subexperiment["seed"])
+
+# Cover the combinations that need runs with boxes, each needing the same number of repetitions
+# need maps the value indices of a combination of the space of sizes to the repetitions it needs when they differ
+# from default, so only those combinations are visited. The values of the first value set whose combinations need
+# the same runs are grouped and the rest of the space is covered the same way, so a widened value set or added
+# repetitions give a single box. Returns (box,repetitions) where a box lists the indices of the values of each value set
+def coverboxes(sizes,need,default=0):
+    if len(need)==0:
+        return [([xrange(size) for size in sizes],default)] if default>0 else []
+    if len(sizes)==0:
+        return [([],need[()])] if need[()]>0 else []
+    slices={}
+    for combination,repetitions in need.iteritems():
+        slices.setdefault(combination[0],{})[combination[1:]]=repetitions
+    groups={}
+    order=[]
+    for index in xrange(sizes[0]):
+        pattern=frozenset(slices.get(index,{}).iteritems())
+        if pattern not in groups:
+            groups[pattern]=[]
+            order.append(pattern)
+        groups[pattern].append(index)
+    boxes=[]
+    for pattern in order:
+        for box,repetitions in coverboxes(sizes[1:],dict(pattern),default):
+            boxes.append(([groups[pattern]]+box,repetitions))
+    return boxes
+
+# Drop the runs already in the result cache from the experiment described by spec
+# cached maps the value indices of a combination (in experimentvaluesets order) to its cached repetitions
+# (see collectresults.cachedrepetitions). Returns the specs of the parts of the experiment left to run, or [spec]
+# when nothing is cached. The parts are named <name>_<cached runs>_<part>_, so their sub-experiments and tables differ
+# from those of the sweep and of the follow-up sweeps planned from another state of the cache (see collectresults.collecttable)
+def uncachedexperiments(spec,cached):
+    need=dict((combination,max(spec["repetitions"]-repetitions,0)) for combination,repetitions in cached.iteritems() if repetitions>0)
+    if len(need)==0:
+        return [spec]
+    return partexperiments(spec,need,spec["repetitions"],"_"+str(sum(cached.values())))
+
+# The parts of the experiment described by spec that run need[combination] repetitions of a combination (its value
+# indices) and default repetitions of the combinations not in need, one part per box of combinations needing the same
+# repetitions (see coverboxes). The parts are named <name><prefix>_<part>_ and their spec is written to experiment.<part name>.json
+def partexperiments(spec,need,default=0,prefix=""):
+    valuesets=experimentvaluesets(spec)
+    sizes=[len(valueset) for valueset in valuesets]
+    parts=[]
+    for box,repetitions in coverboxes(sizes,need,default):
+        part=dict(spec)
+        part["name"]=spec["name"]+prefix+"_"+str(len(parts))+"_"
+        master=minidom.parseString(spec["master"].encode("utf-8")).documentElement
+        master.setAttribute("name",part["name"])
+        part["master"]=master.toxml()
+        part["repetitions"]=repetitions
+        part["valuesets"]=[valueset.tospec() if len(indices)==len(valueset) else EnumeratedValueSet(valueset.variable,[valueset[index] for index in indices]).tospec()
+                           for valueset,indices in zip(valuesets,box)]
+        part["specfile"]="experiment."+part["name"]+".json"
+        parts.append(part)
+    return parts
+
+# Decompose the parts of an experiment left to run (see uncachedexperiments) into numberofsubexperiments
+# sub-experiments in all, shared between the parts by their number of simulations. A part gets at least one,
+# so when there are more parts than sub-experiments the smallest are bundled (see bundlesubexperiments)
+# The runs of each part are seeded after those of the parts before it. Sub-experiment files are only written once
+# the bundles are known, so those of bundled sub-experiments are never written
+def createpartsubexperiments(specs,numberofsubexperiments,subexperimentdirectory,compact=False,planonly=False,partition="tile",costmodel=None,seed=None):
+    if len(specs)==1:
+        return createsubexperiments(specs[0],numberofsubexperiments,subexperimentdirectory,compact,planonly,partition,costmodel,seed)
+    total=sum(experimentsimulations(spec) for spec in specs)
+    subexperiments=[]
+    offset=0
+    for spec in specs:
+        simulations=experimentsimulations(spec)
+        count=max(numberofsubexperiments*simulations//total,1)
+        print "Part %s : %i simulations (%i repetitions) in %i sub-experiments"%(spec["name"],simulations,spec["repetitions"],count)
+        subexperiments+=createsubexperiments(spec,count,subexperimentdirectory,compact,planonly,partition,costmodel,None if seed==None else seed+offset,False)
+        offset+=simulations
+    subexperiments=bundlesubexperiments(subexperiments,numberofsubexperiments,subexperimentdirectory,planonly)
+    if not planonly:
+        for subexperiment in subexperiments:
+            if "box" in subexperiment:
+                writeexperimentfile(boxexperiment(subexperiment),subexperimentdirectory)
+    return subexperiments
+
+# Bundle the sub-experiments into numberofsubexperiments tasks of about the same predicted cost when there are
+# more of them (the costliest first, each into the cheapest bundle). A bundle is named after its first sub-experiment
+# and described by <subexperimentdirectory>/bundle.<name>.json, which holds the experiments of its sub-experiments
+# (see boxexperiment) and the rank ranges of its compact sub-experiments. It runs as the compact
+# sub-experiment bundle.<name>.json:0:<number of sub-experiments> (see materializebundle)
+def bundlesubexperiments(subexperiments,numberofsubexperiments,subexperimentdirectory,planonly=False):
+    if len(subexperiments)<=numberofsubexperiments:
+        return subexperiments
+    bundles=[[] for i in xrange(numberofsubexperiments)]
+    costs=[0.0]*numberofsubexperiments
+    for subexperiment in sorted(subexperiments,key=lambda subexperiment: -subexperiment["cost"]):
+        cheapest=costs.index(min(costs))
+        bundles[cheapest].append(subexperiment)
+        costs[cheapest]+=subexperiment["cost"]
+
+    bundled=[]
+    for bundle in bundles:
+        bundlefilename=subexperimentdirectory+"/bundle."+bundle[0]["name"]+".json"
+        if not planonly:
+            members=[]
+            for subexperiment in bundle:
+                if "start" in subexperiment:
+                    members.append({"expfile":os.path.basename(subexperiment["expfile"])})
+                    continue
+                members.append({"experiments":[boxexperiment(subexperiment).toxml()]})
+            with open(bundlefilename,'w') as f:
+                json.dump({"bundle":members},f)
+        bundled.append({"name":bundle[0]["name"],"expfile":bundlefilename+":0:%i"%len(bundle),"start":0,"end":len(bundle),
+                        "simulations":sum(subexperiment["simulations"] for subexperiment in bundle),
+                        "cost":sum(subexperiment["cost"] for subexperiment in bundle)})
+    print "Sub-experiments bundled into",len(bundled),"tasks"
+    return bundled
+
+# Write the plan of the sub-experiments for generate-tasks.py when it runs as a separate script
+# The plan file lists the number of simulations and the predicted cost of every sub-experiment
+# and, for compact sub-experiments and bundles, the ranges file their rank range and spec (or bundle) file
+def writeplan(subexperiments,subexperimentdirectory,compact=False):
+    with open(subexperimentdirectory+"/subexperiments.plan",'w') as f:
+        for subexperiment in subexperiments:
+            f.write("%s %i %r\n"%(subexperiment["name"],subexperiment["simulations"],subexperiment["cost"]))
+    if compact or any("start" in subexperiment for subexperiment in subexperiments):
+        with open(subexperimentdirectory+"/subexperiments.ranges",'w') as f:
+            for subexperiment in subexperiments:
+                specfilename=subexperiment["expfile"].rsplit(":",2)[0]
+                f.write("%s %i %i %s\n"%(subexperiment["name"],subexperiment["start"],subexperiment["end"],os.path.basename(specfilename)))
+        print "Simulation ranges written to",subexperimentdirectory+"/subexperiments.ranges"
+
+def main():
+    usage="parse-experiment.py -m <netlogomodel.nlogo> -e <experiment-name> -n <number of sub-experiments> -d <directory for sub-experiments> [-p tile|cost] [--costmodel=<cost model.json>] [--timings=<timings.csv>] [--seed=<base seed>] [--compact] [--plan-only] [--cache=<cache directory>] [--no-cache] [--result-cache=<result store>] [--no-result-cache]\n"
+    usage+="parse-experiment.py --materialize=<experiment.json or bundle.json>:<start>:<end> --name=<sub-experiment name> -d <directory for sub-experiment>"
+
+    # Try to extract command-line options
+    try:
+        opts,args=getopt.getopt(sys.argv[1:],"m:e:n:d:p:",["model=","experiment=","num=","dir=","partition=","costmodel=","timings=","seed=","compact","plan-only","cache=","no-cache","result-cache=","no-result-cache","materialize=","name="])
+    except getopt.GetoptError:
+        print usage
+        sys.exit(1)
+
+    # Set model filename and experiment name based on command-line parameter
+    modelfilename=""
+    experimentname=""
+    subexperimentdirectory=""
+    numberofsubexperiments=0
+    planonly=False # Only print the counts and sub-experiment sizes, do not write any files
+    cachedir=os.path.expanduser("~/.naws/cache") # Parsed experiments are cached here
+    resultcache=None # The result cache of the experiment (see collectresults.resultcachefile), "" to run every simulation
+    partition="tile" # How to partition the parameter space (see generateexperiments)
+    costmodelfilename=""
+    timingsfilename=""
+    seed=None # Base random seed (runs are seeded only when given)
+    compact=False # Describe sub-experiments by rank ranges rather than writing their XML
+    materialize="" # Build the XML of one compact sub-experiment (on the compute node)
+    subexperimentname=""
+    for opt, arg in opts:
+        if opt in ("-m", "--model"):
+            modelfilename=arg
+        if opt in ("-e", "--experiment"):
+            experimentname=arg
+        if opt in ("-n", "--num"):
+            numberofsubexperiments=int(arg)
+        if opt in ("-d", "--dir"):
+            subexperimentdirectory=arg
+        if opt in ("-p", "--partition"):
+            partition=arg
+        if opt=="--costmodel":
+            costmodelfilename=arg
+        if opt=="--timings":
+            timingsfilename=arg
+        if opt=="--seed":
+            seed=int(arg)
+        if opt=="--compact":
+            compact=True
+        if opt=="--materialize":
+            materialize=arg
+        if opt=="--name":
+            subexperimentname=arg
+        if opt=="--plan-only":
+            planonly=True
+        if opt=="--cache":
+            cachedir=arg
+        if opt=="--no-cache":
+            cachedir=""
+        if opt=="--result-cache":
+            resultcache=arg
+        if opt=="--no-result-cache":
+            resultcache=""
+
+    # Materializing a compact sub-experiment only prints the names of the experiments written, for runabm.sh
+    if materialize!="":
+        try:
+            specfilename,start,end=materialize.rsplit(":",2)
+            with open(specfilename,'r') as f:
+                spec=json.load(f)
+            start,end=int(start),int(end)
+        except (IOError,ValueError):
+            print " [ ERROR ] Cannot read compact sub-experiment",materialize
+            sys.exit(1)
+        if subexperimentname=="" or subexperimentdirectory=="":
+            print usage
+            sys.exit(1)
+        if "bundle" in spec:
+            try:
+                names=materializebundle(spec,start,end,subexperimentname,os.path.dirname(specfilename) or ".",subexperimentdirectory)
+            except (IOError,ValueError):
+                print " [ ERROR ] Cannot read the sub-experiments of bundle",materialize
+                sys.exit(1)
+        else:
+            names=materializeexperiment(spec,start,end,subexperimentname,subexperimentdirectory)
+        for name in names:
+            print name
+        return
+
+    err=0
+    if modelfilename=="":
+        print " [ ERROR ] No model file found"
+        err=1
+    if experimentname=="":
+        print " [ ERROR ] No experiment found"
+        err=1
+    if subexperimentdirectory=="" and not planonly:
+        print " [ ERROR ] No subexperiment directory"
+        err=1
+    if numberofsubexperiments<=0:
+        print " [ ERROR ] Number of subexperiments must be greater than 0"
+        err=1
+    if partition not in ("tile","cost"):
+        print " [ ERROR ] Partition must be tile or cost"
+        err=1
+    if partition=="cost" and costmodelfilename=="" and timingsfilename=="":
+        print " [ ERROR ] Partition cost needs a cost model or timings"
+        err=1
+    if err==1:
+        print usage
+        sys.exit(1)
+    print "Start parsing netlogo model file %s"%modelfilename
+    print "Experiment %s"%experimentname
+    print "Number of sub experiments to generate",numberofsubexperiments
+    print "Directory for subexperiments",subexperimentdirectory
+    # Now I have a netlogo model filename and experiment to parse
+    # Try to open the file and parse 
+    try:
+        spec=loadexperiment(modelfilename,experimentname,cachedir)
+    except IOError:
+        print ' [ ERROR ] Cannot open file %s'%modelfilename
+        sys.exit(1)
+    if spec==None:
+        print " [ ERROR ] Experiment",experimentname,"not found"
+        sys.exit(1)
+
+    # Load the cost model or fit one from the timings of past runs
+    costmodel=None
+    try:
+        if costmodelfilename!="":
+            costmodel=loadcostmodel(costmodelfilename)
+        elif timingsfilename!="":
+            costmodel=fitcostmodel(timingsfilename)
+            print "Cost model fitted from",timingsfilename,":",json.dumps(costmodel)
+    except (IOError,ValueError) as e:
+        print " [ ERROR ] Cannot read cost model :",e
+        sys.exit(1)
+
+    # Only the runs missing from the result cache are planned
+    specs=[spec]
+    if resultcache!="":
+        specs=collectresults.pendingexperiments(spec,resultcache or collectresults.resultcachefile(modelfilename,spec))
+    if len(specs)==0:
+        print "Every simulation of the experiment is in the result cache, nothing to run"
+        return
+
+    # Generate the job files after decomposing the experiment 
+    subexperiments=createpartsubexperiments(specs,numberofsubexperiments,subexperimentdirectory,compact,planonly,partition,costmodel,seed)
+    if not planonly:
+        writeplan(subexperiments,subexperimentdirectory,compact)
+
+
+# Run main
+if __name__=="__main__":
+   main()
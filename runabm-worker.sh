@@ -0,0 +1,62 @@
+#!/bin/bash
+"""
+Copyright (c) 2014 High-Performance Computing and GIS (HPCGIS) Laboratory. All rights reserved.
+Use of this source code is governed by a BSD-style license that can be found in the LICENSE file.
+Authors and contributors: Eric Shook (eshook@kent.edu)
+"""
+
+# Starts a long-lived NetLogo worker (NetLogoWorker.java) for workflow.py -w
+# The worker reads tasks on stdin and runs them in one JVM instead of one JVM per task (see runabm.sh)
+# To use it : workflow.py -t <tasklist> -w "runabm-worker.sh <NUMBER OF THREADS>"
+
+# Enable debugging 
+#set -x
+#set -v
+
+# User-defined variables
+THREADS=$1
+
+[ -z "$THREADS" ] && echo "To execute: $0 <NUMBER OF THREADS>" >&2 && exit 1
+
+BINDIR=$(cd $(dirname $0) && pwd)
+
+# System-level variables, sized for the largest tasks the worker will run as in runabm.sh
+export NETLOGO=/usr/local/packages/netlogo-5.0.3
+export MEMORY=$((THREADS*512))
+export PERMSIZE=$((THREADS*32))
+export CODECACHESIZE=$((THREADS*64))
+
+[ $PERMSIZE      -lt 128 ] && export PERMSIZE=128
+[ $CODECACHESIZE -lt 256 ] && export CODECACHESIZE=256
+
+# Set jobid as PBS jobid, without one the worker names tables after the task ids as runabm.sh does
+export JOBID=$PBS_JOBID
+
+# Load latest java module if module command is available
+[ ! -z "`which module`" ] && module load java/1.7.0_45-sun >&2
+
+# If google perftools malloc is available, use it.
+[ -e "/usr/local/packages/bench/gperftools-2.1/lib/libtcmalloc.so" ] && export LD_PRELOAD="/usr/local/packages/bench/gperftools-2.1/lib/libtcmalloc.so"
+
+# Ensure extensions are included in the working directory
+[ ! -e "extensions" ] && ln -sf $NETLOGO/extensions .
+
+# Compile the worker the first time it is used
+if [ ! -e "$BINDIR/NetLogoWorker.class" ]; then
+    javac -cp $NETLOGO/NetLogo.jar -d $BINDIR $BINDIR/NetLogoWorker.java >&2
+    [ "$?" != "0" ] && echo " [ ERROR ] Problem compiling NetLogoWorker.java" >&2 && exit 4
+fi
+
+echo " [ STARTING WORKER : $THREADS THREADS, $MEMORY MB ]" >&2
+
+# stdout is only used for replies to workflow.py
+exec java -server \
+       -Dcom.sun.media.jai.disableMediaLib=true \
+       -Xmx${MEMORY}M \
+       -XX:PermSize=${PERMSIZE}m \
+       -XX:MaxPermSize=${PERMSIZE}m \
+       -XX:ReservedCodeCacheSize=${CODECACHESIZE}m \
+       -XX:+UseParallelGC \
+       -XX:ParallelGCThreads=${THREADS} \
+       -cp .:$NETLOGO/NetLogo.jar:$BINDIR \
+       NetLogoWorker $BINDIR "$JOBID" $$
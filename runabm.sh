@@ -30,12 +30,29 @@ export CODECACHESIZE=$((THREADS*64))
 [ $PERMSIZE      -lt 128 ] && export PERMSIZE=128
 [ $CODECACHESIZE -lt 256 ] && export CODECACHESIZE=256
 
-# Set jobid as either PBS jobid or PID of script
+# Set jobid as either PBS jobid, the task id given by workflow.py or PID of script
+# so the attempts of a task in a job write the same tables
 export JOBID=$PBS_JOBID
+[ -z "$JOBID" ] && export JOBID=$NAWS_TASKID
 [ -z "$JOBID" ] && export JOBID=$$ # Replace PBS job id with own PID
 
 # Sanity check
 [ ! -e "$MODEL" ]          && echo "Netlogo model not found : $MODEL"            && exit 2
+
+# A compact sub-experiment is given as <experiment.json>:<start>:<end> (see parse-experiment.py --compact), a bundle of
+# sub-experiments as <bundle.json>:<start>:<end>
+# Its XML is built here just before launch, in node-local storage when available, and it may hold several
+# experiments (one per box of the parameter space) that are run one after the other
+EXPERIMENTS=$EXPERIMENT
+if [[ "$EXPERIMENTFILE" == *.json:*:* ]]; then
+    SPECFILE=${EXPERIMENTFILE%%:*}
+    [ ! -e "$SPECFILE" ] && echo "Experiment file not found : $SPECFILE" && exit 3
+    LOCALDIR=${TMPDIR:-.}
+    EXPERIMENTS=`$(dirname $0)/parse-experiment.py --materialize=$EXPERIMENTFILE --name=$EXPERIMENT -d $LOCALDIR`
+    [ "$?" != "0" ] && echo " [ ERROR ] Problem building sub-experiment : $EXPERIMENTFILE" && exit 4
+    EXPERIMENTFILE=$LOCALDIR/subexperiment.$EXPERIMENT.xml
+fi
+
 [ ! -e "$EXPERIMENTFILE" ] && echo "Experiment file not found : $EXPERIMENTFILE" && exit 3 
 
 # Optimizations
@@ -47,6 +64,7 @@ export JOBID=$PBS_JOBID
 [ -e "/usr/local/packages/bench/gperftools-2.1/lib/libtcmalloc.so" ] && export LD_PRELOAD="/usr/local/packages/bench/gperftools-2.1/lib/libtcmalloc.so"
 
 # Note: Remember that on certain machines you can over-allocate threads and use hyperthreading
+# (runexperiment.py --calibrate measures whether it pays off for a model and sets workflow.py --oversubscribe)
 
 # Ensure extensions are included in the working directory
 [ ! -e "extensions" ] && ln -sf $NETLOGO/extensions .
@@ -70,6 +88,13 @@ echo " [ STARTING ]"
        # Note: spreadsheet may create memory problems so avoid if possible
        #--spreadsheet out.spreadsheet.$MODEL.$EXPERIMENT.$PBS_JOBID.csv"
 
+for EXPERIMENT in $EXPERIMENTS; do
+
+# The table is written under a name of its own (.part and the PID of this script) and renamed once complete,
+# so an interrupted or killed run never leaves a partial table under the final name
+TABLE=out.table.$MODEL.$EXPERIMENT.$JOBID.csv
+PARTTABLE=$TABLE.part$$
+
 # The following parameters were selected to optimize for NetLogo models (specifically the Ache model)
 COMMAND="java -server \
        -Dcom.sun.media.jai.disableMediaLib=true
@@ -85,14 +110,17 @@ COMMAND="java -server \
        --experiment $EXPERIMENT \
        --setup-file $EXPERIMENTFILE \
        --threads $THREADS \
-       --table out.table.$MODEL.$EXPERIMENT.$JOBID.csv" 
+       --table $PARTTABLE" 
 
 echo "Running command : $COMMAND"
 
 time $COMMAND
 RET=$?
 
-[ "$RET" != "0" ] && echo " [ ERROR ] Problem running command return code : $RET" && exit 100 
+[ "$RET" != "0" ] && echo " [ ERROR ] Problem running command return code : $RET" && rm -f $PARTTABLE && exit 100 
 
-echo " [ FINISHED ]"
+mv -f $PARTTABLE $TABLE
+
+done
 
+echo " [ FINISHED ]"
@@ -10,6 +10,246 @@ import os
 import time
 import subprocess
 import shutil
+import json
+import glob
+import math
+import ConfigParser
+import multiprocessing
+import parseexperiment
+import generatetasks
+import submittasklists
+import collectresults
+import adaptreplication
+import workflow
+
+# The calibrated configurations, one per model and host profile
+calibrationfile=os.path.expanduser("~/.naws/calibration.json")
+
+# The configuration of the cluster, in the [naws] section of ~/.naws/naws.cfg then ./naws.cfg then --config
+# (a later file overrides an earlier one), for example:
+#   [naws]
+#   workflow_bin = ~/workflow/bin
+#   cores_per_node = 16              ; detected on this node otherwise (with its affinity and cgroup limits)
+#   memory_per_node = 64000          ; MB, detected on this node otherwise
+#   threads_per_subexperiment = 8    ; used when the model has no calibration (see --calibrate)
+#   oversubscription = 1             ; used when the model has no calibration
+#   seconds_per_simulation = 30      ; core seconds of a simulation, used when the model has no calibration
+#   subexperiments_per_threadgroup = 2
+#   target_makespan = 10             ; hours, the number of jobs is planned to finish in about this time
+#   max_jobs = 32
+#   number_of_jobs = 4               ; a fixed number of jobs instead of planning it
+#   backend = slurm                  ; pbs (PBS Pro, default), torque, slurm or local (runs the jobs on this machine)
+#   walltime = 10:00:00              ; of a job, from the predicted makespan otherwise
+#   batch_queue = batch              ; the queue (PBS) or partition (Slurm) of the jobs
+#   account = at3uuhp                ; charged for the jobs
+#   email = user@example.edu         ; notified when the jobs finish
+configfiles=[os.path.expanduser("~/.naws/naws.cfg"),"naws.cfg"]
+configtypes={"workflow_bin":str,"cores_per_node":int,"memory_per_node":int,"threads_per_subexperiment":int,"oversubscription":int,
+             "seconds_per_simulation":float,"subexperiments_per_threadgroup":int,"target_makespan":float,"max_jobs":int,"number_of_jobs":int,
+             "backend":str,"walltime":str,"batch_queue":str,"account":str,"email":str}
+
+# The walltime (hh:mm:ss) of a job predicted to take hours : 50% more, rounded up to the hour
+def walltime(hours):
+    return "%d:00:00"%max(int(math.ceil(hours*1.5)),1)
+
+# Read the settings of the configuration files that exist. Returns a dictionary of the settings found
+def readconfig(configfiles):
+    parser=ConfigParser.RawConfigParser()
+    try:
+        parser.read(configfiles)
+    except ConfigParser.Error as e:
+        print " [ ERROR ] Cannot read the configuration :",e
+        sys.exit(1)
+    config={}
+    if parser.has_section("naws"):
+        for name,value in parser.items("naws"):
+            if name not in configtypes:
+                print " [ WARNING ] Unknown configuration setting",name
+                continue
+            try:
+                config[name]=configtypes[name](value)
+            except ValueError:
+                print " [ ERROR ] Bad value for configuration setting",name,":",value
+                sys.exit(1)
+    return config
+
+# Plan the experiment for the cluster with a number of threads per sub-experiment : the number of jobs (unless given)
+# and of sub-experiments. A job (a node) runs as many sub-experiments at a time as its cores (times the oversubscription)
+# and its memory allow. When the core seconds of a simulation are known, enough jobs are planned to finish in the
+# target makespan (hours). The sub-experiments are subexperiments_per_threadgroup rounds of the tasks all the jobs
+# run at a time, which leaves room for the workflow to balance uneven sub-experiments. Returns the plan and its predictions
+def planexperiment(simulations,cores,memory,threads,oversubscription,subexperiments_per_threadgroup,jobs,maxjobs,makespan,secondspersimulation):
+    plan={"threads":threads}
+    plan["fits"]=memory==None or generatetasks.taskmemory(threads)<=memory
+    slots=max(cores*oversubscription//threads,1)
+    if memory!=None:
+        slots=max(min(slots,memory//generatetasks.taskmemory(threads)),1)
+    plan["slots"]=slots
+    taskcores=min(float(threads)/oversubscription,cores) # Cores a running sub-experiment keeps busy
+    if jobs==None:
+        jobs=1
+        if makespan!=None and secondspersimulation!=None:
+            jobs=int(math.ceil(simulations*secondspersimulation/(slots*taskcores*makespan*3600.0)))
+        jobs=min(max(jobs,1),maxjobs)
+    plan["jobs"]=jobs
+    plan["subexperiments"]=max(min(subexperiments_per_threadgroup*jobs*slots,simulations),1)
+    # Sub-experiments of (about) the same size run in rounds of jobs*slots, the last round may leave slots idle
+    rounds=int(math.ceil(plan["subexperiments"]/float(jobs*slots)))
+    plan["utilization"]=plan["subexperiments"]*taskcores/(jobs*cores*rounds)
+    plan["makespan"]=None
+    if secondspersimulation!=None:
+        plan["makespan"]=rounds*(float(simulations)/plan["subexperiments"])*secondspersimulation/taskcores/3600.0
+    return plan
+
+# Pick the threads per sub-experiment and plan the experiment with them (see planexperiment)
+# A sub-experiment uses at most the threads of a node, and more threads when there are fewer simulations than a node
+# runs at a time. Unless the threads are fixed (calibrated or configured), the power of 2 that keeps the most cores busy
+# with sub-experiments that fit the memory of a node is picked, the given threads winning ties
+def planthreads(simulations,cores,memory,threads,fixed,oversubscription,subexperiments_per_threadgroup,jobs,maxjobs,makespan,secondspersimulation):
+    capacity=cores*oversubscription
+    smallest=int(math.ceil(capacity/float(simulations)))
+    candidates=[threads]
+    if not fixed:
+        candidates+=[2**power for power in range(int(math.log(capacity,2))+1)]
+    best=None
+    for candidate in candidates:
+        candidate=max(min(candidate,capacity),smallest)
+        plan=planexperiment(simulations,cores,memory,candidate,oversubscription,subexperiments_per_threadgroup,jobs,maxjobs,makespan,secondspersimulation)
+        if best==None or (plan["fits"],plan["utilization"])>(best["fits"],best["utilization"]+1e-9):
+            best=plan
+    return best
+
+# Call function with what it prints (the progress of the stages) written to log
+def logged(log,function,*args):
+    stdout=sys.stdout
+    sys.stdout=log
+    try:
+        return function(*args)
+    finally:
+        sys.stdout=stdout
+
+# Load the spec of an experiment from a model (cached in ~/.naws/cache, see parseexperiment.loadexperiment)
+def loadexperiment(model_name,experiment_name):
+    try:
+        spec=parseexperiment.loadexperiment(model_name,experiment_name,os.path.expanduser("~/.naws/cache"))
+    except IOError:
+        print " [ ERROR ] Cannot open file",model_name
+        sys.exit(1)
+    if spec==None:
+        print " [ ERROR ] Experiment",experiment_name,"not found"
+        sys.exit(1)
+    return spec
+
+# Load the cost model of the simulations (see parseexperiment.loadcostmodel) or fit one from the timings of past runs
+# None when neither is given
+def loadcostmodel(costmodel_name,timings_name):
+    try:
+        if costmodel_name!="":
+            return parseexperiment.loadcostmodel(costmodel_name)
+        if timings_name!="":
+            costmodel=parseexperiment.fitcostmodel(timings_name)
+            print "Cost model fitted from",timings_name,":",json.dumps(costmodel)
+            return costmodel
+    except (IOError,ValueError) as e:
+        print " [ ERROR ] Cannot read cost model :",e
+        sys.exit(1)
+    return None
+
+# The host profile names the node type a calibration holds for : the CPU model and number of cores
+# Jobs are often submitted from a login node of another type, so it can be named with --profile
+def hostprofile():
+    cpu="unknown cpu"
+    if os.path.exists("/proc/cpuinfo"):
+        for line in open("/proc/cpuinfo").read().splitlines():
+            if line.startswith("model name"):
+                cpu=" ".join(line.split(":",1)[1].split())
+                break
+    return cpu+" x "+str(multiprocessing.cpu_count())
+
+def loadcalibrations():
+    if not os.path.exists(calibrationfile):
+        return {}
+    with open(calibrationfile,'r') as f:
+        return json.load(f)
+
+# Save the calibration of a model on a host profile (written to a new file and renamed, so
+# experiments launched meanwhile never read a partial file)
+def savecalibration(key,calibration):
+    calibrations=loadcalibrations()
+    calibrations[key]=calibration
+    if not os.path.isdir(os.path.dirname(calibrationfile)):
+        os.makedirs(os.path.dirname(calibrationfile))
+    with open(calibrationfile+".part",'w') as f:
+        json.dump(calibrations,f,indent=1,sort_keys=True)
+    os.rename(calibrationfile+".part",calibrationfile)
+
+# Run one calibration trial : as many sub-experiments of threads threads as fit cores*oversubscription threads,
+# each of runspercore simulations per thread, taken at evenly spaced ranks of the experiment so they sample
+# its whole parameter space. Returns the simulations per core-hour, or None if the trial failed
+def calibrationtrial(workflow_bin,calibration_dir,model,numberofruns,cores,threads,oversubscription,runspercore):
+    trial_dir=calibration_dir+"/threads"+str(threads)+".oversubscription"+str(oversubscription)
+    os.makedirs(trial_dir)
+    tasks=max(cores*oversubscription//threads,1)
+    runs=runspercore*threads
+    subexperiments=[]
+    for i in range(tasks):
+        start=min(i*numberofruns//tasks,max(numberofruns-runs,0))
+        end=min(start+runs,numberofruns)
+        subexperiments.append({"name":"calibration%i"%i,"expfile":calibration_dir+"/experiment.json:%i:%i"%(start,end),"simulations":end-start})
+    simulations=sum(subexperiment["simulations"] for subexperiment in subexperiments)
+
+    with open(trial_dir+".log",'w') as log:
+        tasks=logged(log,generatetasks.createtasks,subexperiments,workflow_bin+"/runabm.sh",model,threads)
+        tasklistfile=logged(log,generatetasks.writetasks,trial_dir,tasks,1,threads)[0]
+        # The tasks run in the calibration directory (where the model was copied) and only once
+        log.flush()
+        start=time.time()
+        status=subprocess.call(workflow_bin+"/workflow.py -t "+tasklistfile+" -c "+str(cores*oversubscription)+" --retries=0 --speculate=0",
+                               shell=True,stdout=log,stderr=log,cwd=calibration_dir)
+        elapsed=time.time()-start
+    # The tables of the sample are not kept
+    for table in glob.glob(calibration_dir+"/out.table.*"):
+        os.remove(table)
+    if status!=0:
+        return None
+    return simulations/(cores*elapsed/3600.0)
+
+# Measure the simulations per core-hour of the model on this node for every number of threads per
+# sub-experiment and oversubscription level, and save the best as the calibration of the model on the host profile
+def calibrate(workflow_bin,workflow_dir,model_name,experiment_name,key,threadcounts,oversubscriptions,runspercore):
+    calibration_dir=workflow_dir+"/calibration"
+    os.makedirs(calibration_dir)
+    shutil.copy(model_name,calibration_dir)
+    model=os.path.basename(model_name)
+    # The whole experiment as one compact sub-experiment, the trials take their samples from its ranks
+    with open(calibration_dir+"/parse-experiment.log",'w') as log:
+        spec=logged(log,loadexperiment,model_name,experiment_name)
+        numberofruns=logged(log,parseexperiment.createsubexperiments,spec,1,calibration_dir,True)[0]["end"]
+
+    cores=multiprocessing.cpu_count()
+    print "Calibrating",model,"on",cores,"cores, logs in",calibration_dir
+    trials=[]
+    for threads in threadcounts:
+        for oversubscription in oversubscriptions:
+            if threads>cores*oversubscription:
+                continue
+            rate=calibrationtrial(workflow_bin,calibration_dir,model,numberofruns,cores,threads,oversubscription,runspercore)
+            if rate==None:
+                print " [ WARNING ] Calibration with",threads,"threads and oversubscription",oversubscription,"failed"
+                continue
+            print " [ THREADS %3i OVERSUBSCRIPTION %i : %10.1f SIMULATIONS PER CORE-HOUR ]"%(threads,oversubscription,rate)
+            trials.append({"threads":threads,"oversubscription":oversubscription,"simulationspercorehour":rate})
+    if len(trials)==0:
+        print " [ ERROR ] Every calibration trial failed, see the logs in",calibration_dir
+        sys.exit(1)
+
+    best=max(trials,key=lambda trial: trial["simulationspercorehour"])
+    calibration=dict(best)
+    calibration["trials"]=trials
+    calibration["date"]=time.strftime("%Y-%m-%d %H:%M:%S")
+    savecalibration(key,calibration)
+    print "Best configuration :",best["threads"],"threads per subexperiment, oversubscription",best["oversubscription"]
+    print "Saved as the calibration of",key,"in",calibrationfile
 
 def main(): 
 
@@ -17,21 +257,100 @@ def main():
     print 'Welcome to NetLogo ABM Workflow System (NAWS)'
 
 
+    usage="runexperiment.py -m <NetLogo model> -e <Experiment name in model> [--compact] [--queue] [--profile=<host profile>] [--config=<config file>] [--jobs=<number of jobs>] [--makespan=<hours>] [--backend=<pbs|torque|slurm|local>] [--dry-run] [--no-result-cache]\n"
+    usage+="                 [-p tile|cost] [--costmodel=<cost model.json>] [--timings=<timings.csv>] [--seed=<base seed>]\n"
+    usage+="runexperiment.py -m <NetLogo model> -e <Experiment name in model> --adaptive --ci-width=<width>[%] [--confidence=<level>] [--batch=<repetitions per round>] [--adaptive-metric=<metric> ...] [options above]\n"
+    usage+="runexperiment.py -m <NetLogo model> -e <Experiment name in model> --calibrate [--calibrate-threads=<list>] [--calibrate-oversubscription=<list>] [--calibrate-runs=<simulations per thread>] [--profile=<host profile>]"
+
     # Parsing command-line parameters
     try:
-        opts,args=getopt.getopt(sys.argv[1:],"m:e:",["model=","experiment="])
+        opts,args=getopt.getopt(sys.argv[1:],"m:e:p:",["model=","experiment=","compact","queue","profile=","config=","jobs=","makespan=","calibrate","calibrate-threads=","calibrate-oversubscription=","calibrate-runs=","backend=","dry-run","no-result-cache","partition=","costmodel=","timings=","seed=",
+                                                     "adaptive","ci-width=","confidence=","batch=","adaptive-metric="])
     except getopt.GetoptError:
-        print "runexperiment.py -m <NetLogo model> -e <Experiment name in model>"
+        print usage
         sys.exit(1)
 
     # Blank names by default for sanity check
     model_name=""
     experiment_name=""
+    # Compact sub-experiments are described by rank ranges and built on the compute node
+    compact=False
+    queue=False # Jobs pull tasks from a shared queue instead of running a tasklist each
+    profile=hostprofile()
+    # Calibration runs a sample of the experiment on this node with each number of threads per
+    # sub-experiment and oversubscription level (threads per core, above 1 for hyperthreading)
+    calibrate_mode=False
+    threadcounts=[1,2,4,8,16]
+    oversubscriptions=[1,2]
+    runspercore=4
+    dryrun=False # Write the submit script without submitting it
+    resultcache=True # Only run the simulations missing from the result cache of the experiment (see collect-results.py)
+    partition="tile" # How to partition the parameter space (see parseexperiment.generateexperiments)
+    costmodel_name=""
+    timings_name=""
+    seed=None # Base random seed (runs are seeded only when given)
+    # Adaptive replication runs the repetitions in rounds until the confidence interval of the metrics of each
+    # combination is narrower than the width given (a percentage of the mean with %), see adaptreplication.py
+    adaptive=False
+    width=None
+    relative=False
+    confidence=0.95
+    batch=3
+    adaptivemetrics=[] # All the metrics of the experiment unless chosen
+    config={} # Settings given on the command line override the configuration files
     for opt, arg in opts:
         if opt in ("-m", "--model"):
             model_name=arg
         if opt in ("-e", "--experiment"):
             experiment_name=arg
+        if opt=="--compact":
+            compact=True
+        if opt=="--queue":
+            queue=True
+        if opt=="--profile":
+            profile=arg
+        if opt=="--config":
+            if not os.path.exists(arg):
+                print " [ ERROR ] Configuration file not found :",arg
+                sys.exit(1)
+            configfiles.append(arg)
+        if opt=="--jobs":
+            config["number_of_jobs"]=int(arg)
+        if opt=="--makespan":
+            config["target_makespan"]=float(arg)
+        if opt=="--calibrate":
+            calibrate_mode=True
+        if opt=="--calibrate-threads":
+            threadcounts=[int(count) for count in arg.split(",")]
+        if opt=="--calibrate-oversubscription":
+            oversubscriptions=[int(level) for level in arg.split(",")]
+        if opt=="--calibrate-runs":
+            runspercore=int(arg)
+        if opt=="--backend":
+            config["backend"]=arg
+        if opt=="--dry-run":
+            dryrun=True
+        if opt=="--no-result-cache":
+            resultcache=False
+        if opt in ("-p", "--partition"):
+            partition=arg
+        if opt=="--costmodel":
+            costmodel_name=arg
+        if opt=="--timings":
+            timings_name=arg
+        if opt=="--seed":
+            seed=int(arg)
+        if opt=="--adaptive":
+            adaptive=True
+        if opt=="--ci-width":
+            relative=arg.endswith("%")
+            width=float(arg.rstrip("%"))/(100.0 if relative else 1.0)
+        if opt=="--confidence":
+            confidence=float(arg)
+        if opt=="--batch":
+            batch=int(arg)
+        if opt=="--adaptive-metric":
+            adaptivemetrics.append(arg)
     err=0
     if model_name=="": 
         print " [ ERROR ] Must provide a NetLogo model"
@@ -39,31 +358,86 @@ def main():
     if experiment_name=="":
         print " [ ERROR ] Must provide an Experiment"
         err=1
+    if min(threadcounts+oversubscriptions+[runspercore])<=0:
+        print " [ ERROR ] Calibration threads, oversubscription and runs must be greater than 0"
+        err=1
+    if partition not in ("tile","cost"):
+        print " [ ERROR ] Partition must be tile or cost"
+        err=1
+    if partition=="cost" and costmodel_name=="" and timings_name=="":
+        print " [ ERROR ] Partition cost needs a cost model or timings"
+        err=1
+    if adaptive and (width==None or width<0):
+        print " [ ERROR ] Adaptive replication needs the target width of the confidence intervals (--ci-width)"
+        err=1
+    if not 0<confidence<1:
+        print " [ ERROR ] The confidence level must be between 0 and 1"
+        err=1
+    if batch<=0:
+        print " [ ERROR ] The repetitions per round must be greater than 0"
+        err=1
     if err==1:
-        print "runexperiment.py -m <NetLogo model> -e <Experiment name in model>"
+        print usage
         sys.exit(1)
 
+    settings=readconfig(configfiles)
+    settings.update(config)
+    config=settings
+
     # How many subexperiments should be assigned to a "thread group" (defined below)
-    subexperiments_per_threadgroup=2
+    subexperiments_per_threadgroup=config.get("subexperiments_per_threadgroup",2)
 
     # How many threads should be used for each subexperiment (referred to a "threadgroup" above)
     # 4-8 have been found to be good on several platforms
-    threads_per_subexperiment=8
-
-    # How many cores are available per node
-    cores_per_node=16
+    threads_per_subexperiment=config.get("threads_per_subexperiment",8)
+    threads_fixed="threads_per_subexperiment" in config # Otherwise the planner may pick other threads
+
+    # How many threads run per core (more than 1 over-allocates threads to use hyperthreading)
+    oversubscription=config.get("oversubscription",1)
+
+    # How many core seconds a simulation takes (unknown unless configured or calibrated)
+    seconds_per_simulation=config.get("seconds_per_simulation")
+
+    # The threads and oversubscription found best by runexperiment.py --calibrate for this model and host profile
+    calibration_key=os.path.basename(model_name)+" on "+profile
+    calibration=loadcalibrations().get(calibration_key)
+    if calibration!=None and not calibrate_mode:
+        print "Using the calibration of",calibration_key,"from",calibration["date"]
+        threads_per_subexperiment=calibration["threads"]
+        oversubscription=calibration["oversubscription"]
+        threads_fixed=True
+        seconds_per_simulation=3600.0/calibration["simulationspercorehour"]
+
+    # How many cores and memory (MB) are available per node : detected on this node (the jobs run on nodes like it)
+    # unless configured, for example when submitting from a login node
+    cores_per_node=config.get("cores_per_node")
+    if cores_per_node==None:
+        cores_per_node=workflow.detectcores()
+        print "Detected",cores_per_node,"cores on this node"
+    memory_per_node=config.get("memory_per_node")
+    if memory_per_node==None:
+        memory_per_node=workflow.detectmemory()
+        print "Detected",memory_per_node,"MB of memory on this node"
 
-    # How many jobs should be submitted to the queue system (e.g., qsub)
-    number_of_jobs=1
-
-    # Based on the parameters provided above, calculate the number of subexperiments to create
-    #NUMBEROFSUBEXPERIMENTS=$((SUBEXPERIMENTSPERTHREADGROUP*NUMBEROFJOBS*(CORESPERNODE/THREADSPERSUBEXPERIMENT)))
-    number_of_subexperiments=subexperiments_per_threadgroup*number_of_jobs*(cores_per_node/threads_per_subexperiment)
+    err=0
+    for name,value in (("cores per node",cores_per_node),("threads per subexperiment",threads_per_subexperiment),("oversubscription",oversubscription),
+                       ("subexperiments per threadgroup",subexperiments_per_threadgroup),("maximum number of jobs",config.get("max_jobs",1)),
+                       ("number of jobs",config.get("number_of_jobs",1)),("target makespan",config.get("target_makespan",1))):
+        if value<=0:
+            print " [ ERROR ] The",name,"must be greater than 0"
+            err=1
+    backend=config.get("backend","pbs")
+    if backend not in submittasklists.backends:
+        print " [ ERROR ] The backend must be one of",", ".join(sorted(submittasklists.backends))
+        err=1
+    if err==1:
+        sys.exit(1)
 
     print "Executing in current directory :",os.getcwd()
     exec_dir=os.getcwd()
-    workflow_bin="~/workflow/bin"
-    workflow_bin="~/code/workflow.github/NAWS"
+    # The NAWS scripts are next to this one unless configured
+    workflow_bin=config.get("workflow_bin",os.path.dirname(os.path.abspath(__file__)))
+    workflow_bin=os.path.expanduser(workflow_bin) # The tasks run their program without a shell to expand ~
 
     try:
         os.chdir(exec_dir)
@@ -83,6 +457,60 @@ def main():
     # Copy the model to the working directory as a backup for provenance
     shutil.copy(model_name,workflow_dir)
 
+    if calibrate_mode:
+        calibrate(workflow_bin,workflow_dir,model_name,experiment_name,calibration_key,threadcounts,oversubscriptions,runspercore)
+        print 'Successful exit'
+        return
+
+    # How many jobs should be submitted to the queue system (e.g., qsub) and how many subexperiments to create
+    # Formerly : NUMBEROFSUBEXPERIMENTS=$((SUBEXPERIMENTSPERTHREADGROUP*NUMBEROFJOBS*(CORESPERNODE/THREADSPERSUBEXPERIMENT)))
+    spec=loadexperiment(model_name,experiment_name)
+    specs=[spec]
+    costmodel=loadcostmodel(costmodel_name,timings_name) # Balances the sub-experiments by predicted cost with -p cost
+    if adaptive:
+        # The first round runs a batch of the repetitions of the combinations that have not converged in the result
+        # cache (or a store of the workflow without it), the later rounds are added to the queue while the jobs run
+        # The metrics are only read from the store once the first round has run, so a misspelt one must stop here
+        unknownmetrics=[metric for metric in adaptivemetrics if metric not in parseexperiment.experimentmetrics(spec)]
+        if len(unknownmetrics)>0:
+            print " [ ERROR ] Experiment",experiment_name,"has no metric",", ".join(unknownmetrics),"(its metrics :",", ".join(parseexperiment.experimentmetrics(spec))+")"
+            sys.exit(1)
+        if not queue:
+            print "Adaptive replication adds its rounds to a queue shared by the jobs (--queue)"
+            queue=True
+        storefile=collectresults.resultcachefile(model_name,spec) if resultcache else workflow_dir+"/results.db"
+        state=adaptreplication.newstate(spec,model_name,exec_dir,storefile,workflow_dir+"/tasklists/queue.db",workflow_bin+"/runabm.sh",
+                                        workflow_bin+"/adapt-replication.py",threads_per_subexperiment,None,compact,adaptivemetrics,width,relative,
+                                        confidence,batch,seconds_per_simulation,partition,costmodel,seed)
+        outcomes=adaptreplication.collectoutcomes(state,False)
+        state["storedruns"]=sum(len(runs) for runs in outcomes.values()) # Names the rounds apart from those of earlier sweeps
+        needs,convergedcount,capped=adaptreplication.roundneeds(state,outcomes)
+        if convergedcount+capped>0:
+            print "Result cache",storefile,":",convergedcount,"combinations converged and",capped,"ran every repetition"
+        if len(needs)==0:
+            print "Every combination of the experiment has converged or run every repetition in the result cache, nothing to run"
+            print 'Successful exit'
+            return
+        number_of_simulations=sum(needs.values())
+    else:
+        if resultcache:
+            specs=collectresults.pendingexperiments(spec,collectresults.resultcachefile(model_name,spec))
+        if len(specs)==0:
+            print "Every simulation of the experiment is in the result cache, nothing to run (see collect-results.py --query)"
+            print 'Successful exit'
+            return
+        number_of_simulations=sum(parseexperiment.experimentsimulations(part) for part in specs)
+    plan=planthreads(number_of_simulations,cores_per_node,memory_per_node,threads_per_subexperiment,threads_fixed,oversubscription,subexperiments_per_threadgroup,
+                     config.get("number_of_jobs"),config.get("max_jobs",32),config.get("target_makespan"),seconds_per_simulation)
+    if plan["threads"]!=threads_per_subexperiment:
+        print "Threads per subexperiment changed from",threads_per_subexperiment,"to",plan["threads"],"to fit the node and the experiment"
+        threads_per_subexperiment=plan["threads"]
+    number_of_jobs=plan["jobs"]
+    number_of_subexperiments=plan["subexperiments"]
+    if adaptive and plan["makespan"]!=None:
+        # The jobs are planned for the first round but may have to run every repetition, as the fixed plan does
+        plan["makespan"]*=float(state["fixedplan"])/number_of_simulations
+
     # Print out parameters for record keeping
     print " [ MODEL FILE               :",model_name,"]"
     print " [ EXPERIMENT NAME          :",experiment_name,"]"
@@ -90,29 +518,58 @@ def main():
     print " [ CORES PER NODE           :",cores_per_node,"]"
     print " [ NUMBER OF SUBEXPERIMENTS :",number_of_subexperiments,"]"
     print " [ THREADSPERSUBEXPERIMENT  :",threads_per_subexperiment,"]"
+    print " [ OVERSUBSCRIPTION         :",oversubscription,"]"
+    print " [ BATCH BACKEND            :",backend,"]"
+    print " [ PARTITION                :",partition,"]"
     print " [ NUMBER OF JOBS           :",number_of_jobs,"]"
+    print " [ NUMBER OF SIMULATIONS    :",number_of_simulations,"]"
+    if adaptive:
+        print " [ ADAPTIVE REPLICATION     : rounds of %i repetitions, %g%s wide intervals at %g%% confidence ]"%(batch,width*100 if relative else width,
+                                                                                                                 "% of the mean" if relative else "",confidence*100)
+        print " [ FIXED-REPETITION PLAN    :",state["fixedplan"],"simulations ]"
+    print " [ MEMORY PER NODE          :",memory_per_node if memory_per_node!=None else "unknown","MB ]"
+    print " [ SUBEXPERIMENTS PER NODE  :",plan["slots"],"at a time ]"
+    if plan["makespan"]!=None:
+        print " [ PREDICTED MAKESPAN       : %.2f hours ]"%plan["makespan"]
+    print " [ EXPECTED CORE UTILIZATION: %.1f %% ]"%(100.0*plan["utilization"])
+    if not plan["fits"]:
+        print " [ WARNING ] A subexperiment needs",generatetasks.taskmemory(threads_per_subexperiment),"MB, more than the memory of a node"
+    if plan["utilization"]<0.8:
+        print " [ WARNING ] Cores will be idle : the threads per subexperiment do not fill the cores or memory of a node, or the last round of subexperiments is partly empty"
     
     # Launch the series of scripts to parse and submit the experiments of the ABM
 
-    # Parse experiment extracts out the experiment description (XML) from the ABM and creates a number of sub-experiments
-    status=subprocess.call(workflow_bin+"/parse-experiment.py -d "+workflow_dir+" -m "+model_name+" -e "+experiment_name+" -n "+str(number_of_subexperiments),shell=True)
-    if status!=0:
-        print " [ ERROR ] Problem running parse-experiment.py"
-        sys.exit(1) 
-    #$WORKFLOWBIN/parse-experiment.py -d $WORKFLOWDIR -m $MODEL -e $EXPERIMENT -n $NUMBEROFSUBEXPERIMENTS
+    # The stages run in this process and hand over the parsed experiment, the sub-experiments and the tasks in memory
+    # Only what the jobs need is written : the sub-experiments, the tasklists (or queue) and the submit scripts
 
+    # Parse experiment extracts out the experiment description (XML) from the ABM and creates a number of sub-experiments
     # Generate tasks creates one task per sub-experiment for the workflow engine to manage
-    status=subprocess.call(workflow_bin+"/generate-tasks.py -d "+workflow_dir+" -m "+model_name+" -r "+workflow_bin+"/runabm.sh -n "+str(threads_per_subexperiment)+" -j "+str(number_of_jobs),shell=True)
-    if status!=0:
-        print " [ ERROR ] Problem running generate-tasks.py"
-        sys.exit(1) 
+    if adaptive:
+        # The tasks of the first round and the task deciding the next one
+        state["threads"]=threads_per_subexperiment
+        state["subexperiments"]=number_of_subexperiments
+        tasks=adaptreplication.roundtasks(workflow_dir,state,needs,number_of_subexperiments)
+        adaptreplication.writestate(workflow_dir,state)
+        print "The savings of adaptive replication are reported by",workflow_bin+"/adapt-replication.py -d",workflow_dir,"--report"
+    else:
+        subexperiments=parseexperiment.createpartsubexperiments(specs,number_of_subexperiments,workflow_dir,compact,False,partition,costmodel,seed)
+        tasks=generatetasks.createtasks(subexperiments,workflow_bin+"/runabm.sh",model_name,threads_per_subexperiment)
+    #$WORKFLOWBIN/parse-experiment.py -d $WORKFLOWDIR -m $MODEL -e $EXPERIMENT -n $NUMBEROFSUBEXPERIMENTS
+    tasklistfiles=generatetasks.writetasks(workflow_dir,tasks,number_of_jobs,threads_per_subexperiment,cores_per_node*oversubscription,queue)
     #$WORKFLOWBIN/generate-tasks.py   -d $WORKFLOWDIR -m $MODEL -r $WORKFLOWBIN/runabm.sh -n $THREADSPERSUBEXPERIMENT -j $NUMBEROFJOBS 
 
-    status=subprocess.call(workflow_bin+"/submit-tasklists.py -d "+workflow_dir+" -w "+workflow_bin+"/workflow.py -n "+str(threads_per_subexperiment)+" -e "+exec_dir,shell=True)
-    if status!=0:
-        print " [ ERROR ] Problem running submit-tasklists.py"
+    # Submit tasklists will create one job array for the tasklists (or the jobs sharing the queue) and submit it
+    # Memory is only requested when configured, the detected memory is that of the node submitting
+    resources={"cores":cores_per_node,"memory":config.get("memory_per_node"),"walltime":config.get("walltime"),
+               "queue":config.get("batch_queue"),"account":config.get("account"),"email":config.get("email")}
+    if resources["walltime"]==None and plan["makespan"]!=None:
+        resources["walltime"]=walltime(plan["makespan"])
+    try:
+        submittasklists.submittasklists(workflow_dir,tasklistfiles,workflow_bin+"/workflow.py",threads_per_subexperiment,exec_dir,number_of_jobs,oversubscription,
+                                        backend,resources,dryrun)
+    except (subprocess.CalledProcessError,OSError):
+        print " [ ERROR ] Problem submitting the jobs"
         sys.exit(1) 
-    # Submit tasklists will create a tasklist for each job based on the number of tasks generated previously and create a job file and submit it
     #$WORKFLOWBIN/submit-tasklists.py -d $WORKFLOWDIR -w $WORKFLOWBIN/workflow.py -n $THREADSPERSUBEXPERIMENT -e $EXECDIR
 
 
@@ -0,0 +1,323 @@
+#!/usr/bin/python
+"""
+Copyright (c) 2014 High-Performance Computing and GIS (HPCGIS) Laboratory. All rights reserved.
+Use of this source code is governed by a BSD-style license that can be found in the LICENSE file.
+Authors and contributors: Eric Shook (eshook@kent.edu)
+"""
+
+import os
+import re
+import glob
+import subprocess
+
+import sys,getopt
+
+import workflow
+
+'''
+1. Create one job submission script for all the tasklists, with the backend of the batch system
+2. Each job of the script launches the ABM workflow with a single tasklist (or pulls tasks from the shared queue)
+3. Submit the script : PBS and Slurm submit all the jobs as one job array, the local backend runs them on this machine
+From Python, submittasklists takes the tasklists returned by generatetasks.writetasks
+'''
+
+# The resources of a job and how the batch system accounts for it. Only cores and walltime have defaults,
+# the other directives are left out of the script when they are not given
+defaultresources={"cores":16,"walltime":"10:00:00","memory":None,"queue":None,"account":None,"email":None}
+
+# A backend writes the submission script of the jobs of a workflow and submits it
+# Job i of the script runs the workflow with line i of the job file (a tasklist, or the shared queue once per job),
+# so the jobs of a sweep are one job array and one submission however many tasklists there are
+class Backend(object):
+    name=None
+    submitcommand=None
+
+    def __init__(self,resources):
+        self.resources=dict(defaultresources)
+        self.resources.update(dict((name,value) for name,value in resources.items() if value!=None))
+
+    # The batch directives of a job array of numberofjobs jobs, whose output goes to submitdir
+    def directives(self,numberofjobs,submitdir):
+        return []
+
+    # The shell expression of the index (from 0) of a job in the array
+    def arrayindex(self):
+        return "0"
+
+    # The cores and memory (None when not requested) a job of numberofjobs may use : those it requests
+    def jobresources(self,numberofjobs):
+        return self.resources["cores"],self.resources["memory"]
+
+    # The command of a job, which runs the workflow on the tasklist (or queue) $TASKLIST
+    def workflowcommand(self,workflowexec,queue,oversubscribe,numberofjobs):
+        # The workflow runs as many tasks as fit in the cores and memory of the job (-c, -M), as the workflow only
+        # detects a share of the node where the batch system enforces it (cpusets, cgroups)
+        # With --resume a resubmitted job (e.g. after a walltime kill) only runs the unfinished tasks of its journal
+        # Jobs sharing a queue pull tasks from it as they go and claim again the tasks of a job that stopped
+        if queue:
+            execstr=workflowexec+" -q $TASKLIST"
+        else:
+            execstr=workflowexec+" -t $TASKLIST --resume"
+        # Hyperthreaded nodes may run more threads than cores (see runexperiment.py --calibrate)
+        if oversubscribe>1:
+            execstr+=" --oversubscribe="+str(oversubscribe)
+        cores,memory=self.jobresources(numberofjobs)
+        execstr+=" -c "+str(cores)
+        if memory!=None:
+            execstr+=" -M "+str(memory)
+        return execstr
+
+    def writescript(self,submitfile,jobfile,numberofjobs,workflowexec,execdir,queue=False,oversubscribe=1):
+        submitdir=os.path.dirname(os.path.abspath(submitfile))
+        with open(submitfile,'w') as f:
+            f.write("#!/bin/bash\n\n")
+            for directive in self.directives(numberofjobs,submitdir):
+                f.write(directive+"\n")
+            f.write("\n#set -x\n\n")
+            f.write("echo \" [ STARTING JOB ]\"\n")
+            f.write("command -v ja >/dev/null && ja\ndate\n\n")
+            f.write("cd "+execdir+"\n\n")
+            f.write("INDEX="+self.arrayindex()+"\n")
+            f.write("TASKLIST=`sed -n \"$((INDEX+1))p\" "+jobfile+"`\n")
+            f.write("echo \" [ TASKLIST ] $TASKLIST\"\n\n")
+            f.write("time "+self.workflowcommand(workflowexec,queue,oversubscribe,numberofjobs)+"\n")
+            f.write("STATUS=$?\n\ncommand -v ja >/dev/null && ja -chlst\n\necho \ndate\necho \" [ FINISHED JOB ]\"\nexit $STATUS\n")
+
+    # Submit the script and return the id of the job (array) given by the batch system
+    # Raises subprocess.CalledProcessError when the submission fails
+    def submit(self,submitfile):
+        return subprocess.check_output(self.submitcommand+[submitfile]).strip()
+
+# PBS Pro job arrays (-J, $PBS_ARRAY_INDEX)
+# An array needs at least two jobs, a single job is submitted without an array
+class PBSBackend(Backend):
+    name="pbs"
+    submitcommand=["qsub"]
+    arrayflag="-J"
+
+    def directives(self,numberofjobs,submitdir):
+        directives=["#PBS -N naws","#PBS -l ncpus="+str(self.resources["cores"]),"#PBS -l walltime="+self.resources["walltime"],"#PBS -j oe","#PBS -o "+submitdir]
+        if self.resources["memory"]!=None:
+            directives.append("#PBS -l mem="+str(self.resources["memory"])+"mb")
+        if self.resources["queue"]!=None:
+            directives.append("#PBS -q "+self.resources["queue"])
+        if self.resources["account"]!=None:
+            directives.append("#PBS -W group_list="+self.resources["account"])
+        if self.resources["email"]!=None:
+            directives+=["#PBS -M "+self.resources["email"],"#PBS -m ae"]
+        if numberofjobs>1:
+            directives.append("#PBS "+self.arrayflag+" 0-"+str(numberofjobs-1))
+        return directives
+
+    def arrayindex(self):
+        return "${PBS_ARRAY_INDEX:-0}"
+
+# Torque job arrays (-t, $PBS_ARRAYID), otherwise submitted as with PBS Pro
+class TorqueBackend(PBSBackend):
+    name="torque"
+    arrayflag="-t"
+
+    def arrayindex(self):
+        return "${PBS_ARRAYID:-0}"
+
+# Slurm job arrays (--array, $SLURM_ARRAY_TASK_ID), one node per job
+class SlurmBackend(Backend):
+    name="slurm"
+    submitcommand=["sbatch","--parsable"]
+
+    def directives(self,numberofjobs,submitdir):
+        directives=["#SBATCH --job-name=naws","#SBATCH --nodes=1","#SBATCH --ntasks=1","#SBATCH --cpus-per-task="+str(self.resources["cores"]),
+                    "#SBATCH --time="+self.resources["walltime"],"#SBATCH --output="+submitdir+"/naws-%A_%a.out"]
+        if self.resources["memory"]!=None:
+            directives.append("#SBATCH --mem="+str(self.resources["memory"])+"M")
+        if self.resources["queue"]!=None:
+            directives.append("#SBATCH --partition="+self.resources["queue"])
+        if self.resources["account"]!=None:
+            directives.append("#SBATCH --account="+self.resources["account"])
+        if self.resources["email"]!=None:
+            directives+=["#SBATCH --mail-user="+self.resources["email"],"#SBATCH --mail-type=END,FAIL"]
+        directives.append("#SBATCH --array=0-"+str(numberofjobs-1))
+        return directives
+
+    def arrayindex(self):
+        return "${SLURM_ARRAY_TASK_ID:-0}"
+
+# The local backend runs all the jobs at once on this machine and waits for them, for testing and single-node runs
+# The jobs share the cores (and memory) of the machine instead of each detecting all of it,
+# and write their output to submitdir/local-<index>.out
+class LocalBackend(Backend):
+    name="local"
+
+    def __init__(self,resources):
+        Backend.__init__(self,resources)
+        if resources.get("cores")==None:
+            self.resources["cores"]=workflow.detectcores()
+
+    def jobresources(self,numberofjobs):
+        memory=self.resources["memory"]
+        if memory!=None:
+            memory=max(memory/numberofjobs,1)
+        return max(self.resources["cores"]/numberofjobs,1),memory
+
+    def writescript(self,submitfile,jobfile,numberofjobs,workflowexec,execdir,queue=False,oversubscribe=1):
+        submitdir=os.path.dirname(os.path.abspath(submitfile))
+        with open(submitfile,'w') as f:
+            f.write("#!/bin/bash\n\n")
+            f.write("echo \" [ STARTING JOBS ]\"\ndate\n\n")
+            f.write("cd "+execdir+"\n\n")
+            f.write("PIDS=\"\"\nINDEX=0\n")
+            f.write("while read TASKLIST; do\n")
+            f.write("    "+self.workflowcommand(workflowexec,queue,oversubscribe,numberofjobs)+" > "+submitdir+"/local-$INDEX.out 2>&1 &\n")
+            f.write("    PIDS=\"$PIDS $!\"\n    INDEX=$((INDEX+1))\ndone < "+jobfile+"\n\n")
+            f.write("STATUS=0\nfor PID in $PIDS; do\n    wait $PID || STATUS=1\ndone\n\n")
+            f.write("date\necho \" [ FINISHED JOBS ]\"\nexit $STATUS\n")
+
+    # Run the jobs now and wait for them. Returns the pid of the script as the job id
+    def submit(self,submitfile):
+        process=subprocess.Popen(["bash",submitfile])
+        returncode=process.wait()
+        if returncode!=0:
+            raise subprocess.CalledProcessError(returncode,submitfile)
+        return str(process.pid)
+
+backends={"pbs":PBSBackend,"torque":TorqueBackend,"slurm":SlurmBackend,"local":LocalBackend}
+
+# Find what generate-tasks.py wrote in workflowdir : its shared queue, or else its tasklists
+# (not the journal, accounting or index files of the workflow next to them)
+def findtasklists(workflowdir):
+    queuefile=workflowdir+"/tasklists/queue.db"
+    if os.path.exists(queuefile):
+        return [queuefile]
+    tasklistfiles = [tasklistfile for tasklistfile in glob.glob(workflowdir+"/tasklists/*.jsonl") if re.match(r"tasklist\d+\.jsonl$",os.path.basename(tasklistfile))]
+    tasklistfiles.sort(key=lambda tasklistfile: int(re.search(r"(\d+)\.jsonl$",tasklistfile).group(1)))
+    return tasklistfiles
+
+# Create the submission script of the jobs running the tasklists, or of numberofjobs jobs sharing a queue (a .db file),
+# in workflowdir/submit-scripts with the backend (pbs, torque, slurm or local) and the resources of a job, and submit it
+# unless dryrun. Returns the submit script
+def submittasklists(workflowdir,tasklistfiles,workflowexec,numberofthreads,execdir,numberofjobs=1,oversubscribe=1,backend="pbs",resources={},dryrun=False):
+    if backend not in backends:
+        raise ValueError("Unknown backend "+backend+" (one of "+", ".join(sorted(backends))+")")
+    batch=backends[backend](resources)
+
+    print "Creating submit-scripts directory"
+    submitdir = workflowdir+'/submit-scripts/'
+    if not os.path.exists(submitdir):
+       os.mkdir(submitdir)
+
+    queue=len(tasklistfiles)==1 and tasklistfiles[0].endswith(".db")
+    if queue:
+        # Every job pulls from the shared queue (more jobs can be submitted the same way while they run)
+        print "Jobs share the queue",tasklistfiles[0]
+        jobtasklists=tasklistfiles*numberofjobs
+    else:
+        print tasklistfiles
+        jobtasklists=tasklistfiles
+
+    # Line i of the job file is the tasklist of job i of the array
+    jobfile=os.path.abspath(submitdir+"jobs.txt")
+    with open(jobfile,'w') as f:
+        for tasklistfile in jobtasklists:
+            f.write(os.path.abspath(tasklistfile)+"\n")
+
+    submitfile=submitdir+"submit-"+batch.name+".sh"
+    print " Creating",submitfile,"for",len(jobtasklists),"jobs with tasks of",numberofthreads,"threads","in directory:",execdir
+    batch.writescript(submitfile,jobfile,len(jobtasklists),workflowexec,execdir,queue,oversubscribe)
+
+    if dryrun:
+        print "Not submitting",submitfile,"(dry run)"
+    else:
+        jobid=batch.submit(submitfile)
+        print "Submitted",submitfile,"as job",jobid
+    return submitfile
+
+# Main program code
+def main():
+
+    usage="submit-tasklists.py -w <workflow.py path> -d <workflow directory> -n <number of threads> -e <exec dir> [-j <number of jobs sharing a queue>] [--oversubscribe=<threads per core>]\n"
+    usage+="                    [-b <pbs|torque|slurm|local>] [--dry-run] [--cores=<cores per job>] [--memory=<MB per job>] [--walltime=<hh:mm:ss>] [--batch-queue=<queue or partition>] [--account=<account>] [--email=<address>]"
+
+    try:
+        opts,args=getopt.getopt(sys.argv[1:],"w:d:n:e:j:b:",["workflowxec=","dir=","num=","execdir=","jobs=","oversubscribe=","backend=","dry-run","cores=","memory=","walltime=","batch-queue=","account=","email="])
+    except getopt.GetoptError:
+        print usage
+        sys.exit(1)
+
+    execdir=""
+    workflowexec=""
+    workflowdir=""
+    numberofthreads=0
+    numberofjobs=1 # Only used with a shared queue, otherwise there is one job per tasklist
+    oversubscribe=1
+    backend="pbs"
+    dryrun=False # Only write the submit script
+    resources={}
+    err=0
+    for opt, arg in opts:
+        if opt in ("-n", "--num"):
+            numberofthreads=int(arg)
+        if opt in ("-w", "--workflowxec"):
+            workflowexec=arg
+        if opt in ("-d", "--dir"):
+            workflowdir=arg
+        if opt in ("-e", "--execdir"):
+            execdir=arg
+        if opt in ("-j", "--jobs"):
+            numberofjobs=int(arg)
+        if opt=="--oversubscribe":
+            oversubscribe=int(arg)
+        if opt in ("-b", "--backend"):
+            backend=arg
+        if opt=="--dry-run":
+            dryrun=True
+        if opt in ("--cores","--memory"):
+            resources[opt[2:]]=int(arg)
+        if opt in ("--walltime","--account","--email"):
+            resources[opt[2:]]=arg
+        if opt=="--batch-queue":
+            resources["queue"]=arg
+    if numberofthreads<=0:
+        print " [ ERROR ] Number of threads per task must be greater than 0"
+        err=1
+    if workflowexec=="":
+        print " [ ERROR ] Must assign workflowexec"
+        err=1
+    if workflowdir=="": 
+        print " [ ERROR ] Must assign a workflow directory"
+        err=1
+    if execdir=="": 
+        print " [ ERROR ] Must assign an exec directory"
+        err=1
+    if oversubscribe<=0:
+        print " [ ERROR ] Oversubscription must be greater than 0"
+        err=1
+    if backend not in backends:
+        print " [ ERROR ] Backend must be one of",", ".join(sorted(backends))
+        err=1
+    if min(resources.get("cores",1),resources.get("memory",1))<=0:
+        print " [ ERROR ] Cores and memory per job must be greater than 0"
+        err=1
+
+    print "Number of threads per task",numberofthreads
+
+    if err==1:
+        print usage
+        sys.exit(1)
+
+    print "Starting to generate submit scripts"
+
+    pworkflowdir="."
+    os.chdir(pworkflowdir)
+
+    print "Current working directory :",os.getcwd()
+
+    try:
+        submittasklists(workflowdir,findtasklists(workflowdir),workflowexec,numberofthreads,execdir,numberofjobs,oversubscribe,backend,resources,dryrun)
+    except (subprocess.CalledProcessError,OSError) as e:
+        print " [ ERROR ] Problem submitting the jobs :",e
+        sys.exit(1)
+
+# Run main
+if __name__=="__main__":
+   main()
+
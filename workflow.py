@@ -7,16 +7,25 @@ Authors and contributors: Eric Shook (eshook@kent.edu)
 
 import os
 import datetime
-import time
 import re
 import subprocess
-from Queue import Queue
+import json
+import glob
+import bisect
+import heapq
+import multiprocessing
 #from threading import Thread
 import threading
+import signal
+import select
+import fcntl
+import time
+import socket
+import sqlite3
 import sys,getopt
 
 '''
-The workflow script accepts a tasklist file, which contains a list of taskfiles.
+The workflow script accepts a tasklist file, which is a task manifest with one task per line.
 A task may represent a simulation of an ABM or climate model. Tasks can be run 
 simultaneously if there are no dependencies or ordered in the case of 
 dependencies. Tasks may also include pre-processing or post-processing tasks.
@@ -24,190 +33,1118 @@ dependencies. Tasks may also include pre-processing or post-processing tasks.
 
 # TODO: Logging may be useful if the workflow becomes long
 
-# TODO: Currently num_threads is user-defined, which controls the number of threads to launch tasks
-#       However, it would be better to include in the taskfile the number of cores needed
-#       and define the number of cores available, enabling the workflow system to manage core allocation
-
 # Global variables
 
-# The number of threads used to handle tasks is passed as a parameter
-num_threads=0
+# Sort key that orders the numbers inside names by value (task 1.2 before task 1.10)
+def naturalkey(name):
+    return [int(part) if part.isdigit() else part for part in re.split(r"(\d+)",name)]
+
+# Load the tasks of a task manifest (JSON Lines written by generate-tasks.py) with a single read
+# Each task holds the following (additional keys are ignored)
+#   {"id": "1.4", "stage": 1, "program": "/path/to/executable_with_a_name", "args": ["param1", "param2"],
+#    "deps": ["1.2"], "cores": 8, "memory": 4480, "cost": 12.5, "experiment": "experiment60a4",
+#    "outputs": ["out.table.model.nlogo.experiment60a4.*.csv"]}
+def loadtasks(tasklistfile):
+    with open(tasklistfile,'r') as f:
+        lines=f.read().splitlines()
+    tasks=[]
+    for line in lines:
+        if line.strip()=="":
+            continue
+        task=json.loads(line)
+        # Error checking for required parameters
+        if "program" not in task:
+            raise Exception("program missing in task",task.get("id"))
+        if "args" not in task:
+            raise Exception("args missing in task",task.get("id"))
+        tasks.append(task)
+    return tasks
+
+# The cores and memory (MB) a task declares (one core and no memory by default)
+def taskcores(task):
+    return int(task.get("cores",1))
+
+def taskmemory(task):
+    return int(task.get("memory",0))
+
+# Delete the files a task writes (the glob patterns in its "outputs"), which are left over
+# from an earlier attempt of the task that did not finish, and the unfinished (.part) files of any attempt
+def discardoutputs(task):
+    for pattern in task.get("outputs",[]):
+        for filename in glob.glob(pattern)+glob.glob(pattern+".part*"):
+            print "Discarding partial output of task",task["id"],":",filename
+            os.remove(filename)
+
+# Delete the unfinished files of an attempt of a task that failed or was killed
+# A program writes an output to <output>.part<its pid> and renames it once complete (see runabm.sh)
+# so other attempts of the task running at the same time keep their files
+def discardpartial(task,pid):
+    for pattern in task.get("outputs",[]):
+        for filename in glob.glob(pattern+".part"+str(pid)):
+            print "Discarding partial output of task",task["id"],":",filename
+            os.remove(filename)
+
+# The journal records the start and finish of every task, one JSON record per line:
+#   {"event": "start", "id": "1.4", "time": "..."}
+#   {"event": "finish", "id": "1.4", "time": "...", "returncode": 0}
+# Every record is flushed to disk before the workflow goes on, so after a crash (node failure,
+# walltime kill) the journal holds every task that finished and the workflow can resume from it
+class Journal(object):
+    def __init__(self,journalfile,append):
+        self.lock=threading.Lock()
+        self.f=open(journalfile,'a' if append else 'w')
+        # Records go after a last record cut short by a crash, not on the same line
+        if append and self.f.tell()>0:
+            with open(journalfile,'rb') as last:
+                last.seek(-1,os.SEEK_END)
+                if last.read(1)!="\n":
+                    self.f.write("\n")
+
+    def record(self,event,task,returncode=None):
+        entry={"event":event,"id":task["id"],"time":str(datetime.datetime.now())}
+        if returncode!=None:
+            entry["returncode"]=returncode
+        with self.lock:
+            self.f.write(json.dumps(entry,sort_keys=True)+"\n")
+            self.f.flush()
+            os.fsync(self.f.fileno())
+
+# The ids of the tasks that finished successfully according to a journal
+# A last record cut short by a crash is ignored
+def readjournal(journalfile):
+    finished=set()
+    if not os.path.exists(journalfile):
+        return finished
+    with open(journalfile,'r') as f:
+        for line in f:
+            try:
+                entry=json.loads(line)
+            except ValueError:
+                continue
+            if entry["event"]=="start":
+                finished.discard(entry["id"])
+            elif entry["event"]=="finish" and entry.get("returncode")==0:
+                finished.add(entry["id"])
+    return finished
+
+# The accounting file records every attempt of a task, one JSON record per line:
+#   {"id": "1.4", "experiment": "exp3", "attempt": 1, "host": "node12", "job": "1234.pbs",
+#    "start": 1400000000.0, "end": 1400000060.5, "wall": 60.5, "queuewait": 2.1,
+#    "user": 58.2, "system": 1.3, "maxrss": 812.5, "returncode": 0, "result": "done",
+#    "cores": 1, "memory": 896, "cost": 12.5}
+# Times are in seconds (start and end since the epoch), maxrss is the peak resident memory in MB
+# and queuewait is the time between the task being ready and the attempt starting
+# user, system and maxrss are null when they cannot be measured
+class Accounting(object):
+    def __init__(self,accountingfile):
+        self.lock=threading.Lock()
+        self.f=open(accountingfile,'a')
+        self.host=socket.gethostname()
+        self.job=os.environ.get("PBS_JOBID",os.environ.get("SLURM_JOB_ID",""))
+
+    def record(self,entry):
+        entry=dict(entry,host=self.host,job=self.job)
+        with self.lock:
+            self.f.write(json.dumps(entry,sort_keys=True)+"\n")
+            self.f.flush()
 
-# Array of threads (so they can be killed if needed)
-threads=[]
+# The CPU time and peak memory of a child from its rusage (os.wait4)
+def rusageusage(rusage):
+    return {"user":rusage.ru_utime,"system":rusage.ru_stime,"maxrss":rusage.ru_maxrss/1024.0} # ru_maxrss is in KB
+
+# The CPU time and peak memory so far of a running process from /proc, or None
+# (used for workers, which do not exit after each task)
+def procusage(pid):
+    try:
+        with open("/proc/%i/stat"%pid,'r') as f:
+            fields=f.read().rsplit(")",1)[1].split()
+        with open("/proc/%i/status"%pid,'r') as f:
+            status=dict(line.split(":",1) for line in f.read().splitlines() if ":" in line)
+    except IOError:
+        return None
+    ticks=float(os.sysconf("SC_CLK_TCK"))
+    # utime, stime, cutime and cstime are fields 14 to 17 of stat (11 to 14 after the command)
+    return {"user":(int(fields[11])+int(fields[13]))/ticks,"system":(int(fields[12])+int(fields[14]))/ticks,
+            "maxrss":int(status.get("VmHWM","0 kB").split()[0])/1024.0}
 
-# Array of task workflow numbers (one per thread/worker)
-threadtasknums=[]
+# The return code of a failed task, or -1 if it did not give one (e.g. its worker quit)
+def failedreturncode(e):
+    if isinstance(e,subprocess.CalledProcessError):
+        return e.returncode
+    return getattr(e,"returncode",-1)
 
-# Task queue
-taskqueue=Queue()
+# Runners execute tasks for the task workers, each task worker has its own runner
+# A runner has run(task), which raises an exception if the task fails, kill(), which stops the task it
+# runs (from another thread), and close(). pid is the process that ran the last task
+# Tasks run in their own process group so kill() stops the program with everything it started
+
+# Seconds between asking a killed task to terminate and forcing it to
+killgrace=10
+
+# Terminate a process group, and kill it if it is still running after killgrace seconds
+# Returns the timer of the kill (cancel it once the process has exited), or None
+def killgroup(process):
+    try:
+        os.killpg(process.pid,signal.SIGTERM)
+    except OSError:
+        return None
+    def force():
+        if process.poll()==None:
+            try:
+                os.killpg(process.pid,signal.SIGKILL)
+            except OSError:
+                pass
+    timer=threading.Timer(killgrace,force)
+    timer.daemon=True
+    timer.start()
+    return timer
 
-# This function handles executing a task defined by a taskfile
-def runtask(taskfile):
+# Stop the kill timer of a process that has exited
+def canceltimer(timer):
+    if timer!=None:
+        timer.cancel()
+        timer.join()
 
-    # Read and parse the taskfile with the following format
-    # Note additional parameters will likely be added based on need (e.g., CWD, data-dir)
+# Start the program of a task in a new process (exec-style, without a shell) in its own process group
+# Its stdout and stderr go to <logdir>/<task id>.out and .err (appended to by every attempt)
+def starttask(task,logdir):
+    print "Calling program="+task["program"]," ".join(task["args"])
     '''
-    program: /path/to/executable_with_a_name 
-    parameters: param1 -Optionalconfiguration param2 -AnotherParameter
+    In future versions that have defined input,output,stdout,etc.
+    there could be more logic here to:
+        - run each model in a defined directory
+        - package up output files for easier transfer
+        - ...
     '''
-    with open(taskfile,'r') as f:
-        # Set the required parameters as None for error checking at the end
-        program=None
-        parameters=None
-        for line in f:
-            if line.startswith("program:"):
-                # Extract the entire program location from after the colon split()[1]) with whitespace removed (strip())
-                program=line.split(":",1)[1].strip() 
-                #print "Program="+program
-          
-            if line.startswith("parameters:"):
-                # Extract the parameter string from after the colon split()[1]) with whitespace removed (strip())
-                parameters=line.split(":",1)[1].strip() 
-                #print "Parameters="+parameters
+    env=dict(os.environ,NAWS_TASKID=task["id"])
+    with open(os.path.join(logdir,task["id"]+".out"),'a') as out, open(os.path.join(logdir,task["id"]+".err"),'a') as err:
+        return subprocess.Popen([task["program"]]+task["args"],stdout=out,stderr=err,env=env,preexec_fn=os.setsid,close_fds=True)
 
-        # Error checking for required parameters
-        if program==None:
-            raise Exception("program missing in taskfile",taskfile) 
-        if  parameters==None:
-            raise Exception("parameters missing in taskfile",taskfile) 
-
-        print "Calling program="+program,parameters
-        '''
-        In future versions that have defined input,output,stdout,etc.
-        there could be more logic here to:
-            - run each model in a defined directory
-            - output stdout,stderr in the directory
-            - package up output files for easier transfer
-            - ...
-        '''
-        returncode=subprocess.check_call(program+" "+parameters,shell=True)
-
-# A task worker loops while there are tasks left in the taskqueue
+# The process runner executes the program of each task in a new process
+class ProcessRunner(object):
+    def __init__(self,logdir):
+        self.logdir=logdir
+        self.lock=threading.Lock()
+        self.process=None
+        self.killed=False
+        self.timer=None
+        self.pid=None
+        self.usage=None # CPU time and peak memory of the last task
+
+    def run(self,task):
+        self.usage=None
+        try:
+            with self.lock:
+                if self.killed:
+                    raise Exception("Killed before it started")
+                self.process=starttask(task,self.logdir)
+                self.pid=self.process.pid
+            pid,status,rusage=os.wait4(self.process.pid,0)
+            returncode=-os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+            self.process.returncode=returncode
+            self.usage=rusageusage(rusage)
+            if returncode!=0:
+                raise subprocess.CalledProcessError(returncode,task["program"])
+        finally:
+            with self.lock:
+                canceltimer(self.timer)
+                self.timer=None
+                self.process=None
+                self.killed=False
+
+    def kill(self):
+        with self.lock:
+            self.killed=True
+            if self.process!=None and self.timer==None:
+                self.timer=killgroup(self.process)
+
+    def close(self):
+        pass
+
+# The worker runner keeps one long-lived worker process (e.g. runabm-worker.sh, a warm NetLogo JVM)
+# and streams tasks to it, which saves the startup of a process per task
+# Protocol (one line per message, fields separated by tabs):
+#   workflow -> worker (stdin)  : <task id> <args of the task as they would be given to its program>
+#   worker -> workflow (stdout) : <task id> <return code>
+# A worker writes its own output to stderr and quits when its stdin is closed
+# Killing a task kills its worker, which is restarted for the next task
+# The CPU time of a task is the CPU time the worker used while running it, its peak memory
+# is the peak of the worker so far
+class WorkerRunner(object):
+    def __init__(self,command):
+        self.command=command
+        self.lock=threading.Lock()
+        self.worker=None
+        self.killed=False
+        self.timer=None
+        self.pid=None
+        self.usage=None
+
+    def start(self):
+        print "Starting worker :",self.command
+        # exec so the pid of the worker is the one of the command (its unfinished files are named after it)
+        self.worker=subprocess.Popen("exec "+self.command,shell=True,stdin=subprocess.PIPE,stdout=subprocess.PIPE,preexec_fn=os.setsid)
+        self.pid=self.worker.pid
+
+    def run(self,task):
+        self.usage=None
+        try:
+            with self.lock:
+                if self.killed:
+                    raise Exception("Killed before it started")
+                if self.worker==None or self.worker.poll()!=None:
+                    self.start()
+            before=procusage(self.pid)
+            self.send(task)
+            after=procusage(self.pid)
+            if before!=None and after!=None:
+                self.usage={"user":after["user"]-before["user"],"system":after["system"]-before["system"],"maxrss":after["maxrss"]}
+        finally:
+            with self.lock:
+                self.killed=False
+
+    def send(self,task):
+        fields=[task["id"]]+task["args"]
+        for field in fields:
+            if "\t" in field or "\n" in field:
+                raise Exception("Worker task fields cannot hold tabs or newlines : "+repr(field))
+        print "Sending to worker task="+task["id"]," ".join(task["args"])
+        try:
+            self.worker.stdin.write("\t".join(fields)+"\n")
+            self.worker.stdin.flush()
+            reply=self.worker.stdout.readline()
+        except IOError:
+            reply=""
+        if reply=="":
+            # The worker died (e.g. out of memory or killed) and is restarted for the next task
+            with self.lock:
+                self.worker.wait()
+                canceltimer(self.timer)
+                self.timer=None
+                self.worker=None
+            raise Exception("Worker quit while running the task")
+        replyid,returncode=reply.rstrip("\n").split("\t")
+        if replyid!=task["id"]:
+            raise Exception("Worker replied for task "+replyid)
+        if int(returncode)!=0:
+            e=Exception("Worker returned "+returncode)
+            e.returncode=int(returncode)
+            raise e
+
+    def kill(self):
+        with self.lock:
+            self.killed=True
+            if self.worker!=None and self.timer==None:
+                self.timer=killgroup(self.worker)
+
+    def close(self):
+        if self.worker!=None:
+            self.worker.stdin.close()
+            self.worker.wait()
+            self.worker=None
+
+# Parse a Linux cpu list such as 0-3,8-11 into the number of cpus
+def countcpulist(cpulist):
+    count=0
+    for part in cpulist.strip().split(","):
+        if "-" in part:
+            first,last=part.split("-")
+            count+=int(last)-int(first)+1
+        elif part!="":
+            count+=1
+    return count
+
+# Read the first line of a file, or None if it cannot be read
+def readfirstline(filename):
+    try:
+        with open(filename,'r') as f:
+            return f.readline().strip()
+    except IOError:
+        return None
+
+# Detect the number of cores this process may use
+# This is the smallest of the cores of the node, the cpus in its affinity mask (e.g. a PBS cpuset)
+# and the cgroup CPU quota (e.g. a Slurm or container limit)
+def detectcores():
+    cores=multiprocessing.cpu_count()
+    status=open("/proc/self/status").read() if os.path.exists("/proc/self/status") else ""
+    for line in status.splitlines():
+        if line.startswith("Cpus_allowed_list:"):
+            cores=min(cores,countcpulist(line.split(":",1)[1]))
+    quota=readfirstline("/sys/fs/cgroup/cpu.max") # cgroup v2 : <quota> <period>
+    if quota!=None and not quota.startswith("max"):
+        quota,period=quota.split()
+        cores=min(cores,max(int(float(quota)/float(period)),1))
+    quota=readfirstline("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") # cgroup v1
+    period=readfirstline("/sys/fs/cgroup/cpu/cpu.cfs_period_us")
+    if quota!=None and period!=None and int(quota)>0:
+        cores=min(cores,max(int(float(quota)/float(period)),1))
+    return cores
+
+# Detect the memory (MB) this process may use
+# This is the smallest of the available memory of the node and the cgroup memory limit
+def detectmemory():
+    memory=None
+    if os.path.exists("/proc/meminfo"):
+        meminfo={}
+        for line in open("/proc/meminfo").read().splitlines():
+            name,value=line.split(":",1)
+            meminfo[name]=int(value.split()[0])//1024 # kB to MB
+        memory=meminfo.get("MemAvailable",meminfo.get("MemTotal"))
+    for limitfile in ("/sys/fs/cgroup/memory.max","/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+        limit=readfirstline(limitfile)
+        if limit!=None and limit.isdigit():
+            limit=int(limit)//(1024*1024)
+            if memory==None or limit<memory:
+                memory=limit
+    return memory
+
+# The claimable tasks of a shared queue, most expensive first (parameters: heartbeat before which claims
+# have expired, cores, memory)
+claimablequery="""SELECT id,task,state FROM tasks
+    WHERE (state='pending' OR (state='claimed' AND heartbeat<?)) AND cores<=? AND memory<=?
+    AND stage=(SELECT MIN(stage) FROM tasks WHERE state IN ('pending','claimed'))
+    AND NOT EXISTS (SELECT 1 FROM deps JOIN tasks AS dep ON dep.id=deps.dep WHERE deps.id=tasks.id AND dep.state!='done')
+    ORDER BY cost DESC LIMIT 1"""
+
+# A task queue shared by the jobs of a workflow, an SQLite database on the shared filesystem
+# written by generate-tasks.py --queue (see createqueue there). Every job pulls tasks from it, so work is
+# balanced across the nodes and jobs can be added while the workflow runs. Its tables are:
+#   tasks (id, stage, cost, cores, memory, spawns, task, state, owner, heartbeat, attempts)
+#   deps (id, dep)
+# where task is the task in JSON and state is pending, claimed, done, failed or skipped.
+# A task with spawns set adds tasks to the queue while it runs (see generatetasks.appendqueue and adaptreplication.py).
+# A task is claimed in a transaction, so one job gets it. A job renews the heartbeat of its claims
+# and the claims of a job that stopped renewing them for lease seconds (a crashed node) can be claimed again.
+class SharedQueue(object):
+    def __init__(self,queuefile,lease=600.0):
+        self.queuefile=queuefile
+        self.lease=lease
+        self.owner=socket.gethostname()+":"+str(os.getpid())
+        # Connections wait on the locks of other jobs rather than failing
+        self.db=sqlite3.connect(queuefile,timeout=300,isolation_level=None,check_same_thread=False)
+        self.lock=threading.Lock()
+        self.lastheartbeat=0
+        self.lastpending=(0,True) # (time,result) of the last check for pending tasks
+
+    # Claim the most expensive task that fits in cores and memory (MB), whose deps are done and whose
+    # stage is the earliest unfinished one. Returns (task,reclaimed) or (None,False) if none can be claimed
+    # reclaimed tells that the task was claimed by a job that stopped (and may have left partial outputs)
+    def claim(self,cores,memory):
+        with self.lock:
+            now=time.time()
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                row=self.db.execute(claimablequery,(now-self.lease,cores,memory)).fetchone()
+                if row==None:
+                    self.db.execute("COMMIT")
+                    return None,False
+                self.db.execute("UPDATE tasks SET state='claimed',owner=?,heartbeat=?,attempts=attempts+1 WHERE id=?",(self.owner,now,row[0]))
+                self.db.execute("COMMIT")
+            except:
+                self.db.execute("ROLLBACK")
+                raise
+            return json.loads(row[1]),row[2]=="claimed"
+
+    # Record that a claimed task finished, when it failed the tasks depending on it and
+    # the tasks of later stages are skipped
+    def finish(self,taskid,succeeded):
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                self.db.execute("UPDATE tasks SET state=? WHERE id=?",("done" if succeeded else "failed",taskid))
+                if not succeeded:
+                    self.db.execute("UPDATE tasks SET state='skipped' WHERE state='pending' AND stage>(SELECT stage FROM tasks WHERE id=?)",(taskid,))
+                    while self.db.execute("""UPDATE tasks SET state='skipped' WHERE state='pending' AND id IN
+                        (SELECT deps.id FROM deps JOIN tasks AS dep ON dep.id=deps.dep WHERE dep.state IN ('failed','skipped'))""").rowcount>0:
+                        pass
+                self.db.execute("COMMIT")
+            except:
+                self.db.execute("ROLLBACK")
+                raise
+
+    # Renew the claims of this job (at most every lease/10 seconds)
+    def heartbeat(self,taskids):
+        with self.lock:
+            now=time.time()
+            if now-self.lastheartbeat<self.lease/10 or len(taskids)==0:
+                return
+            self.lastheartbeat=now
+            self.db.executemany("UPDATE tasks SET heartbeat=? WHERE id=? AND owner=? AND state='claimed'",[(now,taskid,self.owner) for taskid in taskids])
+
+    # Whether tasks are still waiting to be claimed or may be added by a running task that spawns tasks
+    # (checked at most every 5 seconds)
+    # Tasks that cannot be claimed while no job runs a task (a cycle or a dep on a later stage)
+    # will never be claimed, so they do not count
+    def haspending(self):
+        with self.lock:
+            now=time.time()
+            if now-self.lastpending[0]>=5:
+                pending=self.db.execute("SELECT COUNT(*) FROM tasks WHERE state='pending' OR (state='claimed' AND heartbeat<?)",(now-self.lease,)).fetchone()[0]
+                spawning=self.db.execute("SELECT COUNT(*) FROM tasks WHERE state='claimed' AND spawns=1 AND heartbeat>=?",(now-self.lease,)).fetchone()[0]
+                result=pending>0 or spawning>0
+                if pending>0 and self.db.execute("SELECT COUNT(*) FROM tasks WHERE state='claimed' AND heartbeat>=?",(now-self.lease,)).fetchone()[0]==0:
+                    if self.db.execute(claimablequery,(now-self.lease,sys.maxint,sys.maxint)).fetchone()==None:
+                        print " [ ERROR ]",pending,"tasks in the queue can never be claimed (a cycle or a dep on a later stage)"
+                        result=False
+                self.lastpending=(now,result)
+            return self.lastpending[1]
+
+    # The number of tasks in each state
+    def counts(self):
+        with self.lock:
+            return dict(self.db.execute("SELECT state,COUNT(*) FROM tasks GROUP BY state").fetchall())
+
+# The scheduler releases tasks as soon as their dependencies have finished
+# A task depends on the tasks listed in its "deps" and on every task of an earlier stage (the 1. in task 1.4),
+# tasks of the same stage without deps between them are independent and run in any order.
+# Ready tasks are handed out most expensive first (by their cost hint) to shorten the tail of the workflow.
+# If a task fails, the tasks depending on it (including every task of a later stage) are skipped.
+# Tasks declare the cores and memory (MB) they use and only start when they fit in what is left of
+# the node (cores,memory). When the first ready task does not fit, smaller ready tasks are backfilled
+# into the leftover capacity. A task larger than the node runs alone.
+# A task runs in one or more attempts:
+#  - a failed attempt is retried up to retries times, after backoff, 2*backoff, 4*backoff... seconds
+#  - an attempt running longer than the timeout of its task ("timeout" or the default timeout) is killed (and retried)
+#  - when nothing is ready, a task running speculate times longer than predicted gets a duplicate attempt
+#    in the idle cores. Its runtime is predicted from its cost and the runtime per unit of cost of the
+#    tasks that finished. The first attempt to finish wins and the others are killed
+# With a shared queue (source), the scheduler claims a task from the queue whenever nothing ready fits
+# the free cores and memory, and records in the queue how the tasks it claimed finished
+class Scheduler(object):
+    def __init__(self,tasks,cores,memory,retries=0,backoff=10.0,timeout=None,speculate=None,accounting=None,source=None):
+        self.condition=threading.Condition()
+        self.tasks=dict((task["id"],task) for task in tasks)
+        self.ready=[] # A sorted list of (-cost,natural order,task id)
+        self.cores=cores
+        self.memory=memory
+        self.freecores=cores
+        self.freememory=memory
+        self.retries=retries
+        self.backoff=backoff
+        self.timeout=timeout
+        self.speculate=speculate
+        self.accounting=accounting
+        self.source=source
+        self.lastclaim=(0,None) # (time,free cores and memory) of the last claim that found nothing
+        self.signaled=False
+        self.readytime={} # When each task was last released, to measure how long it waited
+        self.started={} # Number of attempts started for each task
+        self.unfinisheddeps={} # Number of unfinished deps of each task
+        self.dependents=dict((taskid,[]) for taskid in self.tasks)
+        self.unfinishedstage={} # Number of unfinished tasks in each stage
+        self.unfinished=len(tasks)
+        self.running=0
+        self.attempts={} # The running attempts of each task : {"runner","start","killed"}
+        self.tries={} # Number of failed attempts of each task
+        self.delayed=[] # A heap of (time,task id) of the tasks waiting to be retried
+        self.completed=set()
+        self.speculated=set()
+        self.rates=[] # Runtime per unit of cost of the tasks that finished
+        self.failed=[]
+        self.skipped=set()
+        # The last completion writes to this pipe so main can wait on it (and still be interrupted with ^C)
+        self.donepipe=os.pipe()
+
+        for task in tasks:
+            stage=int(task.get("stage",1))
+            self.unfinishedstage[stage]=self.unfinishedstage.get(stage,0)+1
+            deps=[dep for dep in task.get("deps",[]) if dep in self.tasks]
+            self.unfinisheddeps[task["id"]]=len(deps)
+            for dep in deps:
+                self.dependents[dep].append(task["id"])
+        self.stages=sorted(self.unfinishedstage)
+        self.openstage=None
+        self.openstages()
+        self.checkstalled()
+        self.signaldone()
+
+    # Whether every task has finished (and the shared queue has no task left to claim)
+    def finished(self):
+        return self.unfinished==0 and (self.source==None or not self.source.haspending())
+
+    # Write the done pipe once every task has finished
+    def signaldone(self):
+        if not self.signaled and self.finished():
+            self.signaled=True
+            os.write(self.donepipe[1],"x")
+
+    # Add a task claimed from the shared queue, its stage and deps are already done so it is ready
+    def addtask(self,task,reclaimed):
+        taskid=task["id"]
+        if reclaimed:
+            print "Claimed task",taskid,"from a job that stopped"
+            discardoutputs(task)
+        self.tasks[taskid]=task
+        self.dependents[taskid]=[]
+        self.unfinisheddeps[taskid]=0
+        stage=self.stageof(taskid)
+        self.unfinishedstage[stage]=self.unfinishedstage.get(stage,0)+1
+        self.unfinished+=1
+        self.release(taskid)
+
+    # Claim a task that fits from the shared queue, unless the last claim found nothing
+    # in the last seconds with the same free cores and memory
+    def claim(self):
+        free=(self.freecores,self.freememory)
+        if self.source==None or (time.time()-self.lastclaim[0]<2 and self.lastclaim[1]==free):
+            return False
+        cores,memory=free if self.running>0 else (sys.maxint,sys.maxint) # A task larger than the node runs alone
+        task,reclaimed=self.source.claim(cores,memory)
+        if task==None:
+            self.lastclaim=(time.time(),free)
+            return False
+        self.addtask(task,reclaimed)
+        return True
+
+    def stageof(self,taskid):
+        return int(self.tasks[taskid].get("stage",1))
+
+    def release(self,taskid):
+        task=self.tasks[taskid]
+        self.readytime[taskid]=time.time()
+        bisect.insort(self.ready,(-float(task.get("cost",1.0)),naturalkey(taskid),taskid))
+
+    def isready(self,taskid):
+        return any(readyid==taskid for cost,order,readyid in self.ready)
+
+    # Open the earliest stage with unfinished tasks and release its tasks that have no unfinished deps
+    # When a task of an earlier stage failed, the tasks of the stage are skipped instead
+    def openstages(self):
+        while len(self.stages)>0 and self.unfinishedstage[self.stages[0]]==0:
+            self.stages.pop(0)
+        if len(self.stages)==0 or self.stages[0]==self.openstage:
+            return
+        self.openstage=self.stages[0]
+        stagetasks=[taskid for taskid in self.tasks if self.stageof(taskid)==self.openstage]
+        if len(self.failed)>0:
+            for taskid in stagetasks:
+                if taskid not in self.skipped:
+                    self.skip(taskid)
+            self.openstages()
+            return
+        for taskid in stagetasks:
+            if self.unfinisheddeps[taskid]==0:
+                self.release(taskid)
+
+    # Skip a task and every task depending on it
+    def skip(self,taskid):
+        pending=[taskid]
+        while len(pending)>0:
+            taskid=pending.pop()
+            if taskid in self.skipped:
+                continue
+            self.skipped.add(taskid)
+            print "Skipping",taskid,"because a task it depends on failed"
+            self.unfinishedstage[self.stageof(taskid)]-=1
+            self.unfinished-=1
+            pending.extend(self.dependents[taskid])
+
+    # Nothing ready, waiting or running while tasks are unfinished means the deps can never be met
+    # (a cycle or a dep on a later stage), so those tasks are skipped rather than waiting forever
+    def checkstalled(self):
+        if len(self.ready)==0 and len(self.delayed)==0 and self.running==0 and self.unfinished>0:
+            print " [ ERROR ] Tasks with deps that can never finish (a cycle or a dep on a later stage)"
+            for taskid in sorted(self.tasks,key=naturalkey):
+                if taskid not in self.skipped and self.unfinishedstage[self.stageof(taskid)]>0:
+                    self.failed.append(taskid)
+                    self.skip(taskid)
+
+    # Release the tasks whose retry backoff is over
+    def releasedelayed(self):
+        while len(self.delayed)>0 and self.delayed[0][0]<=time.time():
+            self.release(heapq.heappop(self.delayed)[1])
+
+    # The first ready task (in priority order) that fits in the free cores and memory, or None
+    def nextfit(self):
+        for i,(cost,order,taskid) in enumerate(self.ready):
+            task=self.tasks[taskid]
+            if self.running==0 or (taskcores(task)<=self.freecores and taskmemory(task)<=self.freememory):
+                del self.ready[i]
+                return task
+        return None
+
+    # Seconds until the next task waiting to be retried is released, or None
+    def nextdelay(self):
+        if len(self.delayed)==0:
+            return None
+        return max(self.delayed[0][0]-time.time(),0.01)
+
+    # Return a ready task that fits on the node now, or None
+    # The runner that will run the task is recorded so the attempt can be killed
+    def trynext(self,runner):
+        with self.condition:
+            self.releasedelayed()
+            task=self.nextfit()
+            if task==None and self.claim():
+                task=self.nextfit()
+            if task==None:
+                return None
+            self.running+=1
+            self.freecores-=taskcores(task)
+            self.freememory-=taskmemory(task)
+            now=time.time()
+            self.started[task["id"]]=self.started.get(task["id"],0)+1
+            self.attempts.setdefault(task["id"],[]).append({"runner":runner,"start":now,"killed":None,
+                "number":self.started[task["id"]],"queuewait":now-self.readytime[task["id"]]})
+            return task
+
+    # Block until a ready task fits on the node and return it, or return None once every task has finished
+    def next(self,runner):
+        with self.condition:
+            task=self.trynext(runner)
+            while task==None and not self.finished():
+                # Wake up for the next retry, if there is one, or to claim from the shared queue again
+                timeout=self.nextdelay()
+                if self.source!=None:
+                    timeout=min(timeout if timeout!=None else 5,5)
+                self.condition.wait(timeout)
+                task=self.trynext(runner)
+            return task
+
+    # Record that a task is finished (succeeded or not) and release the tasks waiting on it
+    def complete(self,taskid,succeeded):
+        self.unfinishedstage[self.stageof(taskid)]-=1
+        self.unfinished-=1
+        if self.source!=None:
+            self.source.finish(taskid,succeeded)
+        if succeeded:
+            self.completed.add(taskid)
+            for dependent in self.dependents[taskid]:
+                self.unfinisheddeps[dependent]-=1
+                if self.unfinisheddeps[dependent]==0 and self.stageof(dependent)==self.openstage and dependent not in self.skipped:
+                    self.release(dependent)
+        else:
+            self.failed.append(taskid)
+            for dependent in self.dependents[taskid]:
+                self.skip(dependent)
+        self.openstages()
+
+    # Record that the attempt of a task run by runner finished (succeeded or not)
+    # with its return code and usage (CPU time and peak memory) in the accounting file
+    # Returns what became of the task : "done", "failed", "retry" (after a backoff) or
+    # "lost" (another attempt of the task finished first or is still running)
+    def finish(self,task,runner,succeeded,returncode=None,usage=None):
+        with self.condition:
+            taskid=task["id"]
+            attempts=self.attempts[taskid]
+            attempt=[attempt for attempt in attempts if attempt["runner"]==runner][0]
+            attempts.remove(attempt)
+            if len(attempts)==0:
+                del self.attempts[taskid]
+            self.running-=1
+            self.freecores+=taskcores(task)
+            self.freememory+=taskmemory(task)
+            if taskid in self.completed or taskid in self.failed:
+                result="lost"
+            elif succeeded:
+                self.rates.append((time.time()-attempt["start"])/max(float(task.get("cost",1.0)),1e-9))
+                for other in attempts:
+                    print "Killing the other attempt of task",taskid
+                    other["killed"]="lost"
+                    other["runner"].kill()
+                if taskid in self.speculated:
+                    self.ready=[entry for entry in self.ready if entry[2]!=taskid] # A duplicate that did not start
+                self.complete(taskid,True)
+                result="done"
+            elif len(attempts)>0 or self.isready(taskid):
+                result="lost"
+            elif self.tries.get(taskid,0)<int(task.get("retries",self.retries)):
+                self.tries[taskid]=self.tries.get(taskid,0)+1
+                delay=self.backoff*2**(self.tries[taskid]-1)
+                print "Retrying task",taskid,"in",delay,"seconds (retry",self.tries[taskid],")"
+                heapq.heappush(self.delayed,(time.time()+delay,taskid))
+                result="retry"
+            else:
+                self.complete(taskid,False)
+                result="failed"
+            if self.accounting!=None:
+                end=time.time()
+                if usage==None:
+                    usage={"user":None,"system":None,"maxrss":None}
+                self.accounting.record(dict(usage,id=taskid,experiment=task.get("experiment"),attempt=attempt["number"],
+                    start=attempt["start"],end=end,wall=end-attempt["start"],queuewait=attempt["queuewait"],
+                    returncode=returncode,result=result,cores=taskcores(task),memory=taskmemory(task),cost=task.get("cost")))
+            self.lastclaim=(0,None) # The free cores and memory changed
+            self.checkstalled()
+            self.signaldone()
+            self.condition.notify_all()
+            return result
+
+    # Kill the attempts running past their timeout and launch duplicates of stragglers
+    # Called regularly by main
+    def watch(self):
+        with self.condition:
+            now=time.time()
+            for taskid,attempts in self.attempts.items():
+                timeout=self.tasks[taskid].get("timeout",self.timeout)
+                for attempt in attempts:
+                    if timeout!=None and attempt["killed"]==None and now-attempt["start"]>float(timeout):
+                        print " [ ERROR ] Task",taskid,"timed out after",timeout,"seconds, killing it"
+                        attempt["killed"]="timeout"
+                        attempt["runner"].kill()
+            if self.speculate and len(self.rates)>0 and len(self.ready)==0:
+                rate=sorted(self.rates)[len(self.rates)//2]
+                for taskid in sorted(self.attempts,key=naturalkey):
+                    task=self.tasks[taskid]
+                    attempts=self.attempts[taskid]
+                    if taskid in self.speculated or len(attempts)!=1 or attempts[0]["killed"]!=None:
+                        continue
+                    if taskcores(task)>self.freecores or taskmemory(task)>self.freememory:
+                        continue
+                    predicted=float(task.get("cost",1.0))*rate
+                    elapsed=now-attempts[0]["start"]
+                    if elapsed>self.speculate*predicted:
+                        print "Task",taskid,"is a straggler (running %.1f s, predicted %.1f s), launching a duplicate"%(elapsed,predicted)
+                        self.speculated.add(taskid)
+                        self.release(taskid)
+                        break # The free cores are only reserved when the duplicate starts
+            if self.source!=None:
+                self.source.heartbeat([taskid for taskid in self.tasks if taskid not in self.completed and taskid not in self.failed])
+            self.releasedelayed()
+            self.signaldone()
+            self.condition.notify_all()
+
+    # Kill every running attempt (when the workflow is interrupted)
+    def killall(self):
+        with self.condition:
+            for attempts in self.attempts.values():
+                for attempt in attempts:
+                    attempt["killed"]="interrupted"
+                    attempt["runner"].kill()
+
+# A task worker runs tasks with its runner as the scheduler releases them until every task has finished
 # Input parameter is a thread id (tid)
-def taskworker(tid):
-    while not taskqueue.empty():
-        taskfile=taskqueue.get()
-
-        tasknum=taskfile.split("/",1)[1].split(".",1)[0].strip() 
-        tasknum=re.sub("\D", "", tasknum)
-        #print "tid=",tid
-        threadtasknums[tid]=int(tasknum)
-
-        # While there is a dependency problem (lower order task numbers are still being processed)
-        # then spintwait
-        mintasknum=min(threadtasknums)
-        while threadtasknums[tid]>mintasknum:
-            #print "min=",minthreadtasknum,"min(array)=",min(*threadtasknums),"nums[",i,"]=",threadtasknums[i]
-            #if(threadtasknums[tid]<=min(*threadtasknums)): # If this task number is less than or equal to the minimum 
-            #    break # then there are no dependencies, so you can break out of this infinite loop
-            time.sleep(1)  # this is a spin-wait loop
-            mintasknum=min(*threadtasknums)
-
-        print "Thread",tid,"running",taskfile,"at",str(datetime.datetime.now())
+def taskworker(tid,scheduler,runner,journal):
+    while True:
+        task=scheduler.next(runner)
+        if task==None:
+            break
+        print "Thread",tid,"running",task["id"],"at",str(datetime.datetime.now())
+        journal.record("start",task)
         try:
-            runtask(taskfile)
-        except:
-            exit(1)
-        taskqueue.task_done()
-    threadtasknums[tid]=999999 # Set the tasknum for tid to 9999 so it doesn't influence dependencies
-    print "Thread",tid,"quitting, because taskqueue is empty"
+            runner.run(task)
+            succeeded=True
+            returncode=0
+        except Exception as e:
+            error=e
+            succeeded=False
+            returncode=failedreturncode(e)
+            discardpartial(task,runner.pid)
+        journal.record("finish",task,returncode)
+        result=scheduler.finish(task,runner,succeeded,returncode,runner.usage)
+        if result=="lost":
+            print "Attempt of task",task["id"],"stopped, another attempt of the task finished first or is still running"
+        elif result=="retry":
+            print "Attempt of task",task["id"],"failed :",error,"(it is retried)"
+        elif result=="failed":
+            print " [ ERROR ] Task",task["id"],"failed :",error
+    runner.close()
+    print "Thread",tid,"quitting, because all tasks have finished"
+
+# A process launched by the event engine, it is the runner of one attempt of a task
+class ProcessLaunch(object):
+    def __init__(self,logdir):
+        self.logdir=logdir
+        self.process=None
+        self.timer=None
+        self.pid=None
+
+    def start(self,task):
+        self.process=starttask(task,self.logdir)
+        self.pid=self.process.pid
+
+    def kill(self):
+        if self.process!=None and self.timer==None:
+            self.timer=killgroup(self.process)
+
+# The event engine runs the tasks from a single thread, without a thread per task
+# It launches every task that fits, then sleeps in select until a child exits (SIGCHLD wakes it up
+# through a pipe), a retry is due or a second has passed, and reaps the exited children with wait4
+def runevents(scheduler,journal,maxtasks,logdir):
+    running={} # pid -> (task,launch)
+    wakeup=os.pipe()
+    for fd in wakeup:
+        fcntl.fcntl(fd,fcntl.F_SETFL,fcntl.fcntl(fd,fcntl.F_GETFL)|os.O_NONBLOCK)
+    signal.set_wakeup_fd(wakeup[1])
+    signal.signal(signal.SIGCHLD,lambda signum,frame: None)
+    lastwatch=time.time()
+    try:
+        while not scheduler.finished() or len(running)>0:
+            # Launch every ready task that fits
+            while len(running)<maxtasks:
+                launch=ProcessLaunch(logdir)
+                task=scheduler.trynext(launch)
+                if task==None:
+                    break
+                journal.record("start",task)
+                try:
+                    launch.start(task)
+                    running[launch.pid]=(task,launch)
+                except OSError as e:
+                    print " [ ERROR ] Task",task["id"],"failed to start :",e
+                    journal.record("finish",task,-1)
+                    scheduler.finish(task,launch,False,-1)
+
+            # Wait for a child to exit
+            timeout=1.0
+            if scheduler.nextdelay()!=None:
+                timeout=min(timeout,scheduler.nextdelay())
+            try:
+                if len(select.select([wakeup[0]],[],[],timeout)[0])>0:
+                    while True:
+                        os.read(wakeup[0],4096)
+            except (select.error,OSError):
+                pass # Interrupted by SIGCHLD or the wakeup pipe is drained
+
+            # Reap the children that exited
+            while len(running)>0:
+                try:
+                    pid,status,usage=os.wait4(-1,os.WNOHANG)
+                except OSError:
+                    break
+                if pid==0:
+                    break
+                if pid not in running:
+                    continue
+                task,launch=running.pop(pid)
+                canceltimer(launch.timer)
+                returncode=-os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+                launch.process.returncode=returncode
+                succeeded=returncode==0
+                if not succeeded:
+                    discardpartial(task,pid)
+                journal.record("finish",task,returncode)
+                result=scheduler.finish(task,launch,succeeded,returncode,rusageusage(usage))
+                if result=="lost":
+                    print "Attempt of task",task["id"],"stopped, another attempt of the task finished first or is still running"
+                elif result=="retry":
+                    print "Attempt of task",task["id"],"failed : returned",returncode,"(it is retried)"
+                elif result=="failed":
+                    print " [ ERROR ] Task",task["id"],"failed : returned",returncode
+
+            if time.time()-lastwatch>=1.0:
+                scheduler.watch()
+                lastwatch=time.time()
+    finally:
+        signal.signal(signal.SIGCHLD,signal.SIG_DFL)
+        signal.set_wakeup_fd(-1)
+
+# The thread engine runs each task from a thread (one per slot) that blocks while its task runs
+def runthreads(scheduler,journal,num_threads,cores,numberoftasks,workercommand,logdir):
+    # Each thread runs one task at a time and the scheduler only hands out tasks that fit in the free
+    # cores and memory, so there is no need for more threads than cores (or tasks)
+    num_threads=min(num_threads,cores,max(numberoftasks,1))
+    print "Starting ",num_threads," threads"
+    threads=[]
+    if workercommand!=None:
+        print "Running tasks in workers :",workercommand
+    for i in range(num_threads):
+        runner=ProcessRunner(logdir) if workercommand==None else WorkerRunner(workercommand)
+        t=threading.Thread(target=taskworker,args=(i,scheduler,runner,journal))
+        t.daemon=True
+        t.start()
+        threads.append(t)
+
+    # Now we wait until all of the tasks are finished.
+    print "Waiting for threads to finish"
+
+    # A blocking .join cannot be interrupted, so wait on the scheduler's done pipe instead,
+    # which is written on the last completion and lets a user kill this process with ^C
+    # Every second the scheduler checks for tasks past their timeout and for stragglers
+    try:
+        while len(select.select([scheduler.donepipe[0]],[],[],1.0)[0])==0:
+            scheduler.watch()
+    except KeyboardInterrupt:
+        print " [ ERROR ] Interrupted, killing the running tasks and quitting with unfinished tasks"
+        scheduler.killall()
+        sys.exit(1)
+
+    print "Joining threads"
+    for t in threads:
+        t.join()
 
 # Main program code
 def main():
     print "Starting node workflow"
 
+    usage="workflow.py -t <tasklist manifest> | -q <shared queue> [--lease=<seconds>] [-c <cores>] [--oversubscribe=<threads per core>] [-M <memory MB>] [-n <maximum number of concurrent tasks>] [-w <worker command>] [--journal=<journal>] [--resume]"
+    usage+=" [--retries=<retries per task>] [--backoff=<seconds>] [--timeout=<seconds per task>] [--speculate=<times the predicted runtime, 0 to disable>]"
+    usage+=" [--engine=events|threads] [--logs=<directory for the stdout and stderr of tasks>] [--accounting=<accounting file>]"
     try:
-        opts,args=getopt.getopt(sys.argv[1:],"n:t:",["numthreads=","tasklist="])
+        opts,args=getopt.getopt(sys.argv[1:],"n:t:q:c:M:w:",["numthreads=","tasklist=","queue=","lease=","cores=","oversubscribe=","memory=","worker=","journal=","resume","retries=","backoff=","timeout=","speculate=","engine=","logs=","accounting="])
     except getopt.GetoptError:
-        print "workflow.py -n <number of threads to launch> -t <tasklistfile>"
+        print usage
         sys.exit(1)
 
     # Set model filename and experiment name based on command-line parameter
-    num_threads=0
+    # The cores and memory of the node are detected unless given
+    num_threads=None
+    cores=None
+    oversubscribe=1 # Threads of tasks per core, more than 1 to use hyperthreading (see runexperiment.py --calibrate)
+    memory=None
+    workercommand=None # Tasks run in a new process each unless a worker command is given
     tasklistfile=""
+    queuefile="" # Tasks are pulled from a queue shared by the jobs instead of a tasklist (see generate-tasks.py --queue)
+    lease=600.0
+    journalfile=None # <tasklist>.journal by default
+    resume=False
+    retries=2 # Transient failures (JVM out of memory, filesystem hiccup) are retried
+    backoff=10.0
+    timeout=None # Tasks may also have their own "timeout"
+    speculate=3.0
+    engine=None # The event engine, unless tasks run in workers (a thread per worker)
+    logdir=None # <tasklist>.logs by default
+    accountingfile=None # <tasklist>.accounting.jsonl by default (see export-trace.py)
     for opt, arg in opts:
         if opt in ("-n", "--numthreads"):
             num_threads=int(arg)
         if opt in ("-t", "--tasklist"):
             tasklistfile=arg
+        if opt in ("-q", "--queue"):
+            queuefile=arg
+        if opt=="--lease":
+            lease=float(arg)
+        if opt in ("-c", "--cores"):
+            cores=int(arg)
+        if opt=="--oversubscribe":
+            oversubscribe=int(arg)
+        if opt in ("-M", "--memory"):
+            memory=int(arg)
+        if opt in ("-w", "--worker"):
+            workercommand=arg
+        if opt=="--journal":
+            journalfile=arg
+        if opt=="--resume":
+            resume=True
+        if opt=="--retries":
+            retries=int(arg)
+        if opt=="--backoff":
+            backoff=float(arg)
+        if opt=="--timeout":
+            timeout=float(arg)
+        if opt=="--speculate":
+            speculate=float(arg)
+        if opt=="--engine":
+            engine=arg
+        if opt=="--logs":
+            logdir=arg
+        if opt=="--accounting":
+            accountingfile=arg
+    if cores==None:
+        cores=detectcores()
+    cores*=oversubscribe
+    if memory==None:
+        memory=detectmemory()
+        if memory==None:
+            print " [ WARNING ] Could not detect the memory of the node, memory is not managed"
+            memory=sys.maxint
+    if num_threads==None:
+        num_threads=cores
     err=0
     if num_threads<=0:
-        print " [ ERROR ] Number of threads must be greater than 0"
+        print " [ ERROR ] Number of concurrent tasks must be greater than 0"
+        err=1
+    if cores<=0:
+        print " [ ERROR ] Number of cores and oversubscription must be greater than 0"
         err=1
-    if tasklistfile=="":
-        print " [ ERROR ] Must provide tasklistfile"
+    if memory<=0:
+        print " [ ERROR ] Memory must be greater than 0"
+        err=1
+    if retries<0 or backoff<0 or (timeout!=None and timeout<=0) or speculate<0:
+        print " [ ERROR ] Retries, backoff, timeout and speculate cannot be negative"
+        err=1
+    if engine==None:
+        engine="events" if workercommand==None else "threads"
+    if engine not in ("events","threads"):
+        print " [ ERROR ] Engine must be events or threads"
+        err=1
+    if engine=="events" and workercommand!=None:
+        print " [ ERROR ] Workers need the threads engine"
+        err=1
+    if (tasklistfile=="")==(queuefile==""):
+        print " [ ERROR ] Must provide either tasklistfile or queue"
+        err=1
+    if queuefile!="" and not os.path.exists(queuefile):
+        print " [ ERROR ] Queue not found :",queuefile
+        err=1
+    if queuefile!="" and resume:
+        print " [ ERROR ] --resume is for tasklists, a shared queue records the finished tasks itself"
         err=1
     if err==1:
-        print "workflow.py -n <number of threads to launch> -t <tasklistfile>"
+        print usage
         sys.exit(1)
 
     print "Executing in current directory :",os.getcwd()
 
-    print "Reading tasklist file"
-    with open(tasklistfile,'r') as f:
-        taskfiles = f.readlines()
-        f.close()
+    source=None
+    if queuefile!="":
+        # The files of each job are named after the queue, its host and its pid
+        print "Pulling tasks from the shared queue",queuefile
+        source=SharedQueue(queuefile,lease)
+        print "Tasks in the queue by state :",source.counts()
+        tasks=[]
+        tasklistfile=queuefile+"."+socket.gethostname()+"."+str(os.getpid())
+    else:
+        print "Reading tasklist file"
+        tasks=loadtasks(tasklistfile)
+        tasks.sort(key=lambda task: naturalkey(task["id"]))
 
+    if journalfile==None:
+        journalfile=tasklistfile+".journal"
+    if resume:
+        # Tasks that finished in an earlier run are left out (deps on them are met) and
+        # the partial outputs of the tasks that were interrupted or failed are discarded
+        finished=readjournal(journalfile)
+        print "Resuming from journal",journalfile,":",len(finished),"tasks already finished"
+        tasks=[task for task in tasks if task["id"] not in finished]
+        for task in tasks:
+            discardoutputs(task)
+    elif os.path.exists(journalfile):
+        print " [ WARNING ] Starting a new journal, use --resume to skip the tasks finished in",journalfile
+    journal=Journal(journalfile,resume)
+    if accountingfile==None:
+        accountingfile=tasklistfile+".accounting.jsonl"
+    accounting=Accounting(accountingfile)
 
-#    tasksdir = 'tasks/'
-#    taskfiles = os.listdir(tasksdir) # Contains a list of task files to process 
-    taskfiles.sort()
+    print "Node capacity :",cores,"cores",memory if memory!=sys.maxint else "unmanaged","MB memory"
+    for task in tasks:
+        if taskcores(task)>cores or taskmemory(task)>memory:
+            print " [ WARNING ] Task",task["id"],"needs",taskcores(task),"cores and",taskmemory(task),"MB, more than the node, it will run alone"
 
-    print "Starting task queue"
-    for taskfile in taskfiles:
-        taskqueue.put(taskfile.strip())
-    print "Task queue contains ",taskqueue.qsize()," tasks"
+    print "Starting scheduler"
+    scheduler=Scheduler(tasks,cores,memory,retries,backoff,timeout,speculate,accounting,source)
+    print "Scheduler contains ",len(tasks)," tasks"
 
-    # Start the workflow engine
-    # Currently the logic is simple -> one task==one thread==one core but that will need
-    # to be modified to account for multithreaded models (agent-based and climate)
-    # so eventually this will need to parse the task to determine the number of cores
-    # needed by the task and dynamically manage the number of tasks running simultaneously
-    print "Starting ",num_threads," threads"
-    for i in range(num_threads):
-        threadtasknums.append(-1)
-        t=threading.Thread(target=taskworker,args=(i,))
-        t.daemon=True
-        t.setDaemon(True)
-        t.start()
-        threads.append(t)
-
-    # Now we wait until all of the tasks are finished.
-    print "Waiting for threads to finish"
+    if logdir==None:
+        logdir=(queuefile if queuefile!="" else tasklistfile)+".logs"
+    if not os.path.isdir(logdir):
+        try:
+            os.makedirs(logdir)
+        except OSError: # Another job sharing the queue made it first
+            if not os.path.isdir(logdir):
+                raise
+    print "Writing the output of tasks to",logdir
 
-    # Normally you can use a blocking .join, but then you cannot kill the process
-    # So instead we spin-wait and catch ^C so a user can kill this process.
-#    while threading.activeCount() > 0:
-#        time.sleep(20)
-    while taskqueue.qsize()>0:
-        time.sleep(1)
-        print "taskqueue size",taskqueue.qsize()
-        ''' # FIXME: Need to clean up this code, which was used for testing ^C 
+    # Start the workflow engine
+    if engine=="events":
+        print "Running up to",num_threads,"tasks at a time with the event engine"
         try:
-            time.sleep(5) # Wait 5 seconds before checking again
-                          # FIXME: In production this should be changed to 30
-        # If Ctrl+C or other error, kill all of the threads
-        except:
-            while not taskqueue.empty(): # Empty the queue
-                taskqueue.get()
-            for i in threads:
-                i.kill_received=True
-                i.kill()
-            exit(1)
-        '''
-
-    print "Joining taskqueue"
-    # At this point all of the tasks should be finished so we join them
-    notfinished=1
-    while notfinished==1:
-        notfinished=0
-        for i in range(num_threads):
-            if threadtasknums[i]<999999:
-                notfinished=1
-                time.sleep(1)
-    #while not taskqueue.join(1):
-    #    time.sleep(1)
+            runevents(scheduler,journal,num_threads,logdir)
+        except KeyboardInterrupt:
+            print " [ ERROR ] Interrupted, killing the running tasks and quitting with unfinished tasks"
+            scheduler.killall()
+            sys.exit(1)
+    else:
+        # Tasks pulled from a queue are not known in advance, so only a tasklist bounds the threads
+        runthreads(scheduler,journal,num_threads,cores,len(tasks) if source==None else sys.maxint,workercommand,logdir)
+
+    if source!=None:
+        print "Tasks in the queue by state :",source.counts()
+    if len(scheduler.failed)>0:
+        print " [ ERROR ] Failed tasks :"," ".join(scheduler.failed)
+        print " [ ERROR ] Skipped tasks :",len(scheduler.skipped)
+        sys.exit(1)
     print "Finished node workflow"
 
 # Run main